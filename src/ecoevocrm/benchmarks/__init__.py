@@ -0,0 +1,7 @@
+# Reproducible benchmarks of the simulation hot paths; run `python -m ecoevocrm.benchmarks --help` for usage.
+# Scaling studies of run() (ecoevocrm.benchmarks.scaling) and golden-trajectory validation of alternative engines (ecoevocrm.benchmarks.golden)
+# run separately: `python -m ecoevocrm.benchmarks.scaling --help`, `python -m ecoevocrm.benchmarks.golden --help`.
+
+from ecoevocrm.benchmarks.runner import BENCHMARKS, benchmark, get_benchmarks, run_benchmark, run_benchmarks, save_results, load_results, compare_results, format_report
+import ecoevocrm.benchmarks.micro
+import ecoevocrm.benchmarks.macro
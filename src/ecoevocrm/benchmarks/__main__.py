@@ -0,0 +1,41 @@
+import sys
+import argparse
+
+import ecoevocrm.benchmarks as benchmarks
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ecoevocrm.benchmarks', description='Run the ecoevocrm benchmarks and optionally compare them against a saved baseline.')
+    parser.add_argument('pattern', nargs='?', default=None, help='run only benchmarks whose names match this pattern (substring or fnmatch-style glob)')
+    parser.add_argument('--group', choices=['micro', 'macro'], default=None, help='run only this group of benchmarks')
+    parser.add_argument('--repeat', type=int, default=None, help='number of timed repeats per benchmark (default: per-benchmark setting)')
+    parser.add_argument('--no-memory', action='store_true', help='skip measuring peak memory')
+    parser.add_argument('--save', metavar='PATH', default=None, help='save the results as JSON (e.g., to use as a baseline)')
+    parser.add_argument('--compare', metavar='PATH', default=None, help='compare against baseline results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='fractional change in median time reported as slower/faster (default: 0.1)')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 if any benchmark is slower than the baseline')
+    parser.add_argument('--list', action='store_true', help='list the matching benchmarks and exit')
+    args = parser.parse_args(argv)
+    #----------------------------------
+    if(args.list):
+        for bench in benchmarks.get_benchmarks(args.pattern, args.group):
+            print(f"{bench['group']:<6} {bench['name']}")
+        return 0
+    #----------------------------------
+    baseline = benchmarks.load_results(args.compare) if args.compare is not None else None
+    results  = benchmarks.run_benchmarks(args.pattern, args.group, repeat=args.repeat, measure_memory=(not args.no_memory),
+                                         callback=lambda result: print(f"  {result['name']} done", file=sys.stderr))
+    comparison = benchmarks.compare_results(results, baseline, tolerance=args.tolerance) if baseline is not None else None
+    print(benchmarks.format_report(results, comparison))
+    if(args.save is not None):
+        benchmarks.save_results(results, args.save)
+    #----------------------------------
+    if(args.fail_on_regression and comparison is not None and any(c['status'] == 'slower' for c in comparison.values())):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import contextlib
+import numpy as np
+
+from ecoevocrm.consumer_resource_system import *
+from ecoevocrm.resource_schedule import ResourceSchedule
+from ecoevocrm.benchmarks.scenarios import DEFAULT_SEED, make_system
+from ecoevocrm.cache import get_package_version
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Golden-trajectory regression harness: records reference trajectories, event sequences, and phylogenies of canonical
+# fixed-seed scenarios with the current implementation, and validates alternative engines (e.g., a compiled RHS, an analytic
+# Jacobian, another solver) against them with tolerance-aware trajectory metrics, reporting both accuracy and speed.
+# Run with `python -m ecoevocrm.benchmarks.golden --help`.
+
+DEFAULT_REFERENCE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ecoevocrm', 'golden')
+
+DEFAULT_TOLERANCES = {'event_time_rtol':    1e-3,  # event times match if |t - t_ref| <= atol + rtol*|t_ref|
+                      'event_time_atol':    1e-6,
+                      'log_abundance_rms':  5e-2,  # rms of |log(N + floor) - log(N_ref + floor)| over present types and sample times
+                      'log_abundance_max':  0.5,   # max of the same (establishment abundances 1/fitness are sensitive to event times,
+                      'abundance_floor':    1.0,   # so single types may be offset by more than solver tolerances)
+                      'resource_rtol':      1e-2}  # max |R - R_ref|/(|R_ref| + floor) over resources and sample times
+
+# Sample times per matched epoch at which trajectories are compared (at equal fractions of each run's own epoch):
+SAMPLES_PER_EPOCH = 4
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Canonical scenarios: {name: {'build': fn returning a fresh system, 'T': run duration, 'run_args': other run() args}}
+GOLDEN_SCENARIOS = {}
+
+
+def golden_scenario(name, T, run_args=None):
+    def register(build):
+        GOLDEN_SCENARIOS[name] = {'build': build, 'T': T, 'run_args': {} if run_args is None else run_args}
+        return build
+    return register
+
+
+def get_crossfeeding_matrix(L, seed=DEFAULT_SEED):
+    # Random column-stochastic conversion matrix with no self-conversion
+    D = np.random.RandomState(seed).uniform(size=(L, L))
+    np.fill_diagonal(D, 0)
+    return D/D.sum(axis=0, keepdims=True)
+
+
+@golden_scenario('fasteq', T=30)
+def build_fasteq():
+    return make_system(L=8, mu=1e-4)
+
+
+@golden_scenario('explicit', T=30)
+def build_explicit():
+    return make_system(L=8, mu=1e-4, resource_mode='explicit')
+
+
+@golden_scenario('crossfeeding_homotypes', T=30)
+def build_crossfeeding_homotypes():
+    return make_system(L=8, mu=1e-4, resource_mode='explicit', lamda=0.3, D=get_crossfeeding_matrix(8))
+
+
+@golden_scenario('crossfeeding_heterotypes', T=30)
+def build_crossfeeding_heterotypes():
+    lamda = np.random.RandomState(DEFAULT_SEED+1).uniform(0, 0.5, size=(4, 8))
+    return make_system(L=8, mu=1e-4, resource_mode='explicit', lamda=lamda, D=get_crossfeeding_matrix(8))
+
+
+@golden_scenario('temporal_rho', T=30)
+def build_temporal_rho():
+    return make_system(L=8, mu=1e-4, resource_mode='temporal')
+
+
+@golden_scenario('influx_breakpoints', T=12, run_args={'dt': 1})
+def build_influx_breakpoints():
+    # Piecewise constant influx whose breakpoints (epoch ends) fall off the dt grid of the run:
+    system = make_system(L=8, mu=1e-5)
+    values = np.random.RandomState(DEFAULT_SEED).uniform(0.5, 1.5, size=(8, 6))
+    system.resource_set.rho = ResourceSchedule(t=[0, 2.5, 5.5, 8.25, 10.75, 100], values=values, kind='constant')
+    return system
+
+
+@golden_scenario('mean_xi_mut', T=30)
+def build_mean_xi_mut():
+    rng   = np.random.RandomState(DEFAULT_SEED)
+    sigma = rng.randint(0, 2, size=(4, 8))
+    sigma[sigma.sum(axis=1) == 0, 0] = 1
+    np.random.seed(DEFAULT_SEED) # mutant costs are drawn when the type set generates its mutants
+    type_set = TypeSet(sigma=sigma, mu=1e-4, xi=np.full(4, 0.5), chi=0, kappa=1e3, mean_xi_mut=0.02)
+    return ConsumerResourceSystem(type_set=type_set, N_init=np.ones(4), R_init=np.ones(8), seed=DEFAULT_SEED)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Engine():
+
+    # An implementation of the dynamics to run scenarios with. While it runs, `patches` replace ConsumerResourceSystem class
+    # attributes (e.g., {'growth_rate': staticmethod(fast_growth_rate)}, or {'dynamics': compiled_dynamics}); `setup(system)`,
+    # if given, may modify (or return a replacement for) each freshly built system; and `run_args` are passed to run().
+
+    def __init__(self, name, patches=None, setup=None, run_args=None):
+        self.name     = name
+        self.patches  = {} if patches is None else patches
+        self.setup    = setup
+        self.run_args = {} if run_args is None else run_args
+
+    @contextlib.contextmanager
+    def activate(self):
+        # Originals are taken from the class __dict__, so that staticmethod wrappers are restored as they were:
+        originals = {attr: ConsumerResourceSystem.__dict__[attr] for attr in self.patches}
+        try:
+            for attr, replacement in self.patches.items():
+                setattr(ConsumerResourceSystem, attr, replacement)
+            yield self
+        finally:
+            for attr, original in originals.items():
+                setattr(ConsumerResourceSystem, attr, original)
+
+    def run_scenario(self, scenario_name):
+        # Returns (system after the run, wall time of the run)
+        scenario = GOLDEN_SCENARIOS[scenario_name]
+        system   = scenario['build']()
+        if(self.setup is not None):
+            system = self.setup(system) or system
+        with self.activate():
+            timer = time.perf_counter()
+            system.run(T=scenario['T'], **{**scenario['run_args'], **self.run_args})
+            wall_time = time.perf_counter() - timer
+        return (system, wall_time)
+
+
+REFERENCE_ENGINE = Engine('reference')
+
+# The current implementation integrating log abundances (validate with --engine ecoevocrm.benchmarks.golden:LOG_ABUNDANCE_ENGINE):
+LOG_ABUNDANCE_ENGINE = Engine('abundance_integration_mode=log',
+                              setup=lambda system: setattr(system, 'abundance_integration_mode', ConsumerResourceSystem.ABUNDANCE_INTEGRATION_LOG))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_trajectory_record(system):
+    # The parts of a finished run that engines are compared on; epochs are delimited by event_times (epoch end times)
+    # and epoch_end_indices (series column of each epoch's end state)
+    metrics = system.get_run_metrics()
+    return {'t_series':          system.t_series,
+            'N_series':          system.N_series,
+            'R_series':          system.R_series,
+            'event_times':       metrics['t_end'],
+            'event_types':       metrics['event'],
+            'epoch_end_indices': np.cumsum(metrics['num_recorded']),
+            'lineage_ids':       np.array(system.type_set.lineage_ids, dtype=str),
+            'sigma':             system.type_set.sigma,
+            'xi':                np.ravel(system.type_set.xi)}
+
+
+def record_references(reference_dir=DEFAULT_REFERENCE_DIR, scenarios=None, engine=REFERENCE_ENGINE):
+    # Runs the scenarios with the given (by default, the current) engine and saves their records as <reference_dir>/<scenario>.npz
+    os.makedirs(reference_dir, exist_ok=True)
+    scenarios = list(GOLDEN_SCENARIOS.keys()) if scenarios is None else utils.treat_as_list(scenarios)
+    for scenario_name in scenarios:
+        system, wall_time = engine.run_scenario(scenario_name)
+        metadata = {'scenario': scenario_name, 'T': GOLDEN_SCENARIOS[scenario_name]['T'], 'engine': engine.name, 'wall_time': wall_time,
+                    'ecoevocrm': get_package_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        np.savez_compressed(os.path.join(reference_dir, f"{scenario_name}.npz"), metadata=json.dumps(metadata), **get_trajectory_record(system))
+
+
+def load_reference(scenario_name, reference_dir=DEFAULT_REFERENCE_DIR):
+    path = os.path.join(reference_dir, f"{scenario_name}.npz")
+    if(not os.path.exists(path)):
+        utils.error(f"Error in load_reference(): no reference recorded for scenario '{scenario_name}' in {reference_dir} (see record_references()).")
+    with np.load(path) as saved:
+        reference = {key: saved[key] for key in saved.files}
+    reference['metadata'] = json.loads(str(reference['metadata']))
+    return reference
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_epoch_samples(record, num_epochs, type_order):
+    # log-abundance and resource samples at SAMPLES_PER_EPOCH equal fractions of each of the first num_epochs epochs
+    # (so that samples fall on the same side of events in runs whose event times differ slightly);
+    # type_order: row of each compared type in this record's N_series (-1 for types absent from this record)
+    fractions  = np.arange(1, SAMPLES_PER_EPOCH+1)/SAMPLES_PER_EPOCH
+    t_series   = np.ravel(record['t_series'])
+    epoch_ends = np.concatenate([[0], record['epoch_end_indices'][:num_epochs]])
+    N_samples, R_samples = [], []
+    for k in range(num_epochs):
+        cols = slice(epoch_ends[k], epoch_ends[k+1]+1)
+        t_epoch  = t_series[cols]
+        t_sample = t_epoch[0] + fractions*(t_epoch[-1] - t_epoch[0])
+        N_epoch  = np.vstack([record['N_series'][:, cols], np.zeros((1, len(t_epoch)))])[type_order] # row -1 is all zeros
+        N_samples.append(np.array([np.interp(t_sample, t_epoch, N_type) for N_type in N_epoch]).reshape(len(type_order), -1))
+        R_samples.append(np.array([np.interp(t_sample, t_epoch, R_resource) for R_resource in record['R_series'][:, cols]]))
+    if(num_epochs == 0):
+        return (np.zeros((len(type_order), 0)), np.zeros((record['R_series'].shape[0], 0)))
+    return (np.hstack(N_samples), np.hstack(R_samples))
+
+
+def get_lineage_births(record):
+    # {(lineage id, phenotype, cost): epoch at whose end the lineage was established (-1 for initial types)}
+    first_cols   = np.argmax(record['N_series'] != 0, axis=1)
+    birth_epochs = np.where(first_cols > 0, np.searchsorted(record['epoch_end_indices'], first_cols), -1)
+    per_type_xi  = (len(record['xi']) == len(record['lineage_ids']))
+    return {(lineage_id, record['sigma'][i].tobytes(), record['xi'][i] if per_type_xi else None): birth_epochs[i] for i, lineage_id in enumerate(record['lineage_ids'])}
+
+
+def compare_to_reference(record, reference, tolerances=None):
+    tol = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+    #----------------------------------
+    # Events: the matched prefix of the epoch sequence, in which event types agree and event times are within tolerance:
+    num_events, num_events_ref = len(record['event_times']), len(reference['event_times'])
+    num_common = min(num_events, num_events_ref)
+    time_errors = np.abs(record['event_times'][:num_common] - reference['event_times'][:num_common])
+    matches = (record['event_types'][:num_common] == reference['event_types'][:num_common]) & (time_errors <= tol['event_time_atol'] + tol['event_time_rtol']*np.abs(reference['event_times'][:num_common]))
+    events_prefix = int(np.argmin(matches)) if not np.all(matches) else num_common
+    #----------------------------------
+    # Phylogenies: the same lineages, with the same phenotypes, must have been established in the same epochs;
+    # the epoch sequence stops matching at the first epoch where they were not. Only lineages established within the
+    # matched event prefix are compared (after the events diverge, the phylogenies are expected to differ as well):
+    births, births_ref = get_lineage_births(record), get_lineage_births(reference)
+    divergent_epochs   = [births[key] for key in births.keys() - births_ref.keys()] + [births_ref[key] for key in births_ref.keys() - births.keys()]
+    divergent_epochs  += [births[key] for key in births.keys() & births_ref.keys() if births[key] != births_ref[key]]
+    phylogeny_matched  = all(epoch >= events_prefix for epoch in divergent_epochs)
+    events_matched     = max(0, min([events_prefix] + divergent_epochs)) # (initial types that differ have birth epoch -1)
+    #----------------------------------
+    lineage_ids, lineage_ids_ref = list(record['lineage_ids']), list(reference['lineage_ids'])
+    ref_rows = {lineage_id: i for i, lineage_id in enumerate(lineage_ids_ref)}
+    # Trajectories, over the matched epochs, with types aligned by lineage id:
+    all_lineages = lineage_ids_ref + [lineage_id for lineage_id in lineage_ids if lineage_id not in ref_rows]
+    rows     = {lineage_id: i for i, lineage_id in enumerate(lineage_ids)}
+    N, R         = get_epoch_samples(record, events_matched, np.array([rows.get(lineage_id, -1) for lineage_id in all_lineages]))
+    N_ref, R_ref = get_epoch_samples(reference, events_matched, np.array([ref_rows.get(lineage_id, -1) for lineage_id in all_lineages]))
+    log_abundance_errors = np.abs(np.log(np.maximum(N, 0) + tol['abundance_floor']) - np.log(np.maximum(N_ref, 0) + tol['abundance_floor']))[(N > 0) | (N_ref > 0)]
+    resource_errors      = np.abs(R - R_ref)/(np.abs(R_ref) + tol['abundance_floor'])
+    # (errors are None when no epochs matched, as there was nothing to compare)
+    max_log_abundance_error = float(log_abundance_errors.max()) if log_abundance_errors.size > 0 else 0.0 if events_matched > 0 else None
+    rms_log_abundance_error = float(np.sqrt(np.mean(log_abundance_errors**2))) if log_abundance_errors.size > 0 else 0.0 if events_matched > 0 else None
+    max_resource_error      = float(resource_errors.max()) if resource_errors.size > 0 else 0.0 if events_matched > 0 else None
+    #----------------------------------
+    return {'num_events': num_events, 'num_events_ref': num_events_ref, 'events_matched': events_matched,
+            'max_event_time_error': float(time_errors[:events_matched].max()) if events_matched > 0 else None,
+            'phylogeny_matched': phylogeny_matched, 'num_lineages': len(lineage_ids), 'num_lineages_ref': len(lineage_ids_ref),
+            'max_log_abundance_error': max_log_abundance_error, 'rms_log_abundance_error': rms_log_abundance_error,
+            'max_resource_error': max_resource_error,
+            'passed': bool(events_matched == num_events == num_events_ref > 0 and phylogeny_matched
+                           and rms_log_abundance_error <= tol['log_abundance_rms'] and max_log_abundance_error <= tol['log_abundance_max']
+                           and max_resource_error <= tol['resource_rtol'])}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def validate_engine(engine, reference_dir=DEFAULT_REFERENCE_DIR, scenarios=None, tolerances=None, time_reference=True):
+    # Runs each scenario with the engine and compares it to the recorded reference. Speedups are relative to the current
+    # implementation timed in this session (time_reference=True) or to the wall time stored with the reference.
+    scenarios = list(GOLDEN_SCENARIOS.keys()) if scenarios is None else utils.treat_as_list(scenarios)
+    results = {}
+    for scenario_name in scenarios:
+        reference = load_reference(scenario_name, reference_dir)
+        system, wall_time = engine.run_scenario(scenario_name)
+        reference_wall_time = REFERENCE_ENGINE.run_scenario(scenario_name)[1] if time_reference else reference['metadata']['wall_time']
+        results[scenario_name] = {**compare_to_reference(get_trajectory_record(system), reference, tolerances),
+                                  'engine': engine.name, 'wall_time': wall_time, 'reference_wall_time': reference_wall_time,
+                                  'speedup': reference_wall_time/wall_time if wall_time > 0 else np.inf}
+    return results
+
+
+def format_error(error, width):
+    # Errors that could not be computed (no matched epochs) are shown as '-'
+    return f"{error:>{width}.2e}" if error is not None else f"{'-':>{width}}"
+
+
+def format_validation_report(results):
+    lines = [f"{'scenario':<26} {'result':<6} {'events':>9} {'max dt_event':>12} {'rms dlogN':>10} {'max dlogN':>10} {'max dR':>9} {'phylogeny':>9} {'time':>9} {'speedup':>8}"]
+    for scenario_name, result in results.items():
+        lines.append(f"{scenario_name:<26} {('pass' if result['passed'] else 'FAIL'):<6} {result['events_matched']:>4}/{result['num_events_ref']:<4} "
+                     f"{format_error(result['max_event_time_error'], 12)} {format_error(result['rms_log_abundance_error'], 10)} {format_error(result['max_log_abundance_error'], 10)} {format_error(result['max_resource_error'], 9)} "
+                     f"{('match' if result['phylogeny_matched'] else 'differ'):>9} {result['wall_time']:>8.3f}s {result['speedup']:>7.2f}x")
+    return '\n'.join(lines)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def load_engine(spec):
+    # 'module.path:attribute' naming an Engine instance (or a callable returning one)
+    module_name, attr = spec.split(':')
+    engine = getattr(importlib.import_module(module_name), attr)
+    # (duck-typed, since under `python -m ecoevocrm.benchmarks.golden` this module's Engine is __main__.Engine, not the one imported by engine modules)
+    return engine if hasattr(engine, 'run_scenario') else engine()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ecoevocrm.benchmarks.golden', description='Record golden reference trajectories, or validate engines against them.')
+    parser.add_argument('command', choices=['record', 'validate', 'list'])
+    parser.add_argument('--dir', default=DEFAULT_REFERENCE_DIR, help=f"reference directory (default: {DEFAULT_REFERENCE_DIR})")
+    parser.add_argument('--scenario', nargs='+', choices=list(GOLDEN_SCENARIOS.keys()), default=None, help='scenarios to record/validate (default: all)')
+    parser.add_argument('--engine', nargs='+', default=[], metavar='MODULE:ATTR', help='engines to validate (default: the current implementation)')
+    parser.add_argument('--integration-method', nargs='+', default=[], metavar='METHOD', help='also validate the current implementation run with these solve_ivp methods')
+    parser.add_argument('--stored-times', action='store_true', help='compute speedups against the wall times stored with the references instead of timing the current implementation')
+    args = parser.parse_args(argv)
+    #----------------------------------
+    if(args.command == 'list'):
+        for scenario_name, scenario in GOLDEN_SCENARIOS.items():
+            print(f"{scenario_name:<26} T={scenario['T']}")
+        return 0
+    elif(args.command == 'record'):
+        record_references(args.dir, args.scenario)
+        print(f"Recorded {len(args.scenario or GOLDEN_SCENARIOS)} reference trajectories in {args.dir}")
+        return 0
+    #----------------------------------
+    engines  = [load_engine(spec) for spec in args.engine]
+    engines += [Engine(f"integration_method={method}", run_args={'integration_method': method}) for method in args.integration_method]
+    engines  = engines if len(engines) > 0 else [REFERENCE_ENGINE]
+    all_passed = True
+    for engine in engines:
+        results = validate_engine(engine, args.dir, args.scenario, time_reference=(not args.stored_times))
+        print(f"Engine: {engine.name}")
+        print(format_validation_report(results))
+        all_passed = all_passed and all(result['passed'] for result in results.values())
+    return 0 if all_passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+import numpy as np
+
+import ecoevocrm.coarse_graining as cg
+import ecoevocrm.strain_pool as strain_pool
+from ecoevocrm.benchmarks.runner import benchmark
+from ecoevocrm.benchmarks.scenarios import DEFAULT_SEED, RUN_SCENARIOS, LONG_RUN_SCENARIOS, make_system, get_long_trajectory
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Macrobenchmarks of whole simulations and of analyses of a canned long trajectory.
+
+
+for scenario_name, (system_args, T) in RUN_SCENARIOS.items():
+    @benchmark(f"run_{scenario_name}", group='macro', setup=(lambda system_args=system_args, T=T: (make_system(**system_args), T)), repeat=3)
+    def bench_run(system, T):
+        system.run(T=T)
+
+
+# The same runs (and longer ones) with the default integrator and with the integrator policy (run(integration_method='auto')):
+for scenario_name, (system_args, T) in {**RUN_SCENARIOS, **LONG_RUN_SCENARIOS}.items():
+    if(scenario_name in LONG_RUN_SCENARIOS):
+        @benchmark(f"run_{scenario_name}", group='macro', setup=(lambda system_args=system_args, T=T: (make_system(**system_args), T)), repeat=3)
+        def bench_run(system, T):
+            system.run(T=T)
+    @benchmark(f"run_auto_{scenario_name}", group='macro', setup=(lambda system_args=system_args, T=T: (make_system(**system_args), T)), repeat=3)
+    def bench_run_auto(system, T):
+        system.run(T=T, integration_method='auto')
+
+
+def get_strain_pool_args():
+    np.random.seed(DEFAULT_SEED)
+    return (make_system(L=8, mu=1e-5),)
+
+
+@benchmark('generate_strain_pool', group='macro', setup=get_strain_pool_args, repeat=3)
+def bench_generate_strain_pool(orig_system):
+    strain_pool.generate_strain_pool(orig_system, rep_communities=5, run_T=20,
+                                     perturbation_args={'param': 'kappa', 'dist': 'normal', 'args': {'mean': 0, 'std': 0.1}, 'mode': 'multiplicative_proportional', 'element_wise': True})
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_trajectory_args():
+    return (get_long_trajectory(),)
+
+
+@benchmark('cg_phylogenetic_group_abundance_series', group='macro', setup=get_trajectory_args, repeat=5)
+def bench_phylogenetic_group_abundance_series(system):
+    cg.get_phylogenetic_group_abundance_series(system, phylogeny_depth=2)
+
+
+@benchmark('cg_functional_group_abundance_series', group='macro', setup=get_trajectory_args, repeat=5)
+def bench_functional_group_abundance_series(system):
+    cg.get_functional_group_abundance_series(system, trait_subset=range(6))
+
+
+@benchmark('cg_Lstar_types_series', group='macro', setup=get_trajectory_args, repeat=5)
+def bench_Lstar_types_series(system):
+    cg.get_Lstar_types_series(system)
+
+
+@benchmark('cg_phylogenetic_group_turnover_series', group='macro', setup=get_trajectory_args, repeat=5)
+def bench_phylogenetic_group_turnover_series(system):
+    cg.phylogenetic_group_turnover_series(system, phylogeny_depth=2, t0=np.linspace(0, system.t/2, 500), lag=system.t/2)
+
+
+@benchmark('cg_functional_group_diversity', group='macro', setup=get_trajectory_args, repeat=5)
+def bench_functional_group_diversity(system):
+    for t_index in range(0, len(system.t_series), 100):
+        cg.functional_group_diversity(system, trait_subset=range(6), t_index=t_index)
@@ -0,0 +1,107 @@
+import numpy as np
+
+from ecoevocrm.consumer_resource_system import *
+from ecoevocrm.benchmarks.runner import benchmark
+from ecoevocrm.benchmarks.scenarios import DEFAULT_SEED, TEMPORAL_HORIZON, get_midrun_system, get_long_trajectory
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Microbenchmarks of single steps of the simulation, on systems partway into their evolution.
+
+
+def get_rhs_args(L):
+    # Arguments for one evaluation of the dynamics, as run() sets them up for the system's current state
+    system = get_midrun_system(L)
+    system._active_type_indices = system.extant_type_indices
+    params = system.get_dynamics_params(system._active_type_indices)
+    y      = np.concatenate([system.N[system._active_type_indices], system.R, [0]])
+    return (system, y, params)
+
+
+for L in [16, 32]:
+    @benchmark(f"dynamics_L{L}", group='micro', setup=(lambda L=L: get_rhs_args(L)), number=200, repeat=7)
+    def bench_dynamics(system, y, params):
+        system.dynamics(system.t, y, *params)
+
+
+def get_temporal_rhs_args(L=16):
+    # As get_rhs_args(), with the midrun system's influx replaced by a time-varying one (converted to a ResourceSchedule by ResourceSet)
+    system, y, params = get_rhs_args(L)
+    system = system.clone()
+    system.resource_set.rho = utils.sinusoid_series(T=TEMPORAL_HORIZON, dt=0.1, amplitude=0.5, shift=1, L=L)
+    params = system.get_dynamics_params(system._active_type_indices)
+    return (system, y, params)
+
+
+@benchmark('dynamics_L16_temporal', group='micro', setup=get_temporal_rhs_args, number=200, repeat=7)
+def bench_dynamics_temporal(system, y, params):
+    system.dynamics(system.t, y, *params)
+
+
+def get_sinusoid_rhs_args(L=16):
+    # As get_temporal_rhs_args(), with the same influx evaluated analytically (ResourceSet alpha/theta/phi)
+    system, y, params = get_rhs_args(L)
+    system = system.clone()
+    system.resource_set.alpha = np.full(L, 0.5)
+    system.resource_set.theta = np.full(L, 2*np.pi)
+    params = system.get_dynamics_params(system._active_type_indices)
+    return (system, y, params)
+
+
+@benchmark('dynamics_L16_sinusoid', group='micro', setup=get_sinusoid_rhs_args, number=200, repeat=7)
+def bench_dynamics_sinusoid(system, y, params):
+    system.dynamics(system.t, y, *params)
+
+
+def get_growth_rate_args(L=32):
+    system, y, params = get_rhs_args(L)
+    params = system.get_dynamics_params(system._active_type_indices, as_dict=True)
+    N = np.zeros(params['num_types'] + params['num_mutants'])
+    N[:params['num_types']] = system.N[system._active_type_indices]
+    return (N, system.R, system.t, params)
+
+
+@benchmark('growth_rate_L32', group='micro', setup=get_growth_rate_args, number=200, repeat=7)
+def bench_growth_rate(N, R, t, p):
+    ConsumerResourceSystem.growth_rate(N, R, t, p['sigma'], p['beta'], p['kappa'], p['eta'], p['lamda'], p['gamma'], p['rho'], p['tau'], p['omega'], p['alpha'], p['theta'], p['phi'], p['M'], p['energy_costs'],
+                                       p['resource_dynamics_mode'], p['resource_influx_mode'], p['resource_crossfeeding_mode'],
+                                       uptake_coeffs=p['uptake_coeffs'], consumption_coeffs=p['consumption_coeffs'], resource_decay_rate=p['resource_decay_rate'])
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+@benchmark('generate_mutant_set', group='micro', setup=(lambda: (get_long_trajectory().type_set,)), number=5, repeat=5)
+def bench_generate_mutant_set(type_set):
+    type_set.generate_mutant_set()
+
+
+def get_add_type_args():
+    np.random.seed(DEFAULT_SEED)
+    system = get_long_trajectory().clone(history=True)
+    parent_index = np.argmax(system.N)
+    mutant = system.mutant_set.get_type(system.type_set.get_mutant_indices(parent_index)[0])
+    return (system, mutant, parent_index)
+
+
+@benchmark('add_type', group='micro', setup=get_add_type_args, repeat=20)
+def bench_add_type(system, mutant, parent_index):
+    system.add_type(mutant, abundance=1, parent_index=parent_index)
+
+
+@benchmark('reorder_types', group='micro', setup=(lambda: (get_long_trajectory().clone(history=True), np.random.RandomState(DEFAULT_SEED).permutation(get_long_trajectory().num_types))), repeat=10)
+def bench_reorder_types(system, order):
+    system.reorder_types(order)
+
+
+@benchmark('handle_type_loss', group='micro', setup=(lambda: (get_long_trajectory().clone(history=True),)), repeat=20)
+def bench_handle_type_loss(system):
+    system.handle_type_loss()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# One brownian environment, with the parameters generate_strain_pool_brownian_envs() uses for every replicate community (at dt=1 over T=3e5):
+@benchmark('brownian_series_L16', group='micro', setup=(lambda: (np.random.seed(DEFAULT_SEED),)), repeat=5)
+def bench_brownian_series(_):
+    utils.brownian_series(T=3e5, dt=1, L=16, lamda=1e-3, eta_mean=0, eta_std=1e-8, k=1e-8, y0=1, v0=0, return_interp=False)
@@ -0,0 +1,154 @@
+import gc
+import sys
+import json
+import time
+import fnmatch
+import platform
+import tracemalloc
+import numpy as np
+import scipy
+
+from ecoevocrm.cache import get_package_version
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Registry of benchmarks: {name: {'name', 'group', 'fn', 'setup', 'number', 'repeat'}}
+BENCHMARKS = {}
+
+# Increment when the meaning of stored results changes, so that old baselines are not compared against:
+RESULTS_FORMAT_VERSION = 1
+
+
+def benchmark(name, group, setup=None, number=1, repeat=5):
+    # Decorator registering fn as a benchmark. Each repeat calls setup() (untimed; returns a tuple of args for fn,
+    # e.g., a fresh copy of any state that fn modifies) and then times `number` consecutive calls of fn(*args).
+    def register(fn):
+        if(name in BENCHMARKS):
+            utils.error(f"Error in benchmark(): a benchmark named '{name}' is already registered.")
+        BENCHMARKS[name] = {'name': name, 'group': group, 'fn': fn, 'setup': setup, 'number': number, 'repeat': repeat}
+        return fn
+    return register
+
+
+def get_benchmarks(pattern=None, group=None):
+    # Registered benchmarks whose names match the (fnmatch-style) pattern and that belong to the given group(s)
+    groups = utils.treat_as_list(group) if group is not None else None
+    return [bench for name, bench in BENCHMARKS.items()
+                if (pattern is None or fnmatch.fnmatch(name, pattern) or pattern in name) and (groups is None or bench['group'] in groups)]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def run_benchmark(bench, repeat=None, number=None, measure_memory=True):
+    # Returns per-call timing statistics (seconds) over the repeats, and the peak memory (bytes) allocated during one call
+    repeat = bench['repeat'] if repeat is None else repeat
+    number = bench['number'] if number is None else number
+    #----------------------------------
+    times = []
+    for r in range(repeat):
+        args = bench['setup']() if bench['setup'] is not None else ()
+        gc.collect()
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            timer = time.perf_counter()
+            for i in range(number):
+                bench['fn'](*args)
+            times.append((time.perf_counter() - timer)/number)
+        finally:
+            if(gc_enabled):
+                gc.enable()
+    times = np.array(times)
+    #----------------------------------
+    # Memory is traced in a separate call, since tracing slows down allocation-heavy code:
+    peak_memory = None
+    if(measure_memory):
+        args = bench['setup']() if bench['setup'] is not None else ()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            bench['fn'](*args)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    #----------------------------------
+    return {'name': bench['name'], 'group': bench['group'], 'repeat': repeat, 'number': number,
+            'min': float(times.min()), 'median': float(np.median(times)), 'mean': float(times.mean()), 'std': float(times.std()),
+            'peak_memory': peak_memory}
+
+
+def run_benchmarks(pattern=None, group=None, repeat=None, measure_memory=True, callback=None):
+    # Runs the matching benchmarks; returns {name: result}. callback(result), if given, is called as each benchmark finishes.
+    results = {}
+    for bench in get_benchmarks(pattern, group):
+        results[bench['name']] = run_benchmark(bench, repeat=repeat, measure_memory=measure_memory)
+        if(callback is not None):
+            callback(results[bench['name']])
+    return results
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_environment_info():
+    return {'ecoevocrm': get_package_version(), 'python': sys.version.split()[0], 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def save_results(results, path):
+    with open(path, 'w') as outfile:
+        json.dump({'format_version': RESULTS_FORMAT_VERSION, 'environment': get_environment_info(), 'results': results}, outfile, indent=2)
+
+
+def load_results(path):
+    with open(path) as infile:
+        saved = json.load(infile)
+    if(saved.get('format_version') != RESULTS_FORMAT_VERSION):
+        utils.error(f"Error in load_results(): results in {path} have format version {saved.get('format_version')} (expected {RESULTS_FORMAT_VERSION}).")
+    return saved
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def compare_results(results, baseline, tolerance=0.1):
+    # Compares median times and peak memory against a baseline (as returned by load_results(), or a {name: result} dict).
+    # A benchmark is 'slower'/'faster' if its median time changed by more than the given fraction, else 'same'.
+    baseline_results = baseline['results'] if 'results' in baseline else baseline
+    comparison = {}
+    for name, result in results.items():
+        if(name not in baseline_results):
+            continue
+        base = baseline_results[name]
+        time_ratio   = result['median']/base['median'] if base['median'] > 0 else np.inf
+        memory_ratio = result['peak_memory']/base['peak_memory'] if (result['peak_memory'] is not None and base['peak_memory']) else None
+        status = 'slower' if time_ratio > 1 + tolerance else 'faster' if time_ratio < 1/(1 + tolerance) else 'same'
+        comparison[name] = {'time_ratio': time_ratio, 'memory_ratio': memory_ratio, 'status': status}
+    return comparison
+
+
+def format_bytes(num_bytes):
+    if(num_bytes is None):
+        return '-'
+    for unit in ['B', 'KiB', 'MiB']:
+        if(num_bytes < 1024):
+            return f"{num_bytes:.0f} {unit}" if unit == 'B' else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GiB"
+
+
+def format_time(seconds):
+    for unit, scale in [('s', 1), ('ms', 1e-3), ('us', 1e-6)]:
+        if(seconds >= scale):
+            return f"{seconds/scale:.3g} {unit}"
+    return f"{seconds/1e-9:.3g} ns"
+
+
+def format_report(results, comparison=None):
+    lines = [f"{'benchmark':<40} {'median':>10} {'min':>10} {'peak mem':>11}" + (f" {'vs base':>8}  status" if comparison is not None else '')]
+    for name, result in results.items():
+        line = f"{name:<40} {format_time(result['median']):>10} {format_time(result['min']):>10} {format_bytes(result['peak_memory']):>11}"
+        if(comparison is not None):
+            line += f" {comparison[name]['time_ratio']:>7.2f}x  {comparison[name]['status']}" if name in comparison else f" {'-':>8}  new"
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,212 @@
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+from ecoevocrm.consumer_resource_system import *
+from ecoevocrm.benchmarks.runner import get_environment_info
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Scaling study of ConsumerResourceSystem.run(): sweeps the number of traits (L), the number of initial types, and the mutation
+# rate one at a time around a base point, for fasteq and explicit resources, and fits empirical scaling exponents
+# (slopes of log-log fits) of wall time, RHS evaluations, epochs, and peak memory in each dimension.
+# Run with `python -m ecoevocrm.benchmarks.scaling --help`.
+
+DEFAULT_BASE_POINT = {'L': 8, 'num_types': 8, 'mu': 1e-5, 'T': 20}
+
+DEFAULT_SWEEPS = {'L':         [4, 8, 16, 32],
+                  'num_types': [4, 8, 16, 32, 64],
+                  'mu':        [1e-7, 1e-6, 1e-5, 1e-4]}
+
+QUICK_SWEEPS   = {'L':         [4, 8, 16],
+                  'num_types': [4, 8, 16],
+                  'mu':        [1e-6, 1e-5, 1e-4]}
+
+DEFAULT_RESOURCE_MODES = ['fasteq', 'explicit']
+
+SCALING_METRICS = ['wall_time', 'nfev', 'num_epochs', 'peak_rss_increase']
+
+# Swept dimensions whose realized value can differ from the requested one are fit against the realized value instead
+# (e.g., the number of distinct phenotypes is capped by L, and types go extinct or arise by mutation during the run):
+SCALING_COVARIATES = {'num_types': 'mean_extant_types'}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def make_scaling_system(L, num_types, mu, resource_mode='fasteq', seed=0, J_0=0.2):
+    # Synthetic system with num_types distinct phenotypes drawn from the binary combinations of L traits
+    # (or drawn at random, for L too large to enumerate) and a random tikhonov_sigmoid trait interaction matrix J
+    rng = np.random.RandomState(seed)
+    if(L <= 16):
+        phenotypes = utils.binary_combinations(L, exclude_all_zeros=True)
+        sigma = phenotypes[rng.choice(len(phenotypes), size=min(num_types, len(phenotypes)), replace=False)]
+    else:
+        sigma = rng.randint(0, 2, size=(num_types, L))
+        sigma[sigma.sum(axis=1) == 0, 0] = 1
+        sigma = np.unique(sigma, axis=0)
+    J = utils.random_matrix((L, L), mode='tikhonov_sigmoid', args={'J_0': J_0}, seed=seed)
+    #----------------------------------
+    return ConsumerResourceSystem(sigma=sigma, N_init=np.ones(sigma.shape[0]), R_init=np.ones(L), mu=mu, xi=0.1, chi=0, J=J, kappa=1e3,
+                                  resource_dynamics_mode=resource_mode, seed=seed)
+
+
+def get_scaling_design(base_point=None, sweeps=None, resource_modes=None):
+    # One-at-a-time design: for each resource mode and swept dimension, the base point with that dimension varied
+    base_point     = DEFAULT_BASE_POINT if base_point is None else {**DEFAULT_BASE_POINT, **base_point}
+    sweeps         = DEFAULT_SWEEPS if sweeps is None else sweeps
+    resource_modes = DEFAULT_RESOURCE_MODES if resource_modes is None else utils.treat_as_list(resource_modes)
+    #----------------------------------
+    return [{**base_point, dim: val, 'resource_mode': resource_mode, 'sweep': dim}
+                for resource_mode in resource_modes for dim, vals in sweeps.items() for val in vals]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_peak_rss():
+    # Peak resident set size of the current process in bytes (None where unavailable, e.g., on Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss*1024
+
+
+def run_scaling_point(point):
+    peak_rss_baseline = get_peak_rss()
+    system = make_scaling_system(point['L'], point['num_types'], point['mu'], resource_mode=point['resource_mode'], seed=point.get('seed', 0))
+    num_types_initial = system.num_types
+    timer  = time.perf_counter()
+    system.run(T=point['T'])
+    wall_time = time.perf_counter() - timer
+    #----------------------------------
+    metrics  = system.get_run_metrics()
+    peak_rss = get_peak_rss()
+    return {**point, 'wall_time': wall_time, 'nfev': int(metrics['nfev'].sum()), 'num_epochs': len(metrics),
+            'mean_extant_types': float(metrics['num_extant_types'].mean()), 'num_types_initial': num_types_initial, 'num_types_final': system.num_types,
+            'peak_rss': peak_rss, 'peak_rss_increase': (peak_rss - peak_rss_baseline) if peak_rss is not None else None}
+
+
+def run_scaling_study(design=None, isolate=True, callback=None):
+    # Runs each point of the design (default: get_scaling_design()). With isolate=True, every point runs in a fresh process,
+    # so that its peak RSS is its own (in-process, the peak only ever grows and peak_rss_increase is mostly 0).
+    design  = get_scaling_design() if design is None else design
+    results = []
+    for point in design:
+        if(isolate):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_scaling_point, point).result()
+        else:
+            result = run_scaling_point(point)
+        results.append(result)
+        if(callback is not None):
+            callback(result)
+    return results
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def fit_scaling_exponent(x, y):
+    # Least-squares fit of log y = exponent * log x + log prefactor over the points with positive x and y
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    valid = (x > 0) & (y > 0)
+    if(np.count_nonzero(valid) < 2 or len(np.unique(x[valid])) < 2):
+        return None
+    log_x, log_y = np.log(x[valid]), np.log(y[valid])
+    exponent, log_prefactor = np.polyfit(log_x, log_y, 1)
+    residuals = log_y - (exponent*log_x + log_prefactor)
+    r2 = 1 - np.sum(residuals**2)/np.sum((log_y - log_y.mean())**2) if np.ptp(log_y) > 0 else 1.0
+    return {'exponent': float(exponent), 'prefactor': float(np.exp(log_prefactor)), 'r2': float(r2)}
+
+
+def fit_scaling_exponents(results, metrics=None):
+    # Returns {'<resource_mode>/<swept dimension>': {metric: fit (or None)}}; fits are against the realized value of
+    # the swept dimension where it is given in SCALING_COVARIATES
+    metrics = SCALING_METRICS if metrics is None else metrics
+    exponents = {}
+    for key in dict.fromkeys(f"{result['resource_mode']}/{result['sweep']}" for result in results):
+        resource_mode, dim = key.split('/')
+        sweep_results = [result for result in results if result['resource_mode'] == resource_mode and result['sweep'] == dim]
+        exponents[key] = {metric: fit_scaling_exponent([result[SCALING_COVARIATES.get(dim, dim)] for result in sweep_results], [(result[metric] if result[metric] is not None else np.nan) for result in sweep_results])
+                            for metric in metrics}
+    return exponents
+
+
+def compare_exponents(exponents, baseline_exponents, tolerance=0.25):
+    # Flags scaling exponents that grew by more than tolerance relative to a baseline (e.g., from a previous report's 'exponents')
+    comparison = []
+    for key, fits in exponents.items():
+        for metric, fit in fits.items():
+            baseline_fit = baseline_exponents.get(key, {}).get(metric)
+            if(fit is None or baseline_fit is None):
+                continue
+            change = fit['exponent'] - baseline_fit['exponent']
+            status = 'steeper' if change > tolerance else 'shallower' if change < -tolerance else 'same'
+            comparison.append({'key': key, 'metric': metric, 'exponent': fit['exponent'], 'baseline_exponent': baseline_fit['exponent'], 'status': status})
+    return comparison
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def format_scaling_report(results, exponents, comparison=None):
+    lines = ['# Scaling of ConsumerResourceSystem.run()', '']
+    for key, fits in exponents.items():
+        resource_mode, dim = key.split('/')
+        lines += [f"## {dim} ({resource_mode} resources)", '',
+                  f"| {dim} | initial types | wall time (s) | RHS evals | epochs | mean extant types | peak RSS increase (MiB) |", '|---|---|---|---|---|---|---|']
+        for result in results:
+            if(result['resource_mode'] == resource_mode and result['sweep'] == dim):
+                rss_increase = f"{result['peak_rss_increase']/2**20:.1f}" if result['peak_rss_increase'] is not None else '-'
+                lines.append(f"| {result[dim]:g} | {result['num_types_initial']} | {result['wall_time']:.3g} | {result['nfev']} | {result['num_epochs']} | {result['mean_extant_types']:.1f} | {rss_increase} |")
+        lines += ['', 'Scaling exponents: ' + ', '.join(f"{metric} ~ {SCALING_COVARIATES.get(dim, dim)}^{fit['exponent']:.2f} (r2={fit['r2']:.2f})" for metric, fit in fits.items() if fit is not None), '']
+    if(comparison is not None):
+        lines += ['## Comparison with baseline', '', '| sweep | metric | exponent | baseline | status |', '|---|---|---|---|---|']
+        lines += [f"| {c['key']} | {c['metric']} | {c['exponent']:.2f} | {c['baseline_exponent']:.2f} | {c['status']} |" for c in comparison]
+    return '\n'.join(lines) + '\n'
+
+
+def write_scaling_report(results, exponents, path_prefix, comparison=None):
+    # Writes <path_prefix>.json (raw results and fits, reusable as a baseline) and <path_prefix>.md (report)
+    with open(f"{path_prefix}.json", 'w') as outfile:
+        json.dump({'environment': get_environment_info(), 'results': results, 'exponents': exponents, 'comparison': comparison}, outfile, indent=2)
+    with open(f"{path_prefix}.md", 'w') as outfile:
+        outfile.write(format_scaling_report(results, exponents, comparison))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ecoevocrm.benchmarks.scaling', description='Measure how ConsumerResourceSystem.run() scales with L, number of types, and mutation rate.')
+    parser.add_argument('--out', default='scaling_report', help='path prefix of the .json and .md report files (default: scaling_report)')
+    parser.add_argument('--quick', action='store_true', help='use shorter sweeps')
+    parser.add_argument('--resource-modes', nargs='+', choices=DEFAULT_RESOURCE_MODES, default=None, help='resource dynamics modes to sweep (default: both)')
+    parser.add_argument('--T', type=float, default=None, help=f"run duration at every point (default: {DEFAULT_BASE_POINT['T']})")
+    parser.add_argument('--no-isolate', action='store_true', help='run all points in this process (faster, but peak RSS is not per point)')
+    parser.add_argument('--compare', metavar='PATH', default=None, help='compare exponents against a previous .json report')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='change in exponent reported as steeper/shallower (default: 0.25)')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 if any exponent is steeper than the baseline')
+    args = parser.parse_args(argv)
+    #----------------------------------
+    design  = get_scaling_design(base_point=({'T': args.T} if args.T is not None else None), sweeps=(QUICK_SWEEPS if args.quick else None), resource_modes=args.resource_modes)
+    results = run_scaling_study(design, isolate=(not args.no_isolate),
+                                callback=lambda result: print(f"  {result['resource_mode']} {result['sweep']}={result[result['sweep']]:g}: {result['wall_time']:.3g} s", file=sys.stderr))
+    exponents  = fit_scaling_exponents(results)
+    comparison = None
+    if(args.compare is not None):
+        with open(args.compare) as infile:
+            comparison = compare_exponents(exponents, json.load(infile)['exponents'], tolerance=args.tolerance)
+    write_scaling_report(results, exponents, args.out, comparison)
+    print(format_scaling_report(results, exponents, comparison))
+    #----------------------------------
+    if(args.fail_on_regression and comparison is not None and any(c['status'] == 'steeper' for c in comparison)):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
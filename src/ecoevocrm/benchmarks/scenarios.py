@@ -0,0 +1,71 @@
+import functools
+import numpy as np
+
+from ecoevocrm.consumer_resource_system import *
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Fixed-seed systems for benchmarking. Every call builds a fresh system from the same seed (system parameters and
+# the global numpy RNG that drives mutation events), so repeated runs of a scenario follow the same trajectory.
+
+DEFAULT_SEED = 0
+
+# Time horizon covered by the influx series of 'temporal' systems (runs must stay within it):
+TEMPORAL_HORIZON = 1000
+
+
+def make_system(L=8, num_types=4, mu=1e-5, resource_mode='fasteq', seed=DEFAULT_SEED, **system_args):
+    # resource_mode: 'fasteq', 'explicit', 'temporal' (fast-equilibrium resources with a sinusoidally fluctuating influx,
+    # tabulated as an interp1d), or 'sinusoid' (the same influx, evaluated analytically)
+    rng   = np.random.RandomState(seed)
+    sigma = rng.randint(0, 2, size=(num_types, L))
+    sigma[sigma.sum(axis=1) == 0, 0] = 1 # every type consumes at least one resource
+    #----------------------------------
+    influx_args = {}
+    if(resource_mode in ['temporal', 'sinusoid']):
+        phase = rng.uniform(0, 2*np.pi/0.1, size=L)
+        if(resource_mode == 'temporal'):
+            rho = utils.sinusoid_series(T=TEMPORAL_HORIZON, dt=0.5, amplitude=0.5, period=0.1, phase=phase, shift=1, L=L)
+        else:
+            rho, influx_args = 1, {'alpha': 0.5, 'theta': 0.1, 'phi': phase}
+    elif(resource_mode in ['fasteq', 'explicit']):
+        rho = 1
+    else:
+        utils.error(f"Error in make_system(): resource_mode '{resource_mode}' is not recognized.")
+    #----------------------------------
+    args = {'sigma': sigma, 'N_init': np.ones(num_types), 'R_init': np.ones(L), 'mu': mu, 'xi': 0.1, 'chi': 0, 'kappa': 1e3, 'rho': rho, **influx_args,
+            'resource_dynamics_mode': ('explicit' if resource_mode == 'explicit' else 'fasteq'), 'seed': seed}
+    args.update(system_args)
+    return ConsumerResourceSystem(**args)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# run() scenarios: {name: (make_system() args, run T)}
+RUN_SCENARIOS = {f"L{L}_mu{mu:.0e}_{resource_mode}": ({'L': L, 'mu': mu, 'resource_mode': resource_mode}, 20)
+                    for L in [8, 16, 32] for mu in [1e-6, 1e-5] for resource_mode in ['fasteq']}
+RUN_SCENARIOS.update({f"L16_mu1e-05_{resource_mode}": ({'L': 16, 'mu': 1e-5, 'resource_mode': resource_mode}, 20) for resource_mode in ['explicit', 'temporal', 'sinusoid']})
+
+# Longer runs (a few dozen epochs), over which run(integration_method='auto') can amortize its exploration of integrators:
+LONG_RUN_SCENARIOS = {f"L16_mu1e-05_{resource_mode}_T200": ({'L': 16, 'mu': 1e-5, 'resource_mode': resource_mode}, 200) for resource_mode in ['fasteq', 'explicit', 'temporal', 'sinusoid']}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+@functools.lru_cache(maxsize=None)
+def get_midrun_system(L=16):
+    # A system a short way into its evolution (a few dozen types), for benchmarking single steps of the simulation.
+    # Shared between calls: clone it before doing anything that modifies it.
+    system = make_system(L=L, mu=1e-5)
+    system.run(T=20)
+    return system
+
+
+@functools.lru_cache(maxsize=None)
+def get_long_trajectory(cache=None):
+    # A canned long trajectory (~200 types over ~8000 recorded time points), for benchmarking analyses of run histories.
+    # Shared between calls: clone it before doing anything that modifies it. Pass a ResultCache to keep it across sessions.
+    system = make_system(L=12, mu=1e-3)
+    system.run(T=100, cache=cache)
+    return system
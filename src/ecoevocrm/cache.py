@@ -0,0 +1,179 @@
+import os
+import glob
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Increment when the stored entry format or the key contents change:
+CACHE_FORMAT_VERSION = 1
+
+
+def get_package_version():
+    try:
+        import importlib.metadata
+        return importlib.metadata.version('ecoevocrm')
+    except Exception:
+        return 'unknown'
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def update_hash(hasher, obj):
+    # Feeds a stable (process- and platform-independent) representation of obj into hasher
+    if(isinstance(obj, utils.ExpandableArray)):
+        update_hash(hasher, obj.values)
+    elif(isinstance(obj, np.ndarray)):
+        hasher.update(f"ndarray{obj.dtype.str}{obj.shape}".encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif(isinstance(obj, dict)):
+        hasher.update(b'dict')
+        for key in sorted(obj.keys(), key=str):
+            update_hash(hasher, key)
+            update_hash(hasher, obj[key])
+    elif(isinstance(obj, (list, tuple))):
+        hasher.update(f"{type(obj).__name__}{len(obj)}".encode())
+        for item in obj:
+            update_hash(hasher, item)
+    elif(isinstance(obj, (str, bool, int, float, complex, np.generic)) or obj is None):
+        hasher.update(f"{type(obj).__name__}:{obj!r}".encode())
+    elif(hasattr(obj, 'get_hash_contents')):
+        # e.g., ResourceSchedule resource influx (whose evaluation state is left out)
+        update_hash(hasher, obj.get_hash_contents())
+    elif(hasattr(obj, 'x') and hasattr(obj, 'y')):
+        # e.g., scipy.interpolate.interp1d resource influx series
+        hasher.update(type(obj).__name__.encode())
+        update_hash(hasher, np.asarray(obj.x))
+        update_hash(hasher, np.asarray(obj.y))
+        update_hash(hasher, getattr(obj, '_kind', None))
+    else:
+        hasher.update(pickle.dumps(obj))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class ResultCache():
+
+    # Opt-in on-disk cache of ConsumerResourceSystem.run() results, keyed by a hash of everything that determines the outcome
+    # of a run (type/mutant/resource set parameters, system options, current state and history, numpy RNG state, run arguments)
+    # together with the package version. Entries are evicted least-recently-used first once the cache exceeds max_size bytes.
+
+    def __init__(self, cache_dir=None, max_size=1e9):
+        self.cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'ecoevocrm') if cache_dir is None else cache_dir
+        self.max_size  = max_size
+        self.version   = f"{get_package_version()}-{CACHE_FORMAT_VERSION}"
+        #----------------------------------
+        os.makedirs(self.entries_dir, exist_ok=True)
+
+    @property
+    def entries_dir(self):
+        return os.path.join(self.cache_dir, self.version)
+
+    @property
+    def entry_files(self):
+        return glob.glob(os.path.join(self.cache_dir, '*', '*.pkl'))
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(f) for f in self.entry_files if os.path.exists(f))
+
+    def get_entry_file(self, key):
+        return os.path.join(self.entries_dir, f"{key}.pkl")
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_run_key(self, system, **run_args):
+        type_set     = system.type_set
+        mutant_set   = system.mutant_set
+        resource_set = system.resource_set
+        #----------------------------------
+        key_contents = {
+            'version':         self.version,
+            'type_set':        [type_set.sigma, type_set.beta, type_set.kappa, type_set.eta, type_set.lamda, type_set.gamma, type_set.xi, type_set._chi, type_set.mu, type_set.J,
+                                type_set._mean_xi_mut, type_set.normalize_phenotypes, type_set.binarize_traits_chi_cost_terms, type_set.binarize_traits_J_cost_terms,
+                                type_set.lineage_ids, type_set.parent_indices],
+            'mutant_set':      [mutant_set.sigma, mutant_set.xi],
+            'resource_set':    [resource_set.rho, resource_set.tau, resource_set.omega, resource_set.alpha, resource_set.theta, resource_set.phi, resource_set.D, resource_set.max_step_hint],
+            'system_options':  [system.threshold_eq_abundance_change, system.threshold_min_abs_abundance, system.threshold_min_rel_abundance, system.threshold_precise_integrator,
+                                system.check_event_low_abundance, system.convergent_lineages, system.max_time_step, system.resource_dynamics_mode, system.resource_crossfeeding_mode,
+                                system.abundance_integration_mode],
+            'state':           [system.t_series, system.N_series, system.R_series],
+            'rng_state':       np.random.get_state(),
+            'run_args':        run_args
+        }
+        #----------------------------------
+        hasher = hashlib.sha256()
+        update_hash(hasher, key_contents)
+        return hasher.hexdigest()
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def load_run(self, system, key):
+        entry_file = self.get_entry_file(key)
+        try:
+            with open(entry_file, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+        #----------------------------------
+        # Mark the entry as recently used:
+        os.utime(entry_file)
+        #----------------------------------
+        # Restore the post-run system state and numpy RNG state, as if the run had been integrated:
+        system.__dict__.update(entry['system_state'])
+        np.random.set_state(entry['rng_state'])
+        return True
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def save_run(self, system, key):
+        # The resource set is not changed by run() and is left out of the stored state:
+        entry = {'system_state': {attr: val for attr, val in system.__dict__.items() if attr != 'resource_set'},
+                 'rng_state':    np.random.get_state()}
+        #----------------------------------
+        # Write atomically so that concurrent readers (e.g., sweep workers) never see partial entries:
+        fd, tmp_file = tempfile.mkstemp(dir=self.entries_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.get_entry_file(key))
+        #----------------------------------
+        self.evict()
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def evict(self):
+        entries = []
+        for entry_file in self.entry_files:
+            try:
+                stat = os.stat(entry_file)
+                entries.append((stat.st_mtime, stat.st_size, entry_file))
+            except OSError:
+                continue
+        #----------------------------------
+        total_size = sum(size for mtime, size, entry_file in entries)
+        for mtime, size, entry_file in sorted(entries):
+            if(total_size <= self.max_size):
+                break
+            try:
+                os.remove(entry_file)
+                total_size -= size
+            except OSError:
+                pass
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def clear(self):
+        for entry_file in self.entry_files:
+            try:
+                os.remove(entry_file)
+            except OSError:
+                pass
@@ -7,134 +7,132 @@ import ecoevocrm.utils as utils
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def get_sorted_prefix_lengths(sigma):
+    # Sorts the rows of sigma lexicographically and returns (sort order, lcp), where lcp[i] is the length of the
+    # longest common prefix of sorted rows i-1 and i (lcp[0] = 0). The number of distinct length-L* prefixes among
+    # any subset of rows is then the number of (sorted) subset rows whose lcp with the preceding subset row is < L*.
+    num_traits = sigma.shape[1]
+    order      = np.lexsort(sigma.T[::-1]) if sigma.shape[0] > 0 else np.array([], dtype=int)
+    sorted_sigma = sigma[order]
+    diffs = (sorted_sigma[1:] != sorted_sigma[:-1])
+    lcp   = np.concatenate([[0], np.where(diffs.any(axis=1), np.argmax(diffs, axis=1), num_traits)]).astype(int)
+    return (order, lcp)
+
+
 def get_Lstar_types(system, Lstar='all', nonzero_abundance_only=True):
     Lstar_vals = list(range(1, system.type_set.sigma.shape[1])) if Lstar == 'all' else utils.treat_as_list(Lstar)
     #------------------------------
-    extant_type_indices = np.where(system.N_series[:,-1] > 0)[0] if nonzero_abundance_only else np.ones(system.type_set.num_types)
+    type_indices = np.where(system.N_series[:,-1] > 0)[0] if nonzero_abundance_only else np.arange(system.type_set.num_types)
+    sigma        = system.type_set.sigma[type_indices, :]
+    #------------------------------
+    # One lexicographic sort serves all L*: the unique length-L* prefixes are the sorted rows that differ from
+    # their predecessor within the first L* traits (in the same order as np.unique(sigma[:, :Lstar], axis=0)):
+    order, lcp = get_sorted_prefix_lengths(sigma)
     num_Lstar_types  = []
     Lstar_types_list = []
     for Lstar in Lstar_vals: 
-        Lstar_types = np.unique(system.type_set.sigma[extant_type_indices, :Lstar], axis=0)
-        num_Lstar_types.append(Lstar_types.shape[0])
-        Lstar_types_list.append(Lstar_types)
+        is_new_prefix = (lcp < Lstar)
+        if(len(lcp) > 0):
+            is_new_prefix[0] = True
+        num_Lstar_types.append(int(np.count_nonzero(is_new_prefix)))
+        Lstar_types_list.append(sigma[order[is_new_prefix], :Lstar])
     #------------------------------
     return (Lstar_vals, num_Lstar_types, Lstar_types_list)
 
 
+def get_Lstar_types_series(system, Lstar='all', t_index=None):
+    # Number of distinct length-L* phenotype prefixes among the extant types at each of the given (default all) time indices;
+    # returns (Lstar_vals, array of shape (num_Lstar_vals, num_times))
+    Lstar_vals   = np.array(list(range(1, system.type_set.sigma.shape[1])) if Lstar == 'all' else utils.treat_as_list(Lstar))
+    time_indices = np.arange(system.t_series.shape[0]) if t_index is None else np.array(utils.treat_as_list(t_index))
+    num_traits   = system.type_set.num_traits
+    #------------------------------
+    order, lcp = get_sorted_prefix_lengths(system.type_set.sigma)
+    # The lcp between two non-adjacent sorted rows is the min of the lcps between them; sentinel keeps reduceat indices in range:
+    lcp_padded = np.concatenate([lcp, [0]])
+    N_sorted   = system.N_series[order]
+    #------------------------------
+    num_Lstar_types = np.zeros((len(Lstar_vals), len(time_indices)), dtype=int)
+    for j, tidx in enumerate(time_indices):
+        extant_positions = np.where(N_sorted[:, tidx] > 0)[0]
+        if(len(extant_positions) == 0):
+            continue
+        extant_lcp = np.minimum.reduceat(lcp_padded, extant_positions+1)[:-1]
+        # Count of extant rows whose lcp with the preceding extant row is < L*, for every L* at once:
+        num_new_prefixes = np.concatenate([[0], np.cumsum(np.bincount(extant_lcp, minlength=num_traits+1))])
+        num_Lstar_types[:, j] = 1 + num_new_prefixes[Lstar_vals]
+    #------------------------------
+    return (Lstar_vals, num_Lstar_types)
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 def get_phylogenetic_group_abundances(system, phylogeny_depth, t=None, t_index=None, relative_abundance=False, mode='branchings'):
     t_idx = np.argmax(system.t_series >= t) if t is not None else t_index if t_index is not None else -1
     #----------------------------------
-    lineageIDs             = np.array(system.type_set.lineage_ids)
-    extant_type_indices    = system.get_extant_type_indices(t_index=t_idx)
-    extant_type_lineageIDs = lineageIDs[extant_type_indices]
-    abundances             = system.get_type_abundance(t_index=t_idx).ravel()
-    total_abundance        = np.sum(abundances)
-    # extant_type_abundances = system.get_type_abundance(type_index=extant_type_indices, t_index=t_idx).ravel()
-    extant_type_abundances = abundances[extant_type_indices]
-    #----------------------------------
-    if(mode == 'branchings'):
-        type_cladeIDs          = np.array(['.'.join(lid.split('.')[:phylogeny_depth]) for lid in extant_type_lineageIDs])# if lid.count('.') >= phylogeny_depth-1]
-        unique_cladeIDs        = np.unique(type_cladeIDs)
-        #------------------------------
-        clade_abds_dict = {}
-        for i, clade_id in enumerate(unique_cladeIDs):
-            clade_abds_dict[clade_id] = np.sum( abundances[extant_type_indices[np.where(type_cladeIDs == clade_id)[0]]] )
-            if(relative_abundance):
-                clade_abds_dict[clade_id] /= total_abundance
+    # Clades (see PhylogenyIndex.get_clades() for the 'branchings' and 'coalescings' modes) with at least one extant type:
+    clade_ids, clade_abds, clade_counts = system.type_set.phylogeny_index.get_clade_sums(system.get_type_abundance(t_index=t_idx).ravel(), phylogeny_depth, mode=mode)
+    total_abundance = np.sum(clade_abds)
     #----------------------------------
-    if(mode == 'coalescings'):
-        _tree = copy.deepcopy(system.type_set.phylogeny)
-        #------------------------------
-        def collapse_subtrees(tree_dict):
-            for child_id, childs_subtree in tree_dict.items():
-                if(len(childs_subtree) == 0):
-                    continue
-                else:
-                    all_children_have_empty_subtrees = True
-                    for grandchild_id, grandchilds_subtree in childs_subtree.items():
-                        if(len(grandchilds_subtree) > 0):
-                            all_children_have_empty_subtrees = False
-                            break
-                    if(all_children_have_empty_subtrees):
-                        # collapse this child's subtree:
-                        # print(f">> collapsing {child_id}")
-                        tree_dict[child_id] = {}
-                    else:
-                        # traverse down into the child's subtree:
-                        collapse_subtrees(childs_subtree)
-        #..............................
-        # Repeated rounds of childless subtree collapses   
-        for d in range(1, phylogeny_depth+1):
-            collapse_subtrees(_tree)
-        #------------------------------    
-        def collect_abundances(tree_dict, abds_dict):
-            for child_id, childs_subtree in tree_dict.items():
-                # print(child_id, "::", len(childs_subtree), "children,", ("extant" if child_id in extant_type_lineageIDs else "extinct"), ("interior node" if len(childs_subtree) > 0 else "leaf node"))
-                if(len(childs_subtree) > 0):
-                    # child_id is an interior node in the collapsed tree;
-                    # abundance for this 'clade' is abundance of the type exactly matching this id
-                    for i, extant_id in enumerate(extant_type_lineageIDs):
-                        # check if extant_id mathces the child_id
-                        if (child_id == extant_id):
-                            if(extant_type_abundances[i] > 0):
-                                abds_dict[child_id] = extant_type_abundances[i] / (np.sum(extant_type_abundances) if relative_abundance else 1)
-                            # print ('\t', extant_id, "matches", child_id, "\tabd =", extant_type_abundances[i])
-                            # break
-                        # else:
-                        #     print('\tskip', extant_id)
-                    # continue traversing down the subtrees:
-                    collect_abundances(childs_subtree, abds_dict)
-                else:
-                    # child_id is a leaf in the collapsed tree; 
-                    # abundance for this clade is sum of all extant types that begin with this child_id
-                    clade_abd = 0.0
-                    for i, extant_id in enumerate(extant_type_lineageIDs):
-                        # check if extant_id starts with the child_id
-                        if (child_id == extant_id or extant_id[:len(child_id)+1] == child_id+'.'):
-                        # if (child_id in extant_id and re.search("^" + child_id, extant_id)):
-                            clade_abd += extant_type_abundances[i]
-                            # print("extant_type_abundances", extant_type_abundances, extant_type_abundances.shape)
-                            # print("extant_type_abundances[i]", extant_type_abundances[i])
-                            # print("clade_abd", clade_abd)
-                            # print ('\t', extant_id, "starts with", child_id, "\tabd =", extant_type_abundances[i])
-                        # else:
-                        #     print('\tskip', extant_id)
-                    if(clade_abd > 0):
-                        abds_dict[child_id] = clade_abd / (np.sum(extant_type_abundances) if relative_abundance else 1)
-        #..............................
-        clade_abds_dict = {}
-        collect_abundances(_tree, clade_abds_dict)
+    clade_abds_dict = {}
+    for i in np.where(clade_counts > 0)[0]:
+        clade_abds_dict[clade_ids[i]] = clade_abds[i] / (total_abundance if relative_abundance else 1)
     #----------------------------------
     return clade_abds_dict
 
 
+def get_phylogenetic_group_abundance_series(system, phylogeny_depth, t_index=None, relative_abundance=False, mode='branchings'):
+    # Abundances of all clades over all (or the given) time indices at once; returns (clade_ids, array of shape (num_clades, num_times))
+    N_series = system.N_series if t_index is None else system.N_series[:, t_index]
+    clade_ids, clade_abds, clade_counts = system.type_set.phylogeny_index.get_clade_sums(N_series, phylogeny_depth, mode=mode)
+    if(relative_abundance):
+        total_abundances = clade_abds.sum(axis=0)
+        clade_abds = np.divide(clade_abds, total_abundances, out=np.full(clade_abds.shape, np.nan), where=(total_abundances > 0))
+    #----------------------------------
+    return (clade_ids, clade_abds)
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+def get_functional_group_codes(sigma, trait_subset):
+    # Integer code for each row's binarized trait profile over trait_subset. Codes put the first subset trait in the most significant bit,
+    # so ordering codes orders profiles lexicographically; profiles longer than 63 bits are packed and mapped to their rank among the unique packed rows.
+    trait_bits = (np.asarray(sigma)[:, list(trait_subset)] != 0)
+    if(trait_bits.shape[1] <= 63):
+        return trait_bits.astype(np.int64) @ (np.int64(1) << np.arange(trait_bits.shape[1]-1, -1, -1, dtype=np.int64))
+    else:
+        packed_bits = np.packbits(trait_bits, axis=1)
+        return np.unique(packed_bits, axis=0, return_inverse=True)[1].ravel().astype(np.int64)
+
+
+def get_functional_group_ids(sigma, trait_subset, type_indices, num_traits):
+    # String ids ('-' for traits outside the subset, '0'/'1' within) of the groups of the given representative types
+    trait_subset = list(trait_subset)
+    group_id_chars = np.full((len(type_indices), num_traits), '-')
+    group_id_chars[:, trait_subset] = np.where(np.asarray(sigma)[type_indices][:, trait_subset] != 0, '1', '0')
+    return [''.join(chars) for chars in group_id_chars.tolist()]
+
+
 def get_functional_group_abundances(system, trait_subset, t=None, t_index=None, relative_abundance=False):
     t_idx = np.argmax(system.t_series >= t) if t is not None else t_index if t_index is not None else -1
     #----------------------------------
     extant_type_indices = system.get_extant_type_indices(t_index=t_idx)
-    functypes           = system.type_set.sigma[extant_type_indices, :][:, trait_subset]
-    unique_functypes    = np.unique(functypes, axis=0)
     abundances          = system.get_type_abundance(t_index=t_idx).ravel()
     total_abundance     = np.sum(abundances)
     #----------------------------------
-    group_abds_dict = {}
-    for j, group_trait_profile in enumerate(unique_functypes):
-        group_id = np.array(['-' for i in range(system.type_set.num_traits)])
-        # print("?  ", group_id)
-        group_id[list(trait_subset)] = [str(int(i != 0)) for i in group_trait_profile]
-        # print("?? ", group_id)
-        group_id = ''.join(group_id.tolist())
-        # print("???", group_id)
-        group_abds_dict[group_id] = np.sum( abundances[extant_type_indices[np.where((functypes == group_trait_profile).all(axis=1))[0]]] )
-        # print("@@@")
-        if(relative_abundance):
-            group_abds_dict[group_id] /= total_abundance
+    group_codes, first_indices, type_group_indices = np.unique(get_functional_group_codes(system.type_set.sigma[extant_type_indices], trait_subset), return_index=True, return_inverse=True)
+    group_abds = np.bincount(type_group_indices.ravel(), weights=abundances[extant_type_indices], minlength=len(group_codes))
+    if(relative_abundance):
+        group_abds = group_abds/total_abundance
     #----------------------------------
-    return group_abds_dict
+    group_ids = get_functional_group_ids(system.type_set.sigma, trait_subset, extant_type_indices[first_indices], system.type_set.num_traits)
+    return dict(zip(group_ids, group_abds))
+
+
+def get_functional_group_abundance_series(system, trait_subset, t_index=None, relative_abundance=False):
+    # Abundances of all functional groups over all (or the given) time indices at once; returns (group_ids, array of shape (num_groups, num_times))
+    group_ids, membership = get_functional_group_membership(system, trait_subset)
+    return (group_ids, get_group_abundance_series(system, membership, t_index=t_index, relative_abundance=relative_abundance))
 
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -213,6 +211,82 @@ def functional_group_turnover(system, trait_subset, t0, tf, inverse=False):
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+def get_functional_group_membership(system, trait_subset):
+    # Returns the functional group ids and a sparse (num_groups x num_types) membership matrix grouping all types
+    # (extant or not) by their trait profile over trait_subset (all traits if None)
+    trait_subset = range(system.type_set.num_traits) if trait_subset is None else trait_subset
+    group_codes, first_indices, type_group_indices = np.unique(get_functional_group_codes(system.type_set.sigma, trait_subset), return_index=True, return_inverse=True)
+    group_ids = get_functional_group_ids(system.type_set.sigma, trait_subset, first_indices, system.type_set.num_traits)
+    #----------------------------------
+    membership = scipy.sparse.csr_matrix((np.ones(system.type_set.num_types), (type_group_indices.ravel(), np.arange(system.type_set.num_types))), shape=(len(group_ids), system.type_set.num_types))
+    return (group_ids, membership)
+
+
+def get_phylogenetic_group_membership(system, phylogeny_depth, mode='branchings'):
+    # Returns the phylogenetic group (clade) ids and a sparse (num_groups x num_types) membership matrix,
+    # with groups defined as in get_phylogenetic_group_abundances()
+    phylogeny_index = system.type_set.phylogeny_index
+    clade_ids, clade_starts, clade_ends = phylogeny_index.get_clades(phylogeny_depth, mode=mode)
+    type_clade_indices = phylogeny_index.get_type_clade_indices(clade_starts)
+    #----------------------------------
+    membership = scipy.sparse.csr_matrix((np.ones(system.type_set.num_types), (type_clade_indices, np.arange(system.type_set.num_types))), shape=(len(clade_ids), system.type_set.num_types))
+    return (clade_ids, membership)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_group_abundance_series(system, membership, t_index=None, relative_abundance=False):
+    # Projects the abundance history (all or the given time indices) onto groups with one sparse matmul;
+    # returns an array of shape (num_groups, num_times)
+    N_series = system.N_series if t_index is None else system.N_series[:, t_index]
+    group_abundances = np.asarray(membership @ N_series)
+    if(relative_abundance):
+        total_abundances = group_abundances.sum(axis=0)
+        group_abundances = np.divide(group_abundances, total_abundances, out=np.full(group_abundances.shape, np.nan), where=(total_abundances > 0))
+    return group_abundances
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def turnover_metric_series(abundances_t0, abundances_tf, inverse=False):
+    # Column-wise turnover_metric() for abundance arrays of shape (num_groups, num_pairs)
+    turnover = np.sum(np.power((abundances_t0 - abundances_tf), 2), axis=0) / ( np.sum(np.power(abundances_t0, 2), axis=0) + np.sum(np.power(abundances_tf, 2), axis=0) - np.sum(abundances_t0 * abundances_tf, axis=0) )
+    return turnover if not inverse else (1 - turnover)
+
+
+def group_turnover_series(system, membership, t0=None, tf=None, lag=None, t0_index=None, tf_index=None, inverse=False):
+    # Turnover between group relative abundances for every (t0, tf) pair (t0 and tf broadcast against each other),
+    # or for tf = t0 + lag; times are resolved to the first time index at or after each time
+    if(t0_index is None):
+        t0 = np.asarray(t0, dtype=float)
+        tf = t0 + np.asarray(lag, dtype=float) if lag is not None else np.asarray(tf, dtype=float)
+        t0, tf   = np.broadcast_arrays(t0, tf)
+        t0_index = np.minimum(np.searchsorted(system.t_series, t0, side='left'), len(system.t_series)-1)
+        tf_index = np.minimum(np.searchsorted(system.t_series, tf, side='left'), len(system.t_series)-1)
+    else:
+        t0_index, tf_index = np.broadcast_arrays(np.asarray(t0_index), np.asarray(tf_index))
+    #----------------------------------
+    # Only the time points that appear in some pair are projected onto groups:
+    unique_indices, pair_indices = np.unique(np.concatenate([t0_index.ravel(), tf_index.ravel()]), return_inverse=True)
+    group_relabds = get_group_abundance_series(system, membership, t_index=unique_indices, relative_abundance=True)
+    pair_indices  = pair_indices.ravel()
+    #----------------------------------
+    turnover = turnover_metric_series(group_relabds[:, pair_indices[:t0_index.size]], group_relabds[:, pair_indices[t0_index.size:]], inverse=inverse)
+    return turnover.reshape(t0_index.shape)
+
+
+def functional_group_turnover_series(system, trait_subset, t0=None, tf=None, lag=None, t0_index=None, tf_index=None, inverse=False):
+    group_ids, membership = get_functional_group_membership(system, trait_subset)
+    return group_turnover_series(system, membership, t0=t0, tf=tf, lag=lag, t0_index=t0_index, tf_index=tf_index, inverse=inverse)
+
+
+def phylogenetic_group_turnover_series(system, phylogeny_depth, t0=None, tf=None, lag=None, t0_index=None, tf_index=None, inverse=False, mode='branchings'):
+    group_ids, membership = get_phylogenetic_group_membership(system, phylogeny_depth, mode=mode)
+    return group_turnover_series(system, membership, t0=t0, tf=tf, lag=lag, t0_index=t0_index, tf_index=tf_index, inverse=inverse)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
 # def functional_group_diversity(system, trait_subset, t=None, t_index=None, metric='shannon'):
 #     t_idx = np.argmax(system.t_series >= t) if t is not None else t_index if t_index is not None else -1
 #     #----------------------------------
@@ -223,48 +297,22 @@ def functional_group_turnover(system, trait_subset, t0, tf, inverse=False):
 #     else:
 #         utils.error(f"Error in functional_group_diversity(): diversity metric '{metric}' is not recognized.")
 
-def phylogenetic_group_diversity(system, phylogeny_depth, t=None, t_index=None, metric='shannon', mode='branchings'):
+def phylogenetic_group_diversity(system, phylogeny_depth, t=None, t_index=None, metric='shannon', mode='branchings', order=1):
+    import ecoevocrm.diversity as diversity
     t_idx = np.argmax(system.t_series >= t) if t is not None else t_index if t_index is not None else -1
     #----------------------------------
-    if(metric == 'shannon'):
-        abundances = list( get_phylogenetic_group_abundances(system, phylogeny_depth, t_index=t_idx, relative_abundance=True, mode=mode).values() )
-        abundances = abundances/np.sum(abundances)
-        entropy = scipy.stats.entropy(abundances)
-        diversity = entropy
-    #----------------------------------
-    else:
+    if(metric not in ['shannon', 'simpson', 'richness', 'hill']):
         utils.error(f"Error in phylogenetic_group_diversity(): diversity metric '{metric}' is not recognized.")
     #----------------------------------
-    return diversity
+    return diversity.get_diversity_series(system, metric=metric, order=order, grouping='phylogenetic', phylogeny_depth=phylogeny_depth, mode=mode, t_index=[t_idx])[0]
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def functional_group_diversity(system, trait_subset, t=None, t_index=None, metric='shannon'):
+def functional_group_diversity(system, trait_subset, t=None, t_index=None, metric='shannon', order=1):
+    import ecoevocrm.diversity as diversity
     t_idx = np.argmax(system.t_series >= t) if t is not None else t_index if t_index is not None else -1
     #----------------------------------
-    if(metric == 'shannon'):
-        abundances = list( get_functional_group_abundances(system, trait_subset, t_index=t_idx, relative_abundance=True).values() )
-        abundances = abundances/np.sum(abundances)
-        entropy = scipy.stats.entropy(abundances)
-        diversity = entropy
-    #----------------------------------
-    else:
+    if(metric not in ['shannon', 'simpson', 'richness', 'hill']):
         utils.error(f"Error in functional_group_diversity(): diversity metric '{metric}' is not recognized.")
     #----------------------------------
-    return diversity
-    
-            
-    
-    
-    
-    
-    
-
-            
-            
-
-
-
-
-
-
+    return diversity.get_diversity_series(system, metric=metric, order=order, grouping='functional', trait_subset=trait_subset, t_index=[t_idx])[0]
@@ -5,12 +5,33 @@ os.environ['NUMPY_EXPERIMENTAL_ARRAY_FUNCTION'] = '0'
 #----------------------------------
 import numpy as np
 import scipy.integrate
+import copy
+import time
+import logging
 from scipy.integrate._ivp.base import OdeSolver
 
 from ecoevocrm.type_set import *
 from ecoevocrm.resource_set import *
+from ecoevocrm.integrator_policy import IntegratorPolicy
+from ecoevocrm.dense_output import DenseTrajectory
 import ecoevocrm.utils as utils
 
+# Progress messages from run() are logged at INFO level (silence with logging.getLogger('ecoevocrm').setLevel(logging.WARNING)):
+logger = logging.getLogger(__name__)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Relative margin below threshold_min_abs_abundance at which low abundance events trigger (see event_low_abundance()):
+EVENT_THRESHOLD_MARGIN = 1e-9
+
+# Per-epoch run metrics recorded by ConsumerResourceSystem.run() (see get_run_metrics()):
+RUN_METRICS_DTYPE = [('epoch', 'i8'), ('t_start', 'f8'), ('t_end', 'f8'), ('event', 'U16'), ('integration_method', 'U32'),
+                     ('num_extant_types', 'i8'), ('num_types', 'i8'), ('num_mutants', 'i8'),
+                     ('nfev', 'i8'), ('njev', 'i8'), ('nlu', 'i8'), ('num_steps', 'i8'), ('num_recorded', 'i8'),
+                     ('wall_time', 'f8'), ('time_get_dynamics_params', 'f8'), ('time_integrate', 'f8'), ('time_series_append', 'f8'),
+                     ('time_handle_mutation_event', 'f8'), ('time_handle_type_loss', 'f8'), ('time_observers', 'f8')]
+
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -22,6 +43,8 @@ class ConsumerResourceSystem():
     RESOURCE_CROSSFEEDING_NONE        = 0
     RESOURCE_CROSSFEEDING_HOMOTYPES   = 1
     RESOURCE_CROSSFEEDING_HETEROTYPES = 2
+    ABUNDANCE_INTEGRATION_LINEAR      = 0
+    ABUNDANCE_INTEGRATION_LOG         = 1
 
     def __init__(self, 
                  type_set      = None,
@@ -48,6 +71,7 @@ class ConsumerResourceSystem():
                  phi           = 0,
                  D             = None,
                  resource_dynamics_mode        = 'fasteq',
+                 abundance_integration_mode    = 'linear',
                  threshold_min_abs_abundance   = 1,
                  threshold_min_rel_abundance   = 1e-6,
                  threshold_eq_abundance_change = 1e4,
@@ -140,6 +164,10 @@ class ConsumerResourceSystem():
 
         self.max_time_step = max_time_step
 
+        self._run_metrics = []
+
+        self._dense_trajectory = DenseTrajectory()
+
         #----------------------------------
         # Initialize event parameters:
         #----------------------------------
@@ -158,6 +186,13 @@ class ConsumerResourceSystem():
                                             else ConsumerResourceSystem.RESOURCE_DYNAMICS_EXPLICIT if resource_dynamics_mode=='explicit' \
                                             else -1
 
+        # Type abundances are integrated either directly ('linear') or as log abundances ('log'); the latter is much less stiff
+        # near extinctions (dlogN/dt = growth rate) and keeps abundances positive, so that the solver can take larger steps:
+        if(abundance_integration_mode not in ['linear', 'log']):
+            utils.error(f"Error in ConsumerResourceSystem __init__(): abundance_integration_mode must be 'linear' or 'log' (got {abundance_integration_mode}).")
+        self.abundance_integration_mode = ConsumerResourceSystem.ABUNDANCE_INTEGRATION_LOG if abundance_integration_mode=='log' \
+                                            else ConsumerResourceSystem.ABUNDANCE_INTEGRATION_LINEAR
+
         self.resource_crossfeeding_mode = ConsumerResourceSystem.RESOURCE_CROSSFEEDING_NONE if np.all(self.resource_set.D == 0) or np.all(self.type_set.lamda == 0) \
                                             else ConsumerResourceSystem.RESOURCE_CROSSFEEDING_HOMOTYPES if self.type_set.lamda.ndim == 1 \
                                             else ConsumerResourceSystem.RESOURCE_CROSSFEEDING_HETEROTYPES if self.type_set.lamda.ndim == 2 \
@@ -199,6 +234,13 @@ class ConsumerResourceSystem():
     def t(self):
         return self.t_series[-1]
 
+    @property
+    def dense_trajectory(self):
+        # Dense output recorded by run(..., dense_output=True) (see dense_output.py):
+        if(getattr(self, '_dense_trajectory', None) is None):
+            self._dense_trajectory = DenseTrajectory()
+        return self._dense_trajectory
+
     @property
     def extant_type_indices(self):
         return np.where(self.N > 0)[0]
@@ -234,26 +276,68 @@ class ConsumerResourceSystem():
     
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    def run(self, T, dt=None, integration_method='default', reorder_types_by_phylogeny=True):
+    def run(self, T, dt=None, integration_method='default', reorder_types_by_phylogeny=True, cache=None, observers=None, record_history=True, metrics_callback=None,
+            rtol=None, atol=None, integrator_policy=None, dense_output=False):
+        # integration_method: a solve_ivp method, 'default', or 'auto' (method and tolerances chosen per epoch by integrator_policy,
+        # an IntegratorPolicy (default: IntegratorPolicy()), see integrator_policy.py; giving an integrator_policy implies 'auto'); rtol/atol: solve_ivp tolerances (override the policy's)
+        # dense_output: store each epoch's solver interpolant in self.dense_trajectory (evaluated lazily, see get_dense_series()),
+        # and record only the epochs' end points in the series (dt is then not used)
+
+        observers = [] if observers is None else utils.treat_as_list(observers)
+
+        if(integrator_policy is not None and integration_method not in ['auto', 'default']):
+            utils.error(f"Error in ConsumerResourceSystem run(): An integrator_policy cannot be combined with an explicit integration_method ({integration_method}); use integration_method='auto'.")
+        elif(integrator_policy is not None):
+            integration_method = 'auto' # (a given integrator_policy implies 'auto')
+        if(integration_method == 'auto'):
+            integrator_policy = IntegratorPolicy() if integrator_policy is None else integrator_policy
+            integrator_policy.reset()
+        else:
+            integrator_policy = None
+
+        # If a ResultCache is given, restore the outcome of an identical previous run instead of integrating
+        # (not when observers are given, since they need to see the dynamics as they are integrated):
+        if(cache is not None and len(observers) == 0):
+            cache_key = cache.get_run_key(self, T=T, dt=dt, integration_method=integration_method, reorder_types_by_phylogeny=reorder_types_by_phylogeny, record_history=record_history,
+                                          rtol=rtol, atol=atol, integrator_policy=(integrator_policy.get_config() if integrator_policy is not None else None),
+                                          dense_output=dense_output)
+            if(cache.load_run(self, cache_key)):
+                return
+        else:
+            cache = None
 
         t_start   = self.t
         t_elapsed = 0
 
-        self._t_series.expand_alloc((self._t_series.alloc[0], self._t_series.alloc[1]+int(T/dt if dt is not None else 10000)))
-        self._N_series.expand_alloc((self._N_series.alloc[0], self._N_series.alloc[1]+int(T/dt if dt is not None else 10000)))
-        self._R_series.expand_alloc((self._R_series.alloc[0], self._R_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+        # Observers that have not seen this system yet start from its current state:
+        for observer in observers:
+            if(observer.num_observations == 0):
+                observer.observe(self, self.t_series[-1:], self.N_series[:, -1:], self.R_series[:, -1:])
+
+        if(record_history):
+            self._t_series.expand_alloc((self._t_series.alloc[0], self._t_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+            self._N_series.expand_alloc((self._N_series.alloc[0], self._N_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+            self._R_series.expand_alloc((self._R_series.alloc[0], self._R_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+        else:
+            self.discard_history()
+
+        log_abundances = (self.abundance_integration_mode == ConsumerResourceSystem.ABUNDANCE_INTEGRATION_LOG)
+
+        if(dense_output):
+            dt = None
 
         while(t_elapsed < T):
 
+            epoch_start_walltime = time.perf_counter()
+            epoch_metrics = {'epoch': len(self._run_metrics), 't_start': self.t, 'event': 'none', 'time_handle_mutation_event': 0.0, 'time_handle_type_loss': 0.0}
+
             #------------------------------
             # Set initial conditions and integration variables:
             #------------------------------
            
-            # Set the time interval for this integration epoch:
-            t_span = (self.t, self.t+T)
-
-            # Set the time ticks at which to save trajectory values:
-            t_eval = np.arange(start=t_span[0], stop=t_span[1]+dt, step=dt) if dt is not None else None,
+            # Set the time interval for this integration epoch (ending at the next discontinuity of the resource influx, if any, so that the solver does not step over it):
+            t_span = (self.t, min(self.t+T, self.resource_set.next_breakpoint(self.t)))
+            ends_at_breakpoint = (t_span[1] < self.t+T)
 
             # Get the indices and count of extant types (abundance > 0):
             self._active_type_indices = self.extant_type_indices
@@ -263,47 +347,77 @@ class ConsumerResourceSystem():
             N_init = self.N[self._active_type_indices] 
             R_init = self.R 
             cumPropMut_init = np.array([0])
-            init_cond = np.concatenate([N_init, R_init, cumPropMut_init])
+            init_cond = np.concatenate([(np.log(N_init) if log_abundances else N_init), R_init, cumPropMut_init])
 
             # Get the params for the dynamics:
+            timer  = time.perf_counter()
             params = self.get_dynamics_params(self._active_type_indices)
+            epoch_metrics['time_get_dynamics_params'] = time.perf_counter() - timer
 
             # Draw a random propensity threshold for triggering the next Gillespie mutation event:
             self.threshold_mutation_propensity = np.random.exponential(1)
             
-            # Set the integration method:
-            if(integration_method == 'default'):
+            # Set the integration method and tolerances:
+            solver_kwargs = {}
+            if(integrator_policy is not None):
+                _integration_method, solver_kwargs = integrator_policy.select(self, num_extant_types)
+            elif(integration_method == 'default'):
                 if(num_extant_types <= self.threshold_precise_integrator):
                     _integration_method = 'LSODA' # accurate stiff integrator
                 else:
                     _integration_method = 'LSODA' # adaptive stiff/non-stiff integrator
             else:
                 _integration_method = integration_method
-
-            # Define the set of events that may trigger:
-            events = []
+            if(rtol is not None):
+                solver_kwargs['rtol'] = rtol
+            if(atol is not None):
+                solver_kwargs['atol'] = atol
+            if(dense_output):
+                solver_kwargs['dense_output'] = True
+
+            # Define the set of events that may trigger (event_names gives the index of each event in sol.t_events):
+            events      = []
+            event_names = []
             if(self.type_set.mu > 0):
                 events.append(self.event_mutation)
+                event_names.append('mutation')
             if(self.check_event_low_abundance):
                 events.append(self.event_low_abundance)
+                event_names.append('low_abundance')
 
             #------------------------------
             # Integrate the system dynamics:
             #------------------------------
             
-            sol = scipy.integrate.solve_ivp(self.dynamics, 
-                                             y0       = init_cond,
-                                             args     = params,
-                                             t_span   = (self.t, self.t+T),
-                                             t_eval   = np.arange(start=self.t, stop=self.t+T+dt, step=dt) if dt is not None else None,
-                                             events   = events,
-                                             method   = _integration_method,
-                                             max_step = self.max_time_step )
+            timer = time.perf_counter()
+            sol = self.integrate_epoch(t_span, dt, init_cond, params, events, _integration_method, log_abundances, solver_kwargs)
+            if(integrator_policy is not None):
+                integrator_policy.update(num_extant_types, _integration_method, sol, time.perf_counter() - timer)
+                if(sol.status == -1 and _integration_method != integrator_policy.fallback_method):
+                    # The policy's trial method failed; re-integrate the epoch with the fallback method:
+                    _integration_method = integrator_policy.fallback_method
+                    sol = self.integrate_epoch(t_span, dt, init_cond, params, events, _integration_method, log_abundances, solver_kwargs)
+            epoch_metrics['time_integrate'] = time.perf_counter() - timer
+            if(sol.status == -1): # Error occurred in integration (no dense output or complete trajectory to store)
+                utils.error(f"Error in ConsumerResourceSystem run(): Integration of dynamics using scipy.solve_ivp returned with error status ({sol.message}).")
+
+            # accepted solver steps are only known when every step is recorded (no t_eval) or from the dense output:
+            num_steps = len(sol.sol.ts)-1 if dense_output else len(sol.t)-1 if dt is None else -1
+
+            # Store the epoch's dense output, and keep only the epoch's start and end points for the series:
+            if(dense_output):
+                self.dense_trajectory.add_epoch(sol.sol, self._active_type_indices, self.resource_set.num_resources, log_abundances)
+                sol.t, sol.y = sol.t[[0, -1]], sol.y[:, [0, -1]]
+
+            # Transform integrated log abundances back to abundances (everything downstream works with abundances):
+            if(log_abundances):
+                sol.y[:num_extant_types] = np.exp(sol.y[:num_extant_types])
 
             #------------------------------
             # Update the system's trajectories with latest dynamics epoch:
             #------------------------------
 
+            timer = time.perf_counter()
             N_epoch = np.zeros(shape=(self._N_series.shape[0], len(sol.t)))
             N_epoch[self._active_type_indices] = sol.y[:num_extant_types]
             
@@ -312,29 +426,67 @@ class ConsumerResourceSystem():
             self._t_series.add(sol.t[1:], axis=1)
             self._N_series.add(N_epoch[:, 1:], axis=1)
             self._R_series.add(R_epoch[:, 1:], axis=1)
+            epoch_metrics['time_series_append'] = time.perf_counter() - timer
             
             t_elapsed = self.t - t_start
 
             typeCountStr = f"{num_extant_types}/{self.type_set.num_types}*({self.mutant_set.num_types})"
 
+            epoch_metrics.update({'t_end': self.t, 'integration_method': getattr(_integration_method, '__name__', str(_integration_method)), 'num_extant_types': num_extant_types, 'num_types': self.type_set.num_types, 'num_mutants': self.mutant_set.num_types,
+                                  'nfev': sol.nfev, 'njev': sol.njev, 'nlu': sol.nlu, 'num_recorded': len(sol.t)-1, 'num_steps': num_steps})
+
             #------------------------------
             # Handle events and update the system's states accordingly:
             #------------------------------
             if(sol.status == 1): # An event occurred
-                if(len(sol.t_events[0]) > 0):
+                if('mutation' in event_names and len(sol.t_events[event_names.index('mutation')]) > 0):
+                    # Mutant fitnesses and propensities at the event state:
+                    growth_rate, self.mutation_propensities = self.rates(sol.t[-1], sol.y[:, -1], *params)[2:]
+                    self.mutant_fitnesses = growth_rate[num_extant_types:]
                     if(np.sum(self.mutation_propensities) > 0):
-                        print(f"[ Mutation event occurred at  t={self.t:.4f} {typeCountStr}]\t\r", end="") # ")#
-                        # print(f"[ Mutation event occurred at  t={self.t:.4f} {typeCountStr}]") # ")#
+                        logger.info(f"[ Mutation event occurred at  t={self.t:.4f} {typeCountStr}]")
+                        epoch_metrics['event'] = 'mutation'
+                        timer = time.perf_counter()
                         self.handle_mutation_event()
-                        # print(f"[ handle type loss after mutation  t={self.t:.4f} {typeCountStr}]\t\r", end="") # ")#
+                        epoch_metrics['time_handle_mutation_event'] = time.perf_counter() - timer
+                        timer = time.perf_counter()
                         self.handle_type_loss()
-                if(len(sol.t_events) > 1 and len(sol.t_events[1]) > 0):
-                    print(f"[ Low abundance event occurred at  t={self.t:.4f} {typeCountStr}]\t\r", end="") # ")#
+                        epoch_metrics['time_handle_type_loss'] = time.perf_counter() - timer
+                if('low_abundance' in event_names and len(sol.t_events[event_names.index('low_abundance')]) > 0):
+                    logger.info(f"[ Low abundance event occurred at  t={self.t:.4f} {typeCountStr}]")
+                    epoch_metrics['event'] = 'low_abundance'
+                    timer = time.perf_counter()
                     self.handle_type_loss()
+                    epoch_metrics['time_handle_type_loss'] += time.perf_counter() - timer
+            elif(sol.status == 0 and ends_at_breakpoint): # Reached a breakpoint of the resource influx (integration continues from it)
+                epoch_metrics['event'] = 'breakpoint'
             elif(sol.status == 0): # Reached end T successfully
+                epoch_metrics['event'] = 'end'
+                timer = time.perf_counter()
                 self.handle_type_loss()
-            else: # Error occurred in integration
-                utils.error("Error in ConsumerResourceSystem run(): Integration of dynamics using scipy.solve_ivp returned with error status.")
+                epoch_metrics['time_handle_type_loss'] = time.perf_counter() - timer
+
+            #------------------------------
+            # Update observers with this epoch's recorded points (as updated by event handling) and drop history if not recorded:
+            #------------------------------
+            timer = time.perf_counter()
+            num_recorded = len(sol.t) - 1
+            for observer in observers:
+                num_observed = num_recorded if observer.every == 'step' else 1
+                if(num_observed > 0):
+                    observer.observe(self, self.t_series[-num_observed:], self.N_series[:, -num_observed:], self.R_series[:, -num_observed:])
+            epoch_metrics['time_observers'] = time.perf_counter() - timer
+
+            if(not record_history):
+                self.discard_history()
+
+            #------------------------------
+            # Record this epoch's metrics:
+            #------------------------------
+            epoch_metrics['wall_time'] = time.perf_counter() - epoch_start_walltime
+            self._run_metrics.append(tuple(epoch_metrics[field] for field, dtype in RUN_METRICS_DTYPE))
+            if(metrics_callback is not None):
+                metrics_callback(epoch_metrics)
 
         #------------------------------
         # Finalize data series at end of integration period:
@@ -347,9 +499,40 @@ class ConsumerResourceSystem():
         if(reorder_types_by_phylogeny):
             self.reorder_types()
 
+        if(cache is not None):
+            cache.save_run(self, cache_key)
+
         return
 
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @staticmethod
+    def get_epoch_t_eval(t_span, dt):
+        # Times at which to record an epoch: every dt from the start of t_span, always ending at the end of the span
+        # (e.g., an influx breakpoint off the grid), so that the next epoch starts where this one ended:
+        if(dt is None):
+            return None
+        t_eval = np.arange(start=t_span[0], stop=t_span[1]+dt, step=dt)
+        t_eval = t_eval[t_eval <= t_span[1]]
+        if(len(t_eval) > 1 and t_span[1] - t_eval[-1] <= 1e-9*dt):
+            t_eval[-1] = t_span[1]
+        elif(len(t_eval) == 0 or t_eval[-1] < t_span[1]):
+            t_eval = np.append(t_eval, t_span[1])
+        return t_eval
+
+    def integrate_epoch(self, t_span, dt, init_cond, params, events, integration_method, log_abundances, solver_kwargs):
+        return scipy.integrate.solve_ivp((self.dynamics_log_abundance if log_abundances else self.dynamics), 
+                                          y0       = init_cond,
+                                          args     = params,
+                                          t_span   = t_span,
+                                          t_eval   = ConsumerResourceSystem.get_epoch_t_eval(t_span, dt),
+                                          events   = events,
+                                          method   = integration_method,
+                                          max_step = min(self.max_time_step, self.resource_set.max_step_hint),
+                                          **solver_kwargs )
+
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def dynamics(self, t, variables, 
@@ -358,6 +541,56 @@ class ConsumerResourceSystem():
                     uptake_coeffs, consumption_coeffs, resource_decay_rate, 
                     resource_dynamics_mode, resource_influx_mode, resource_crossfeeding_mode):
 
+        N_t, dRdt, growth_rate, mutation_propensities = self.rates(t, variables, 
+                                                                    num_types, num_mutants, sigma, beta, kappa, eta, lamda, gamma, xi, chi, J, mu, energy_costs, 
+                                                                    num_resources, rho, tau, omega, alpha, theta, phi, M, 
+                                                                    uptake_coeffs, consumption_coeffs, resource_decay_rate, 
+                                                                    resource_dynamics_mode, resource_influx_mode, resource_crossfeeding_mode)
+        
+        dNdt = N_t[:num_types] * growth_rate[:num_types] # only calc dNdt for extant (non-mutant) types
+                                                          
+        dCumPropMut = np.sum(mutation_propensities, keepdims=True)
+        
+        #------------------------------
+
+        return np.concatenate((dNdt, dRdt, dCumPropMut))
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def dynamics_log_abundance(self, t, variables, 
+                                num_types, num_mutants, sigma, beta, kappa, eta, lamda, gamma, xi, chi, J, mu, energy_costs, 
+                                num_resources, rho, tau, omega, alpha, theta, phi, M, 
+                                uptake_coeffs, consumption_coeffs, resource_decay_rate, 
+                                resource_dynamics_mode, resource_influx_mode, resource_crossfeeding_mode):
+        # As dynamics(), with the type variables being log abundances (dlogN/dt = growth rate):
+
+        variables = np.concatenate((np.exp(variables[:num_types]), variables[num_types:]))
+
+        N_t, dRdt, growth_rate, mutation_propensities = self.rates(t, variables, 
+                                                                    num_types, num_mutants, sigma, beta, kappa, eta, lamda, gamma, xi, chi, J, mu, energy_costs, 
+                                                                    num_resources, rho, tau, omega, alpha, theta, phi, M, 
+                                                                    uptake_coeffs, consumption_coeffs, resource_decay_rate, 
+                                                                    resource_dynamics_mode, resource_influx_mode, resource_crossfeeding_mode)
+
+        dCumPropMut = np.sum(mutation_propensities, keepdims=True)
+
+        #------------------------------
+
+        return np.concatenate((growth_rate[:num_types], dRdt, dCumPropMut))
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def rates(self, t, variables, 
+                num_types, num_mutants, sigma, beta, kappa, eta, lamda, gamma, xi, chi, J, mu, energy_costs, 
+                num_resources, rho, tau, omega, alpha, theta, phi, M, 
+                uptake_coeffs, consumption_coeffs, resource_decay_rate, 
+                resource_dynamics_mode, resource_influx_mode, resource_crossfeeding_mode):
+        # Growth rates (of types, then mutants), resource rates of change, and mutation propensities at the given state.
+        # This is a pure function of the state (no attributes are set), so that mutation events are handled with the propensities
+        # at the event state rather than at whatever state the solver last evaluated.
+
         N_t = np.zeros(num_types+num_mutants)
         N_t[:num_types] = variables[:num_types]
 
@@ -365,15 +598,11 @@ class ConsumerResourceSystem():
 
         #------------------------------
 
-        # resource_influx_rate  = ( rho + ( alpha*np.sin(theta * (t + phi)) if resource_influx_mode == ConsumerResourceSystem.RESOURCE_INFLUX_SINUSOID and np.any(alpha > 0) and np.any(theta > 0) else 0 ) ).ravel()
-        resource_influx_rate = rho(t) if resource_influx_mode == ResourceSet.RESOURCE_INFLUX_TEMPORAL else rho
-        # print(resource_influx_rate)
+        resource_influx_rate = ResourceSet.resource_influx(rho, t, resource_influx_mode, alpha, theta, phi)
 
         #------------------------------
 
         growth_rate = ConsumerResourceSystem.growth_rate(N_t, R_t, t, sigma, beta, kappa, eta, lamda, gamma, rho, tau, omega, alpha, theta, phi, M, energy_costs, resource_dynamics_mode, resource_influx_mode, resource_crossfeeding_mode, uptake_coeffs, consumption_coeffs, resource_influx_rate, resource_decay_rate)
-        
-        dNdt = N_t[:num_types] * growth_rate[:num_types] # only calc dNdt for extant (non-mutant) types
 
         #------------------------------
 
@@ -381,19 +610,11 @@ class ConsumerResourceSystem():
 
         #------------------------------
 
-        self.mutant_fitnesses = growth_rate[-num_mutants:]
-
-        self.mutation_propensities = np.maximum(0, self.mutant_fitnesses * np.repeat(N_t[:num_types] * mu, repeats=num_resources))
-
-        # print("(dyn) self.mutation_propensities", self.mutation_propensities)
-                                                          
-        dCumPropMut = np.sum(self.mutation_propensities, keepdims=True)
-
-        # print("(dyn) dCumPropMut", dCumPropMut)
+        mutation_propensities = np.maximum(0, growth_rate[num_types:] * np.repeat(N_t[:num_types] * mu, repeats=num_resources))
         
         #------------------------------
 
-        return np.concatenate((dNdt, dRdt, dCumPropMut))
+        return (N_t, dRdt, growth_rate, mutation_propensities)
 
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -412,8 +633,7 @@ class ConsumerResourceSystem():
                     uptake_coeffs = uptake_coeffs * omega
         consumption_coeffs   = consumption_rates_bytrait/kappa if consumption_coeffs is None else consumption_coeffs
         resource_decay_rate  = 1/tau if resource_decay_rate is None else resource_decay_rate
-        # resource_influx_rate = rho + ( alpha*np.sin(theta * (t + phi)) if resource_influx_mode == ConsumerResourceSystem.RESOURCE_INFLUX_SINUSOID and np.any(alpha > 0) and np.any(theta > 0) else 0 )
-        resource_influx_rate = rho(t).ravel() if resource_influx_mode == ResourceSet.RESOURCE_INFLUX_TEMPORAL else rho
+        resource_influx_rate = ResourceSet.resource_influx(rho, t, resource_influx_mode, alpha, theta, phi) if resource_influx_rate is None else resource_influx_rate
         #------------------------------
         # print("resource_influx_mode", resource_influx_mode)
         # print("resource_dynamics_mode", resource_dynamics_mode)
@@ -444,8 +664,7 @@ class ConsumerResourceSystem():
 
         consumption_coeffs   = consumption_rates_bytrait/kappa if consumption_coeffs is None else consumption_coeffs
         resource_decay_rate  = (1/tau).ravel() if resource_decay_rate is None else resource_decay_rate
-        # resource_influx_rate = (rho + ( alpha*np.sin(theta * (t + phi)) if resource_influx_mode == ConsumerResourceSystem.RESOURCE_INFLUX_SINUSOID and np.any(alpha > 0) and np.any(theta > 0) else 0 )).ravel()
-        resource_influx_rate = rho(t).ravel() if resource_influx_mode == ResourceSet.RESOURCE_INFLUX_TEMPORAL else rho
+        resource_influx_rate = ResourceSet.resource_influx(rho, t, resource_influx_mode, alpha, theta, phi) if resource_influx_rate is None else resource_influx_rate
         #------------------------------
         if(resource_dynamics_mode == ConsumerResourceSystem.RESOURCE_DYNAMICS_FASTEQ):
             dRdt = np.zeros(len(R))
@@ -478,14 +697,8 @@ class ConsumerResourceSystem():
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def event_mutation(self, t, variables, *args):
+        # The cumulative mutation propensity is integrated as the last state variable, so this is a smooth function of the state alone
         cumulative_mutation_propensity = variables[-1]
-        # print(f"(event) mmmmm {self.threshold_mutation_propensity - cumulative_mutation_propensity}")#" \t\r", end ="")
-        # try:
-        #     print("(event) sum self.mutation_propensities", np.sum(self.mutation_propensities))
-        # except: 
-        #     pass
-        # print("(event) cumulative_mutation_propensity", cumulative_mutation_propensity)
-        # print("(event) thresh diff", self.threshold_mutation_propensity - cumulative_mutation_propensity)
         return self.threshold_mutation_propensity - cumulative_mutation_propensity
     #----------------------------------
     event_mutation.direction = -1
@@ -495,14 +708,17 @@ class ConsumerResourceSystem():
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def event_low_abundance(self, t, variables, *args):
-        # print("(event) lllll \t\r", end ="")
+        # log(min N / threshold) over present types: continuous in the state (unlike a +1/-1 indicator), so that the solver's root finding
+        # converges quickly to the time a type falls below the threshold. The event threshold sits slightly below threshold_min_abs_abundance,
+        # so that the type that triggered the event is always below the loss threshold when handle_type_loss() is called.
+        # (With log abundance integration, the type variables are log abundances of types that are all present, and the event is linear in them.)
         num_types = args[0]
+        if(self.abundance_integration_mode == ConsumerResourceSystem.ABUNDANCE_INTEGRATION_LOG):
+            return (variables[:num_types].min() - np.log(self.threshold_min_abs_abundance*(1 - EVENT_THRESHOLD_MARGIN))) if num_types > 0 else 1.0
         N_t = variables[:num_types]
         #------------------------------
         abundances_abs = N_t[N_t > 0]
-        # abundances_rel = abundances_abs/np.sum(abundances_abs)
-        # return -1 if np.any(abundances_abs < self.threshold_min_abs_abundance) or np.any(abundances_rel < self.threshold_min_rel_abundance) else 1
-        return -1 if np.any(abundances_abs < self.threshold_min_abs_abundance) else 1
+        return np.log(abundances_abs.min()/(self.threshold_min_abs_abundance*(1 - EVENT_THRESHOLD_MARGIN))) if len(abundances_abs) > 0 else 1.0
     #------------------------------
     event_low_abundance.direction = -1
     event_low_abundance.terminal  = True
@@ -617,7 +833,7 @@ class ConsumerResourceSystem():
     
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    def get_dynamics_params(self, type_indices=None):
+    def get_dynamics_params(self, type_indices=None, as_dict=False):
         type_params     = self.type_set.get_dynamics_params(type_indices)
         mutant_params   = self.mutant_set.get_dynamics_params(self.type_set.get_mutant_indices(type_indices))
         resource_params = self.resource_set.get_dynamics_params()
@@ -651,10 +867,16 @@ class ConsumerResourceSystem():
         #------------------
         resource_decay_rate = (1/resource_params['tau']).ravel()
         #----------------------------------
-        return (tuple(type_params_wmuts.values()) 
-                + tuple(resource_params.values())
-                + (uptake_coeffs, consumption_coeffs, resource_decay_rate)
-                + (self.resource_dynamics_mode, self.resource_set.resource_influx_mode, self.resource_crossfeeding_mode))
+        params = {**type_params_wmuts, 
+                  **resource_params,
+                  'uptake_coeffs':              uptake_coeffs, 
+                  'consumption_coeffs':         consumption_coeffs, 
+                  'resource_decay_rate':        resource_decay_rate,
+                  'resource_dynamics_mode':     self.resource_dynamics_mode, 
+                  'resource_influx_mode':       self.resource_set.resource_influx_mode, 
+                  'resource_crossfeeding_mode': self.resource_crossfeeding_mode}
+        #----------------------------------
+        return params if as_dict else tuple(params.values())
 
     
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -664,6 +886,7 @@ class ConsumerResourceSystem():
         mutant_order = self.type_set.get_mutant_indices(type_order)
         #----------------------------------
         self._N_series = self._N_series.reorder(type_order)
+        self.dense_trajectory.reorder_types(type_order)
         self.type_set.reorder_types(type_order) # don't need to reorder mutant_set because type_set.mutant_indices gets reordered and keeps correct pointers
 
 
@@ -686,6 +909,66 @@ class ConsumerResourceSystem():
         return np.where(self.N_series[:, t_idx] > 0)[0]
 
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_dense_series(self, t=None, dt=None):
+        # Abundances and resource levels evaluated from the dense output (of runs with dense_output=True) at times t,
+        # or on a grid of spacing dt over the span of the dense output, or (by default) at all solver steps; returns (t, N, R)
+        if(t is None):
+            t = np.arange(self.dense_trajectory.t_span[0], self.dense_trajectory.t_span[1], dt) if dt is not None else self.dense_trajectory.knots
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        N, R = self.dense_trajectory.evaluate(t, self.num_types)
+        return (t, N, R)
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_run_metrics(self, as_dataframe=False):
+        # Per-epoch metrics of all run() calls on this system, as a numpy structured array (or pandas DataFrame), with fields given by RUN_METRICS_DTYPE
+        metrics = np.array(getattr(self, '_run_metrics', []), dtype=RUN_METRICS_DTYPE)
+        if(as_dataframe):
+            import pandas as pd
+            return pd.DataFrame(metrics)
+        return metrics
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def discard_history(self):
+        # Keep only the current state (latest time point) in the system's series:
+        self._t_series = utils.ExpandableArray(self._t_series.values[:, -1:], alloc_shape=(self._t_series.alloc[0], 1))
+        self._N_series = utils.ExpandableArray(self._N_series.values[:, -1:], alloc_shape=(self._N_series.alloc[0], 1))
+        self._R_series = utils.ExpandableArray(self._R_series.values[:, -1:], alloc_shape=(self._R_series.alloc[0], 1))
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def clone(self, history=False, share_params=True):
+        # Lightweight alternative to copy.deepcopy(system) for spawning replicate systems:
+        # - parameter arrays of the type, mutant, and resource sets are shared copy-on-write if share_params is True;
+        # - only the current state (and no run metrics) is copied unless history is True.
+        clone = copy.copy(self)
+        #----------------------------------
+        clone.type_set     = self.type_set.clone(share_params=share_params)
+        clone.mutant_set   = self.mutant_set.clone(share_params=share_params)
+        clone.resource_set = self.resource_set.clone(share_params=share_params)
+        #----------------------------------
+        if(history):
+            clone._N_series = self._N_series.copy()
+            clone._R_series = self._R_series.copy()
+            clone._t_series = self._t_series.copy()
+            clone._dense_trajectory = self.dense_trajectory.copy()
+            clone._run_metrics = list(getattr(self, '_run_metrics', []))
+        else:
+            clone._N_series = utils.ExpandableArray(self.N.reshape((self.num_types, 1)), alloc_shape=(max(self.resource_set.num_resources*25, self.num_types), 1))
+            clone._R_series = utils.ExpandableArray(self.R.reshape((self.num_resources, 1)), alloc_shape=(self.resource_set.num_resources, 1))
+            clone._t_series = utils.ExpandableArray([self.t], alloc_shape=(1, 1))
+            clone._dense_trajectory = DenseTrajectory()
+            clone._run_metrics = []
+        #----------------------------------
+        return clone
+
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def combine(self, added_system, merge_on_type_id=True):
@@ -779,6 +1062,85 @@ class ConsumerResourceSystem():
         return self.growth_rate(_N, _R, self.t_series[t_idx], self.type_set.sigma, self.type_set.beta, self.type_set.kappa, self.type_set.eta, self.type_set.lamda, self.type_set.gamma, self.resource_set.rho, self.resource_set.tau, self.resource_set.omega, self.resource_set.alpha, self.resource_set.theta, self.resource_set.phi, self.resource_set.M, self.type_set.energy_costs,  self.resource_dynamics_mode, self.resource_set.resource_influx_mode, self.resource_crossfeeding_mode) 
 
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_fitness_series(self, t_indices=None, chunk=1000):
+        # Growth rates of all types over all (or the given) time indices, evaluated as matrix operations over chunks of
+        # at most `chunk` time points (so intermediates are at most num_types x chunk). Also returns the selection coefficients
+        # s_i = r_i - mean(r) relative to the unweighted mean fitness of the types extant at each time (as in get_fitness_sensitivity()),
+        # and that mean fitness series (nan where no type is extant).
+        time_indices = np.arange(self.t_series.shape[0]) if t_indices is None else np.array(utils.treat_as_list(t_indices))
+        #----------------------------------
+        type_params = self.type_set.get_dynamics_params()
+        consumption_rates_bytrait = np.einsum('ij,ij->ij', type_params['sigma'], type_params['beta']) if type_params['beta'].ndim == 2 else np.einsum('ij,j->ij', type_params['sigma'], type_params['beta'])
+        uptake_coeffs = consumption_rates_bytrait
+        if(self.resource_dynamics_mode != ConsumerResourceSystem.RESOURCE_DYNAMICS_FASTEQ):
+            if(np.any(type_params['lamda'] != 0)):
+                uptake_coeffs = uptake_coeffs * (1 - type_params['lamda'])
+            if(np.any(self.resource_set.omega != 1)):
+                uptake_coeffs = uptake_coeffs * self.resource_set.omega
+        consumption_coeffs  = consumption_rates_bytrait/type_params['kappa']
+        resource_decay_rate = (1/self.resource_set.tau).ravel()
+        gamma               = np.broadcast_to(np.asarray(type_params['gamma']).ravel(), (self.type_set.num_types,))[:, np.newaxis]
+        energy_costs        = type_params['energy_costs'].ravel()[:, np.newaxis]
+        #----------------------------------
+        fitness_series      = np.empty(shape=(self.type_set.num_types, len(time_indices)))
+        mean_fitness_series = np.full(len(time_indices), np.nan)
+        for c in range(0, len(time_indices), chunk):
+            chunk_indices = time_indices[c:c+chunk]
+            N_chunk       = self.N_series[:, chunk_indices]
+            if(self.resource_dynamics_mode == ConsumerResourceSystem.RESOURCE_DYNAMICS_FASTEQ):
+                resource_influx_rate = self.resource_set.get_influx_series(self.t_series[chunk_indices])
+                resource_uptake = resource_influx_rate / (resource_decay_rate[:, np.newaxis] + consumption_coeffs.T @ N_chunk)
+            else:
+                resource_uptake = self.R_series[:, chunk_indices]
+            fitness_chunk = gamma * (uptake_coeffs @ resource_uptake - energy_costs)
+            fitness_series[:, c:c+chunk] = fitness_chunk
+            extant_mask   = (N_chunk > 0)
+            num_extant    = extant_mask.sum(axis=0)
+            np.divide(np.einsum('ij,ij->j', extant_mask, fitness_chunk), num_extant, out=mean_fitness_series[c:c+chunk], where=(num_extant > 0))
+        #----------------------------------
+        selection_series = fitness_series - mean_fitness_series
+        #----------------------------------
+        return (fitness_series, selection_series, mean_fitness_series)
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_fitness_sensitivity(self, t=None, t_index=None, extant_only=False):
+        # Exact derivatives of the fasteq growth rates r_i and selection coefficients s_i = r_i - mean(r) with respect to
+        # the abundance N_k of each type, for a block of time points at once, where mean(r) is the unweighted mean over the types
+        # extant at each time (as in get_fitness_series(); the extant set is constant under small perturbations, so d mean(r) = mean(dr)):
+        #   dr_dN[b, k, i] = -gamma_i * sum_j uptake_ij * rho_j * consumption_kj / (decay_j + sum_k' consumption_k'j * N_k'(t_b))^2
+        # Rows (k) index the perturbed type and columns (i) the responding type. With extant_only, only types
+        # extant at any of the given time points are included; the included type indices are returned as well.
+        if(self.resource_dynamics_mode != ConsumerResourceSystem.RESOURCE_DYNAMICS_FASTEQ):
+            utils.error("Error in ConsumerResourceSystem get_fitness_sensitivity(): Analytic fitness sensitivities are only available for the fasteq resource dynamics mode.")
+        #----------------------------------
+        time_indices = np.array([ np.argmax(self.t_series >= t_) for t_ in utils.treat_as_list(t) ] if t is not None else utils.treat_as_list(t_index) if t_index is not None else [-1])
+        type_indices = np.where(np.any(self.N_series[:, time_indices] > 0, axis=1))[0] if extant_only else np.arange(self.type_set.num_types)
+        #----------------------------------
+        type_params = self.type_set.get_dynamics_params(type_indices)
+        consumption_rates_bytrait = np.einsum('ij,ij->ij', type_params['sigma'], type_params['beta']) if type_params['beta'].ndim == 2 else np.einsum('ij,j->ij', type_params['sigma'], type_params['beta'])
+        uptake_coeffs      = consumption_rates_bytrait
+        consumption_coeffs = consumption_rates_bytrait/type_params['kappa']
+        gamma              = np.broadcast_to(np.asarray(type_params['gamma']).ravel(), (len(type_indices),))
+        #----------------------------------
+        # Excluded types have zero abundance at all of the given times, so they do not contribute to resource depletion:
+        N = self.N_series[type_indices][:, time_indices].T # shape = (num_times, num_types)
+        resource_influx_rate = self.resource_set.get_influx_series(self.t_series[time_indices]).T
+        resource_depletion   = (1/self.resource_set.tau) + N @ consumption_coeffs # shape = (num_times, num_resources)
+        depletion_sensitivity = resource_influx_rate / resource_depletion**2
+        #----------------------------------
+        dr_dN = -np.matmul(consumption_coeffs[np.newaxis, :, :] * depletion_sensitivity[:, np.newaxis, :], (uptake_coeffs * gamma[:, np.newaxis]).T)
+        extant_mask = (N > 0)
+        num_extant  = extant_mask.sum(axis=1)[:, np.newaxis, np.newaxis]
+        dr_dN_sum   = np.einsum('bki,bi->bk', dr_dN, extant_mask)[:, :, np.newaxis]
+        ds_dN = dr_dN - np.divide(dr_dN_sum, num_extant, out=np.zeros(dr_dN_sum.shape), where=(num_extant > 0))
+        #----------------------------------
+        return (dr_dN, ds_dN, type_indices)
+
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def get_most_fit_types(self, rank_cutoff=None, fitness_cutoff=None, t=None, t_index=None):
@@ -0,0 +1,141 @@
+import copy
+import numpy as np
+import numpy.polynomial.chebyshev as chebyshev
+
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Compact dense output of ConsumerResourceSystem.run(..., dense_output=True): for each integration epoch, the solver's step
+# knots and, for each step, the Chebyshev coefficients (in the step's local time s in [-1, 1]) of the solver's interpolating
+# polynomial for the extant types' abundances and the resources. Storage grows with the number of solver steps (not with
+# the resolution of the output), and abundances/resources are evaluated lazily at any times on query.
+#
+# Values are those of the integrated solution: state changes applied by events at the end of an epoch (introduction of a
+# mutant, loss of types) take effect from the start of the next epoch (which is the epoch returned for its start time).
+
+# Polynomial degree of the step interpolants of solve_ivp's methods (by dense output class):
+def get_interpolant_degree(interpolant):
+    interpolant_class = type(interpolant).__name__
+    if(interpolant_class == 'LsodaDenseOutput'):
+        return interpolant.yh.shape[1] - 1
+    elif(interpolant_class in ['RkDenseOutput', 'RadauDenseOutput']):
+        return interpolant.Q.shape[1]
+    elif(interpolant_class == 'Dop853DenseOutput'):
+        return interpolant.F.shape[0]
+    elif(interpolant_class == 'BdfDenseOutput'):
+        return int(interpolant.order)
+    else:
+        utils.error(f"Error in get_interpolant_degree(): Unsupported dense output class {interpolant_class}.")
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class DenseEpoch():
+
+    def __init__(self, ode_solution, type_indices, num_resources, log_abundances=False):
+        # ode_solution: the OdeSolution (sol.sol) of an epoch's solve_ivp(dense_output=True),
+        # whose variables are the abundances (or log abundances) of the types with the given indices, then the resources (then others, not kept)
+        self.type_indices   = np.asarray(type_indices)
+        self.num_resources  = num_resources
+        self.log_abundances = log_abundances
+        self.knots          = np.asarray(ode_solution.ts, dtype=float)
+        #----------------------------------
+        # Sample every step's interpolant at degree+1 Chebyshev nodes (exact for polynomials up to the max degree) and convert to coefficients:
+        num_variables = len(self.type_indices) + num_resources
+        degree        = max(get_interpolant_degree(interpolant) for interpolant in ode_solution.interpolants)
+        nodes         = np.cos(np.pi*(np.arange(degree+1) + 0.5)/(degree+1))
+        step_sizes    = np.diff(self.knots)
+        t_nodes       = self.knots[:-1, None] + (nodes[None, :] + 1)/2 * step_sizes[:, None]
+        values        = ode_solution(t_nodes.ravel())[:num_variables].reshape((num_variables, len(step_sizes), degree+1))
+        self.coeffs   = np.linalg.solve(chebyshev.chebvander(nodes, degree), values.transpose((2, 1, 0)).reshape((degree+1, -1))).reshape((degree+1, len(step_sizes), num_variables))
+
+    @property
+    def t_start(self):
+        return self.knots[0]
+
+    @property
+    def t_end(self):
+        return self.knots[-1]
+
+    @property
+    def num_steps(self):
+        return len(self.knots) - 1
+
+    @property
+    def nbytes(self):
+        return self.knots.nbytes + self.coeffs.nbytes + self.type_indices.nbytes
+
+    def evaluate(self, t):
+        # Returns the values of the epoch's variables (types, then resources) at times t (within the epoch), with shape (num_variables, len(t))
+        t = np.asarray(t, dtype=float)
+        step_indices = np.clip(np.searchsorted(self.knots, t, side='right') - 1, 0, self.num_steps - 1)
+        s = 2*(t - self.knots[step_indices])/(self.knots[step_indices+1] - self.knots[step_indices]) - 1
+        values = chebyshev.chebval(s[:, None], self.coeffs[:, step_indices, :], tensor=False).T
+        if(self.log_abundances):
+            values[:len(self.type_indices)] = np.exp(values[:len(self.type_indices)])
+        return values
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class DenseTrajectory():
+
+    def __init__(self):
+        self.epochs = []
+
+    def add_epoch(self, ode_solution, type_indices, num_resources, log_abundances=False):
+        self.epochs.append(DenseEpoch(ode_solution, type_indices, num_resources, log_abundances))
+
+    @property
+    def num_epochs(self):
+        return len(self.epochs)
+
+    @property
+    def t_span(self):
+        return (self.epochs[0].t_start, self.epochs[-1].t_end) if len(self.epochs) > 0 else None
+
+    @property
+    def knots(self):
+        # All solver step times (e.g., for resampling at the resolution of the integration):
+        return np.unique(np.concatenate([epoch.knots for epoch in self.epochs])) if len(self.epochs) > 0 else np.array([])
+
+    @property
+    def nbytes(self):
+        return sum(epoch.nbytes for epoch in self.epochs)
+
+    def evaluate(self, t, num_types):
+        # Returns (N, R): abundances of the num_types types (0 for types that were not extant) with shape (num_types, len(t)),
+        # and resource levels with shape (num_resources, len(t)), at times t (NaN outside of the span of the dense output)
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+        if(len(self.epochs) == 0):
+            utils.error("Error in DenseTrajectory evaluate(): No dense output has been recorded (run with dense_output=True).")
+        num_resources = self.epochs[0].num_resources
+        N = np.full((num_types, len(t)), np.nan)
+        R = np.full((num_resources, len(t)), np.nan)
+        #----------------------------------
+        # Each time is evaluated in the last epoch starting at or before it (so that epoch boundaries get the post-event state):
+        epoch_starts  = np.array([epoch.t_start for epoch in self.epochs])
+        epoch_indices = np.searchsorted(epoch_starts, t, side='right') - 1
+        for e in np.unique(epoch_indices[(epoch_indices >= 0)]):
+            epoch = self.epochs[e]
+            in_epoch = (epoch_indices == e) & (t <= epoch.t_end)
+            if(not np.any(in_epoch)):
+                continue
+            values = epoch.evaluate(t[in_epoch])
+            N[:, in_epoch] = 0
+            N[epoch.type_indices[:, None], np.where(in_epoch)[0]] = values[:len(epoch.type_indices)]
+            R[:, in_epoch] = values[len(epoch.type_indices):]
+        return (N, R)
+
+    def reorder_types(self, type_order):
+        # Update the epochs' type indices after the system's types are reordered (type_order[new_index] = old_index):
+        new_indices = np.argsort(type_order)
+        for epoch in self.epochs:
+            epoch.type_indices = new_indices[epoch.type_indices]
+
+    def copy(self):
+        # The epochs' arrays are not modified in place, so they are shared:
+        dense_trajectory = DenseTrajectory()
+        dense_trajectory.epochs = [copy.copy(epoch) for epoch in self.epochs]
+        return dense_trajectory
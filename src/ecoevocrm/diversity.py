@@ -0,0 +1,149 @@
+import numpy as np
+import scipy.sparse
+
+import ecoevocrm.coarse_graining as cg
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# All functions take an abundance history of shape (num_types, num_times) -- a numpy array, a np.memmap
+# or other disk-backed array, or a scipy.sparse matrix -- and return one value per time (column). Columns are processed
+# in chunks of at most `chunk` time points, so only num_types x chunk values are held in memory at a time.
+
+DEFAULT_CHUNK = 1000
+
+
+def iter_chunks(abundances, chunk=DEFAULT_CHUNK, membership=None):
+    # Yields (first column, dense block) over chunks of columns; if a (num_groups x num_types) membership matrix is given,
+    # each block is projected onto the groups as it is loaded
+    num_times = abundances.shape[1]
+    if(scipy.sparse.issparse(abundances)):
+        abundances = abundances.tocsc()
+    for c in range(0, num_times, chunk):
+        block = abundances[:, c:c+chunk]
+        block = block.toarray() if scipy.sparse.issparse(block) else np.asarray(block, dtype=float)
+        yield (c, np.asarray(membership @ block) if membership is not None else block)
+
+
+def get_relative_abundances(block):
+    totals = block.sum(axis=0)
+    return np.divide(block, totals, out=np.zeros(block.shape), where=(totals > 0))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def hill_number(p, order):
+    # p: relative abundances of shape (num_types, num_times)
+    if(order == 0):
+        return np.count_nonzero(p > 0, axis=0).astype(float)
+    elif(order == 1):
+        return np.exp(shannon_entropy_from_relabds(p))
+    elif(np.isinf(order)):
+        max_p = p.max(axis=0)
+        return np.divide(1, max_p, out=np.zeros(p.shape[1]), where=(max_p > 0))
+    else:
+        p_sum = np.power(p, order, out=np.zeros(p.shape), where=(p > 0)).sum(axis=0)
+        return np.power(p_sum, 1/(1-order), out=np.zeros(p.shape[1]), where=(p_sum > 0))
+
+
+def shannon_entropy_from_relabds(p):
+    return -np.sum(p * np.log(p, out=np.zeros(p.shape), where=(p > 0)), axis=0)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def hill_numbers(abundances, order=1, chunk=DEFAULT_CHUNK, membership=None):
+    # Hill number (effective number of types) of any order q: 0 = richness, 1 = exp(Shannon entropy), 2 = inverse Simpson, inf = inverse Berger-Parker
+    orders  = utils.treat_as_list(order)
+    results = np.zeros((len(orders), abundances.shape[1]))
+    for c, block in iter_chunks(abundances, chunk, membership):
+        p = get_relative_abundances(block)
+        for i, q in enumerate(orders):
+            results[i, c:c+block.shape[1]] = hill_number(p, q)
+    return results if isinstance(order, (list, np.ndarray)) else results[0]
+
+
+def shannon_entropy(abundances, chunk=DEFAULT_CHUNK, membership=None):
+    entropy = np.zeros(abundances.shape[1])
+    for c, block in iter_chunks(abundances, chunk, membership):
+        entropy[c:c+block.shape[1]] = shannon_entropy_from_relabds(get_relative_abundances(block))
+    return entropy
+
+
+def simpson_index(abundances, chunk=DEFAULT_CHUNK, membership=None):
+    # Gini-Simpson index: probability that two individuals drawn at random belong to different types
+    simpson = np.zeros(abundances.shape[1])
+    for c, block in iter_chunks(abundances, chunk, membership):
+        p = get_relative_abundances(block)
+        simpson[c:c+block.shape[1]] = np.where(block.sum(axis=0) > 0, 1 - np.sum(p**2, axis=0), 0)
+    return simpson
+
+
+def richness(abundances, chunk=DEFAULT_CHUNK, membership=None):
+    num_present = np.zeros(abundances.shape[1], dtype=int)
+    for c, block in iter_chunks(abundances, chunk, membership):
+        num_present[c:c+block.shape[1]] = np.count_nonzero(block > 0, axis=0)
+    return num_present
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def phylogenetic_diversity(phylogeny_index, abundances, chunk=DEFAULT_CHUNK):
+    # Faith's phylogenetic diversity with unit branch lengths: the number of lineage tree nodes (i.e., branches leading to them)
+    # on the paths from the roots to the types present at each time. A node is on such a path iff its subtree contains a present type.
+    clade_starts = np.arange(phylogeny_index.num_nodes)
+    pd = np.zeros(abundances.shape[1], dtype=int)
+    for c, block in iter_chunks(abundances, chunk):
+        prefix_counts = phylogeny_index.get_prefix_sums((block > 0).astype(int))
+        pd[c:c+block.shape[1]] = np.count_nonzero((prefix_counts[phylogeny_index.ends] - prefix_counts[clade_starts]) > 0, axis=0)
+    return pd
+
+
+def functional_diversity(sigma, abundances, trait_subset=None, chunk=DEFAULT_CHUNK):
+    # Rao's quadratic entropy sum_ij p_i p_j d_ij with d_ij the fraction of traits in trait_subset at which types i and j differ.
+    # For binary traits this equals the mean over traits of 2 f_k (1 - f_k), with f_k the abundance-weighted frequency of trait k.
+    trait_subset = list(range(sigma.shape[1])) if trait_subset is None else list(trait_subset)
+    trait_bits   = (np.asarray(sigma)[:, trait_subset] != 0).astype(float)
+    rao = np.zeros(abundances.shape[1])
+    for c, block in iter_chunks(abundances, chunk):
+        trait_freqs = trait_bits.T @ get_relative_abundances(block)
+        rao[c:c+block.shape[1]] = np.mean(2 * trait_freqs * (1 - trait_freqs), axis=0)
+    return rao
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_diversity_series(system, metric='hill', order=1, grouping='types', trait_subset=None, phylogeny_depth=None, mode='branchings', t_index=None, abundances=None, chunk=DEFAULT_CHUNK):
+    # Diversity of the system at every recorded (or the given) time index.
+    #   metric:     'hill' (of the given order), 'shannon', 'simpson', 'richness', 'phylogenetic', or 'functional'
+    #   grouping:   'types' (default), 'functional' (groups by trait profile over trait_subset, or all traits if None), or 'phylogenetic' (clades at phylogeny_depth)
+    #               for the abundance-based metrics; the phylogenetic and functional metrics are always computed over types
+    #   abundances: abundance history to use in place of system.N_series (e.g., a sparse or memory-mapped history)
+    abundances = system.N_series if abundances is None else abundances
+    if(t_index is not None):
+        abundances = abundances[:, t_index]
+    #----------------------------------
+    if(metric == 'phylogenetic'):
+        return phylogenetic_diversity(system.type_set.phylogeny_index, abundances, chunk=chunk)
+    elif(metric == 'functional'):
+        return functional_diversity(system.type_set.sigma, abundances, trait_subset=trait_subset, chunk=chunk)
+    #----------------------------------
+    # Group abundances are projected chunk by chunk rather than materializing the full group abundance history:
+    membership = None
+    if(grouping == 'functional'):
+        group_ids, membership = cg.get_functional_group_membership(system, trait_subset)
+    elif(grouping == 'phylogenetic'):
+        group_ids, membership = cg.get_phylogenetic_group_membership(system, phylogeny_depth, mode=mode)
+    elif(grouping != 'types'):
+        utils.error(f"Error in get_diversity_series(): grouping '{grouping}' is not recognized.")
+    #----------------------------------
+    if(metric == 'hill'):
+        return hill_numbers(abundances, order=order, chunk=chunk, membership=membership)
+    elif(metric == 'shannon'):
+        return shannon_entropy(abundances, chunk=chunk, membership=membership)
+    elif(metric == 'simpson'):
+        return simpson_index(abundances, chunk=chunk, membership=membership)
+    elif(metric == 'richness'):
+        return richness(abundances, chunk=chunk, membership=membership)
+    else:
+        utils.error(f"Error in get_diversity_series(): diversity metric '{metric}' is not recognized.")
@@ -0,0 +1,351 @@
+import functools
+import numpy as np
+import scipy.integrate
+import scipy.sparse
+
+from ecoevocrm.consumer_resource_system import *
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class SystemEnsemble():
+
+    # Integrates K independent ConsumerResourceSystems that share dimensions (number of resources and dynamics modes)
+    # as a single batched ODE system, so that the python-level overhead of each RHS evaluation is paid once per ensemble.
+    # Member parameters are stacked into (K x types x L) arrays, where the type dimension is padded to the
+    # largest number of extant types among the members (padded entries have zero abundance and zero coefficients).
+    # Mutation and low abundance events are tracked per member; only the members whose events trigger are
+    # handed to their own handle_mutation_event()/handle_type_loss() between integration epochs.
+
+    def __init__(self, systems):
+
+        self.systems = list(systems)
+
+        if(len(self.systems) == 0):
+            utils.error("Error in SystemEnsemble __init__(): At least one system must be provided.")
+
+        ref_system = self.systems[0]
+        for system in self.systems:
+            if(not isinstance(system, ConsumerResourceSystem)):
+                utils.error("Error in SystemEnsemble __init__(): systems argument expects a list of ConsumerResourceSystem objects.")
+            if(system.num_resources != ref_system.num_resources):
+                utils.error(f"Error in SystemEnsemble __init__(): All systems must have the same number of resources ({system.num_resources} != {ref_system.num_resources}).")
+            if(system.resource_dynamics_mode != ref_system.resource_dynamics_mode or system.resource_crossfeeding_mode != ref_system.resource_crossfeeding_mode):
+                utils.error("Error in SystemEnsemble __init__(): All systems must have the same resource dynamics and crossfeeding modes.")
+            if(system.abundance_integration_mode != ref_system.abundance_integration_mode):
+                utils.error("Error in SystemEnsemble __init__(): All systems must have the same abundance integration mode.")
+            if(system.abundance_integration_mode == ConsumerResourceSystem.ABUNDANCE_INTEGRATION_LOG):
+                # (the batched RHS integrates abundances, and its padded type entries have zero abundance, which has no log)
+                utils.error("Error in SystemEnsemble __init__(): Log abundance integration is not supported for ensembles; use abundance_integration_mode='linear' for the members.")
+            if(system.t != ref_system.t):
+                utils.error(f"Error in SystemEnsemble __init__(): All systems must be at the same time (t={system.t} != t={ref_system.t}).")
+
+        self.resource_dynamics_mode     = ref_system.resource_dynamics_mode
+        self.resource_crossfeeding_mode = ref_system.resource_crossfeeding_mode
+
+        self.threshold_mutation_propensities = None # are updated in run()
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    @property
+    def num_members(self):
+        return len(self.systems)
+
+    @property
+    def num_resources(self):
+        return self.systems[0].num_resources
+
+    @property
+    def t(self):
+        return self.systems[0].t
+
+    def __len__(self):
+        return self.num_members
+
+    def __getitem__(self, index):
+        return self.systems[index]
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def run(self, T, dt=None, integration_method='default', reorder_types_by_phylogeny=True):
+
+        t_start   = self.t
+        t_elapsed = 0
+
+        K = self.num_members
+        L = self.num_resources
+
+        for system in self.systems:
+            system._t_series.expand_alloc((system._t_series.alloc[0], system._t_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+            system._N_series.expand_alloc((system._N_series.alloc[0], system._N_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+            system._R_series.expand_alloc((system._R_series.alloc[0], system._R_series.alloc[1]+int(T/dt if dt is not None else 10000)))
+
+        # Each member keeps its own Gillespie threshold and cumulative mutation propensity across integration epochs;
+        # these are reset only for members whose mutation event triggered:
+        self.threshold_mutation_propensities = np.random.exponential(1, size=K)
+        cumPropMut = np.zeros(K)
+
+        while(t_elapsed < T):
+
+            #------------------------------
+            # Set initial conditions and integration variables:
+            #------------------------------
+
+            active_type_indices = [system.extant_type_indices for system in self.systems]
+
+            params = self.get_dynamics_params(active_type_indices)
+            S      = params['num_types']
+
+            N_init = np.zeros((K, S))
+            for k, system in enumerate(self.systems):
+                N_init[k, :len(active_type_indices[k])] = system.N[active_type_indices[k]]
+            R_init = np.array([system.R for system in self.systems])
+            init_cond = np.concatenate([N_init.ravel(), R_init.ravel(), cumPropMut])
+
+            # Set the integration method:
+            if(integration_method == 'default'):
+                # Members are uncoupled, so the jacobian is block diagonal;
+                # implicit methods that accept a sparsity structure only need ~(S+L+1) RHS evaluations per jacobian estimate:
+                _integration_method = 'BDF'
+            else:
+                _integration_method = integration_method
+            solver_kwargs = {'jac_sparsity': self.get_jacobian_sparsity(S)} if _integration_method in ['BDF', 'Radau'] else {}
+
+            # Define the set of events that may trigger:
+            events = []
+            event_members = []
+            for k, system in enumerate(self.systems):
+                if(np.any(system.type_set.mu > 0)):
+                    events.append(self.get_event_mutation(k))
+                    event_members.append((k, 'mutation'))
+                if(system.check_event_low_abundance):
+                    events.append(self.get_event_low_abundance(k, S))
+                    event_members.append((k, 'low_abundance'))
+
+            #------------------------------
+            # Integrate the ensemble dynamics:
+            #------------------------------
+
+            # (epochs end at the next discontinuity of any member's resource influx, so that the solver does not step over it)
+            t_span = (self.t, min([t_start+T] + [system.resource_set.next_breakpoint(self.t) for system in self.systems]))
+            ends_at_breakpoint = (t_span[1] < t_start+T)
+            t_eval = ConsumerResourceSystem.get_epoch_t_eval(t_span, dt)
+
+            sol = scipy.integrate.solve_ivp(self.dynamics,
+                                             y0       = init_cond,
+                                             args     = (params,),
+                                             t_span   = t_span,
+                                             t_eval   = t_eval,
+                                             events   = events,
+                                             method   = _integration_method,
+                                             max_step = min([min(system.max_time_step, system.resource_set.max_step_hint) for system in self.systems]),
+                                             **solver_kwargs )
+
+            #------------------------------
+            # Update each member's trajectories with latest dynamics epoch:
+            #------------------------------
+
+            N_sol = sol.y[:K*S].reshape((K, S, len(sol.t)))
+            R_sol = sol.y[K*S:K*S+K*L].reshape((K, L, len(sol.t)))
+
+            for k, system in enumerate(self.systems):
+                N_epoch = np.zeros(shape=(system._N_series.shape[0], len(sol.t)))
+                N_epoch[active_type_indices[k]] = N_sol[k, :len(active_type_indices[k])]
+                system._t_series.add(sol.t[1:], axis=1)
+                system._N_series.add(N_epoch[:, 1:], axis=1)
+                system._R_series.add(R_sol[k, :, 1:], axis=1)
+
+            cumPropMut = sol.y[-K:, -1].copy()
+
+            t_elapsed = self.t - t_start
+
+            #------------------------------
+            # Handle events and update the members' states accordingly:
+            #------------------------------
+            if(sol.status == 1): # An event occurred
+                growth_rate, mutation_propensities = self.rates(sol.t[-1], sol.y[:, -1], params)[2:]
+                for e, (k, event_type) in enumerate(event_members):
+                    if(len(sol.t_events[e]) == 0):
+                        continue
+                    system = self.systems[k]
+                    num_active_types = len(active_type_indices[k])
+                    if(event_type == 'mutation'):
+                        system._active_type_indices   = active_type_indices[k]
+                        system.mutant_fitnesses       = growth_rate[k, S:S+num_active_types*L]
+                        system.mutation_propensities  = mutation_propensities[k, :num_active_types*L]
+                        if(np.sum(system.mutation_propensities) > 0):
+                            system.handle_mutation_event()
+                            system.handle_type_loss()
+                        cumPropMut[k] = 0
+                        self.threshold_mutation_propensities[k] = np.random.exponential(1)
+                    elif(event_type == 'low_abundance'):
+                        system.handle_type_loss()
+            elif(sol.status == 0 and ends_at_breakpoint): # Reached a breakpoint of a resource influx (integration continues from it)
+                pass
+            elif(sol.status == 0): # Reached end T successfully
+                for system in self.systems:
+                    system.handle_type_loss()
+            else: # Error occurred in integration
+                utils.error("Error in SystemEnsemble run(): Integration of dynamics using scipy.solve_ivp returned with error status.")
+
+        #------------------------------
+        # Finalize data series at end of integration period:
+        #------------------------------
+
+        for system in self.systems:
+            system._t_series.trim()
+            system._N_series.trim()
+            system._R_series.trim()
+            if(reorder_types_by_phylogeny):
+                system.reorder_types()
+
+        return
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_dynamics_params(self, type_indices):
+        K = self.num_members
+        L = self.num_resources
+        S = max(max([len(idx) for idx in type_indices]), 1)
+        #----------------------------------
+        # Stacked (padded) parameter arrays, with type rows followed by mutant rows:
+        uptake_coeffs       = np.zeros((K, S+S*L, L))
+        consumption_coeffs  = np.zeros((K, S+S*L, L))
+        energy_costs        = np.zeros((K, S+S*L))
+        gamma               = np.zeros((K, S+S*L))
+        mu                  = np.zeros((K, S))
+        lamda               = np.zeros((K, S, L)) if self.resource_crossfeeding_mode == ConsumerResourceSystem.RESOURCE_CROSSFEEDING_HETEROTYPES else np.zeros((K, L))
+        M                   = np.zeros((K, L, L))
+        rho                 = np.zeros((K, L))
+        resource_decay_rate = np.zeros((K, L))
+        rho_fns             = [None for k in range(K)]
+        #----------------------------------
+        for k, system in enumerate(self.systems):
+            n = len(type_indices[k])
+            p = system.get_dynamics_params(type_indices[k], as_dict=True)
+            rows = np.concatenate([np.arange(n), S+np.arange(n*L)])
+            #------------------
+            uptake_coeffs[k, rows]      = p['uptake_coeffs']
+            consumption_coeffs[k, rows] = p['consumption_coeffs']
+            energy_costs[k, rows]       = p['energy_costs']
+            gamma[k, rows]              = np.ravel(p['gamma']) if np.ndim(p['gamma']) == 2 else p['gamma']
+            mu[k, :n]                   = np.ravel(p['mu'])[:n] if np.ndim(p['mu']) == 2 else p['mu']
+            if(self.resource_crossfeeding_mode == ConsumerResourceSystem.RESOURCE_CROSSFEEDING_HETEROTYPES):
+                lamda[k, :n] = p['lamda'][:n]
+            elif(self.resource_crossfeeding_mode == ConsumerResourceSystem.RESOURCE_CROSSFEEDING_HOMOTYPES):
+                lamda[k] = p['lamda']
+            if(p['M'] is not None):
+                M[k] = p['M']
+            #------------------
+            if(p['resource_influx_mode'] == ResourceSet.RESOURCE_INFLUX_CONSTANT):
+                rho[k] = p['rho']
+            else:
+                rho_fns[k] = functools.partial(ResourceSet.resource_influx, p['rho'], resource_influx_mode=p['resource_influx_mode'], alpha=p['alpha'], theta=p['theta'], phi=p['phi'])
+            resource_decay_rate[k] = p['resource_decay_rate']
+        #----------------------------------
+        return {'num_members':         K,
+                'num_types':           S,
+                'num_resources':       L,
+                'uptake_coeffs':       uptake_coeffs,
+                'consumption_coeffs':  consumption_coeffs,
+                'energy_costs':        energy_costs,
+                'gamma':               gamma,
+                'mu':                  mu,
+                'lamda':               lamda,
+                'M':                   M,
+                'rho':                 rho,
+                'rho_fns':             rho_fns if any(fn is not None for fn in rho_fns) else None,
+                'resource_decay_rate': resource_decay_rate}
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_jacobian_sparsity(self, num_types):
+        K = self.num_members
+        L = self.num_resources
+        S = num_types
+        #----------------------------------
+        # Variables are ordered [N (K*S), R (K*L), cumPropMut (K)]; each member's variables only depend on each other:
+        member_of_var = np.concatenate([np.repeat(np.arange(K), S), np.repeat(np.arange(K), L), np.arange(K)])
+        return scipy.sparse.csr_matrix(member_of_var[:, None] == member_of_var[None, :])
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def rates(self, t, variables, params):
+        K = params['num_members']
+        S = params['num_types']
+        L = params['num_resources']
+        #------------------------------
+        N_t = variables[:K*S].reshape((K, S))
+        R_t = variables[K*S:K*S+K*L].reshape((K, L))
+        #------------------------------
+        resource_influx_rate = params['rho'].copy()
+        if(params['rho_fns'] is not None):
+            for k, rho_fn in enumerate(params['rho_fns']):
+                if(rho_fn is not None):
+                    resource_influx_rate[k] = rho_fn(t).ravel()
+        #------------------------------
+        consumption_coeffs = params['consumption_coeffs'][:, :S]
+        if(self.resource_dynamics_mode == ConsumerResourceSystem.RESOURCE_DYNAMICS_FASTEQ):
+            resource_uptake = resource_influx_rate / (params['resource_decay_rate'] + np.einsum('kij,ki->kj', consumption_coeffs, N_t))
+            energy_uptake   = np.einsum('kij,kj->ki', params['uptake_coeffs'], resource_uptake)
+            dRdt            = np.zeros((K, L))
+        elif(self.resource_dynamics_mode == ConsumerResourceSystem.RESOURCE_DYNAMICS_EXPLICIT):
+            energy_uptake   = np.einsum('kij,kj->ki', params['uptake_coeffs'], R_t)
+            if(self.resource_crossfeeding_mode == ConsumerResourceSystem.RESOURCE_CROSSFEEDING_HETEROTYPES):
+                resource_consumption_terms = np.einsum('kij,ki,kj->kij', consumption_coeffs, N_t, R_t)
+                resource_consumption_rate  = np.sum(resource_consumption_terms, axis=1)
+                resource_leak_rate         = np.einsum('kij,kij->kj', params['lamda'], resource_consumption_terms)
+            else:
+                resource_consumption_rate  = np.einsum('kij,ki->kj', consumption_coeffs, N_t) * R_t
+                resource_leak_rate         = params['lamda'] * resource_consumption_rate
+            dRdt = resource_influx_rate - params['resource_decay_rate']*R_t - resource_consumption_rate
+            if(self.resource_crossfeeding_mode != ConsumerResourceSystem.RESOURCE_CROSSFEEDING_NONE):
+                dRdt += np.einsum('kij,kj->ki', params['M'], resource_leak_rate)
+        #------------------------------
+        growth_rate = params['gamma'] * (energy_uptake - params['energy_costs'])
+        #------------------------------
+        mutation_propensities = np.maximum(0, growth_rate[:, S:] * np.repeat(N_t * params['mu'], repeats=L, axis=1))
+        #------------------------------
+        return (N_t, dRdt, growth_rate, mutation_propensities)
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def dynamics(self, t, variables, params):
+        N_t, dRdt, growth_rate, mutation_propensities = self.rates(t, variables, params)
+        #------------------------------
+        dNdt        = N_t * growth_rate[:, :params['num_types']]
+        dCumPropMut = np.sum(mutation_propensities, axis=1)
+        #------------------------------
+        return np.concatenate((dNdt.ravel(), dRdt.ravel(), dCumPropMut))
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_event_mutation(self, member_index):
+        def event_mutation(t, variables, *args):
+            cumulative_mutation_propensity = variables[-self.num_members+member_index]
+            return self.threshold_mutation_propensities[member_index] - cumulative_mutation_propensity
+        event_mutation.direction = -1
+        event_mutation.terminal  = True
+        return event_mutation
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_event_low_abundance(self, member_index, num_types):
+        # Smooth in the state, as ConsumerResourceSystem.event_low_abundance()
+        event_threshold = self.systems[member_index].threshold_min_abs_abundance * (1 - EVENT_THRESHOLD_MARGIN)
+        def event_low_abundance(t, variables, *args):
+            N_t = variables[member_index*num_types:(member_index+1)*num_types]
+            abundances_abs = N_t[N_t > 0]
+            return np.log(abundances_abs.min()/event_threshold) if len(abundances_abs) > 0 else 1.0
+        event_low_abundance.direction = -1
+        event_low_abundance.terminal  = True
+        return event_low_abundance
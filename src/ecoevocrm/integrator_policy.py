@@ -0,0 +1,147 @@
+import numpy as np
+
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Integrator policies choose the solve_ivp method and tolerances of each integration epoch of ConsumerResourceSystem.run()
+# (used with run(integration_method='auto'), optionally run(..., integrator_policy=IntegratorPolicy(...))).
+#
+# The policy keeps, for each community size class (extant types binned by powers of 2), the mean wall time per epoch each
+# method has cost so far in the run (epoch durations are set by the dynamics' events, not by the method, so this is a fair
+# comparison; wall time per unit of simulated time is not, being dominated by which method happened to get the long epochs). Exploration starts with LSODA, whose solver statistics reveal stiffness
+# (LSODA only evaluates jacobians after switching to its stiff BDF method): if the dynamics were stiff, the implicit methods
+# (BDF, and Radau for communities up to threshold_precise_integrator types) are tried next; otherwise, for communities larger
+# than threshold_precise_integrator types, the explicit RK45 is (for smaller non-stiff communities, LSODA's own non-stiff
+# Adams method needs fewer RHS evaluations per step than RK45 and trying RK45 does not pay off).
+# Once every candidate has been tried for trial_epochs epochs (or abandoned after costing more than abandon_factor times
+# the cheapest so far), the cheapest one is used for the rest of the run (for that size class). A new size class starts
+# from what was learned for the nearest size class seen so far (its stiffness, and its best method first). A method whose integration fails is dropped for that size class, and the epoch is re-integrated
+# with the fallback method. Since choices depend on measured wall times, runs with 'auto' are not bit-for-bit reproducible.
+#
+# Absolute tolerances are tied to threshold_min_abs_abundance: abundances are resolved to abundance_atol_fraction of the
+# threshold (with log abundance integration, log abundances are resolved to abundance_atol_fraction, i.e., the same relative
+# error at the threshold), which is far looser than solve_ivp's default atol=1e-6 for abundances that are usually >> 1.
+
+IMPLICIT_METHODS = ['BDF', 'Radau']
+EXPLICIT_METHODS = ['RK45']
+
+
+class IntegratorPolicy():
+
+    def __init__(self, rtol=1e-3, abundance_atol_fraction=1e-3, resource_atol=1e-6, propensity_atol=1e-6,
+                 trial_epochs=3, abandon_factor=2.0, fallback_method='LSODA', methods=None):
+        self.rtol                    = rtol
+        self.abundance_atol_fraction = abundance_atol_fraction
+        self.resource_atol           = resource_atol
+        self.propensity_atol         = propensity_atol
+        self.trial_epochs            = trial_epochs
+        self.abandon_factor          = abandon_factor
+        self.fallback_method         = fallback_method
+        self.methods                 = ['LSODA'] + IMPLICIT_METHODS + EXPLICIT_METHODS if methods is None else utils.treat_as_list(methods)
+        if(fallback_method not in self.methods):
+            utils.error(f"Error in IntegratorPolicy __init__(): fallback_method ('{fallback_method}') must be one of the methods ({self.methods}).")
+        self.reset()
+
+    def get_config(self):
+        # The settings that determine the policy's choices (e.g., for ResultCache keys):
+        return {'rtol': self.rtol, 'abundance_atol_fraction': self.abundance_atol_fraction, 'resource_atol': self.resource_atol, 'propensity_atol': self.propensity_atol,
+                'trial_epochs': self.trial_epochs, 'abandon_factor': self.abandon_factor, 'fallback_method': self.fallback_method, 'methods': self.methods}
+
+    def reset(self):
+        # Forget the costs observed so far (called by run() at the start of every run):
+        self._stats = {}
+
+    @staticmethod
+    def get_size_class(num_extant_types):
+        return int(np.log2(max(num_extant_types, 1)))
+
+    def _get_class_stats(self, num_extant_types):
+        size_class = IntegratorPolicy.get_size_class(num_extant_types)
+        if(size_class not in self._stats):
+            # Start from what was learned for the nearest size class seen so far:
+            nearest_class = min(self._stats.keys(), key=lambda seen_class: abs(seen_class - size_class)) if len(self._stats) > 0 else None
+            self._stats[size_class] = {'methods': {}, 'failed': set(),
+                                       'stiff':     self._stats[nearest_class]['stiff'] if nearest_class is not None else None,
+                                       'preferred': self.get_best_method(nearest_class) if nearest_class is not None else None}
+        return self._stats[size_class]
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_candidates(self, system, num_extant_types):
+        # Methods to consider for this community size, in order of exploration:
+        class_stats = self._get_class_stats(num_extant_types)
+        if(class_stats['stiff'] is None):
+            candidates = [self.fallback_method]
+        elif(class_stats['stiff']):
+            candidates = [self.fallback_method] + [method for method in IMPLICIT_METHODS if method != 'Radau' or num_extant_types <= system.threshold_precise_integrator]
+        else:
+            candidates = [self.fallback_method] + (EXPLICIT_METHODS if num_extant_types > system.threshold_precise_integrator else [])
+        if(class_stats['preferred'] in candidates):
+            candidates = [class_stats['preferred']] + candidates
+        return [method for method in dict.fromkeys(candidates) if method in self.methods and (method not in class_stats['failed'] or method == self.fallback_method)]
+
+    def select_method(self, system, num_extant_types):
+        class_stats = self._get_class_stats(num_extant_types)
+        candidates  = self.get_candidates(system, num_extant_types)
+        # Explore candidates that have not been tried for trial_epochs epochs yet (unless already much costlier than the cheapest):
+        min_cost = min(self.get_cost(num_extant_types, method) for method in candidates)
+        for method in candidates:
+            num_trial_epochs = class_stats['methods'].get(method, {'epochs': 0})['epochs']
+            if(num_trial_epochs < self.trial_epochs and not (num_trial_epochs > 0 and self.get_cost(num_extant_types, method) > self.abandon_factor*min_cost)):
+                return method
+        # Otherwise, use the cheapest one:
+        return min(candidates, key=lambda method: self.get_cost(num_extant_types, method))
+
+    @staticmethod
+    def get_method_cost(method_stats):
+        # Mean wall time per epoch:
+        return method_stats['wall_time']/method_stats['epochs'] if method_stats is not None and method_stats['epochs'] > 0 else np.inf
+
+    def get_cost(self, num_extant_types, method):
+        return IntegratorPolicy.get_method_cost(self._get_class_stats(num_extant_types)['methods'].get(method))
+
+    def get_best_method(self, size_class):
+        costs = {method: IntegratorPolicy.get_method_cost(method_stats) for method, method_stats in self._stats[size_class]['methods'].items()}
+        return min(costs, key=costs.get) if len(costs) > 0 else None
+
+    def get_tolerances(self, system, num_extant_types):
+        # Returns (rtol, atol), with atol given per variable (abundances, resources, cumulative mutation propensity):
+        log_abundances = (system.abundance_integration_mode == system.ABUNDANCE_INTEGRATION_LOG)
+        abundance_atol = self.abundance_atol_fraction * (1 if log_abundances else system.threshold_min_abs_abundance)
+        atol = np.concatenate([np.full(num_extant_types, abundance_atol), np.full(system.num_resources, self.resource_atol), [self.propensity_atol]])
+        return (self.rtol, atol)
+
+    def select(self, system, num_extant_types):
+        # Returns the method and solve_ivp keyword args for the next epoch:
+        method     = self.select_method(system, num_extant_types)
+        rtol, atol = self.get_tolerances(system, num_extant_types)
+        return (method, {'rtol': rtol, 'atol': atol})
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def update(self, num_extant_types, method, sol, wall_time):
+        # Record the outcome of an epoch integrated with the given method:
+        class_stats = self._get_class_stats(num_extant_types)
+        if(sol.status == -1):
+            class_stats['failed'].add(method)
+            return
+        method_stats = class_stats['methods'].setdefault(method, {'epochs': 0, 'wall_time': 0.0, 'simulated_time': 0.0, 'nfev': 0, 'njev': 0})
+        method_stats['epochs']         += 1
+        method_stats['wall_time']      += wall_time
+        method_stats['simulated_time'] += sol.t[-1] - sol.t[0]
+        method_stats['nfev']           += sol.nfev
+        method_stats['njev']           += sol.njev
+        if(method == 'LSODA'):
+            # LSODA evaluates jacobians only when it has switched to its stiff method:
+            class_stats['stiff'] = bool(class_stats['stiff']) or sol.njev > 0
+        elif(class_stats['stiff'] is None):
+            class_stats['stiff'] = method in IMPLICIT_METHODS
+
+    def get_choices(self):
+        # The current best method (by observed cost) for each community size class seen so far (keyed by the smallest size in the class), with the observed costs:
+        choices = {}
+        for size_class, class_stats in sorted(self._stats.items()):
+            costs = {method: IntegratorPolicy.get_method_cost(method_stats) for method, method_stats in class_stats['methods'].items()}
+            choices[2**size_class] = {'best': self.get_best_method(size_class), 'stiff': class_stats['stiff'], 'costs': costs, 'failed': sorted(class_stats['failed'])}
+        return choices
@@ -0,0 +1,157 @@
+import abc
+import numpy as np
+
+import ecoevocrm.coarse_graining as cg
+import ecoevocrm.diversity as diversity
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Observers compute summaries of a ConsumerResourceSystem while it runs, so that long runs can keep only the summaries
+# (e.g., with run(record_history=False)). Pass them to run(observers=[...]); after each integration epoch, every observer's
+# observe() is called with the time points recorded in that epoch (or only the epoch endpoint, if every='epoch'), after
+# mutation and type loss events have been applied -- i.e., with exactly the values that would be stored in the history.
+
+
+class Observer(abc.ABC):
+
+    def __init__(self, name=None, every='step'):
+        if(every not in ['step', 'epoch']):
+            utils.error(f"Error in Observer __init__(): every must be 'step' or 'epoch' (given '{every}').")
+        self.name  = type(self).__name__ if name is None else name
+        self.every = every
+        self._t_blocks     = []
+        self._value_blocks = []
+
+    @property
+    def num_observations(self):
+        return sum(len(t_block) for t_block in self._t_blocks)
+
+    @property
+    def t_series(self):
+        return np.concatenate(self._t_blocks) if len(self._t_blocks) > 0 else np.array([])
+
+    @property
+    def values(self):
+        return np.concatenate(self._value_blocks, axis=-1) if len(self._value_blocks) > 0 else np.array([])
+
+    def observe(self, system, t, N, R):
+        # t: recorded times (k,); N: abundances (num_types, k); R: resource levels (num_resources, k)
+        self._t_blocks.append(np.array(t))
+        self._value_blocks.append(self.reduce(system, t, N, R))
+
+    @abc.abstractmethod
+    def reduce(self, system, t, N, R):
+        # Returns the summary values for the given time points, with time along the last axis
+        pass
+
+    def reset(self):
+        self._t_blocks     = []
+        self._value_blocks = []
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class FunctionObserver(Observer):
+
+    # Summary given by a function fn(system, t, N, R) returning an array with time along the last axis.
+
+    def __init__(self, fn, name=None, every='step'):
+        super().__init__(name=(fn.__name__ if name is None else name), every=every)
+        self.fn = fn
+
+    def reduce(self, system, t, N, R):
+        return np.asarray(self.fn(system, t, N, R))
+
+
+class BiomassObserver(Observer):
+
+    def reduce(self, system, t, N, R):
+        return np.sum(N, axis=0)
+
+
+class DiversityObserver(Observer):
+
+    # Any metric of diversity.get_diversity_series() (with its order, grouping, trait_subset, phylogeny_depth, and mode args).
+
+    def __init__(self, metric='hill', name=None, every='step', **diversity_args):
+        super().__init__(name=(f"{metric}_diversity" if name is None else name), every=every)
+        self.metric = metric
+        self.diversity_args = diversity_args
+
+    def reduce(self, system, t, N, R):
+        return np.asarray(diversity.get_diversity_series(system, metric=self.metric, abundances=N, **self.diversity_args))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class GroupAbundanceObserver(Observer):
+
+    # Base for observers of group abundances; groups (and their ids) may appear as the run goes on,
+    # so values are assembled into a (num_groups, num_observations) array, with group_ids, only on request.
+
+    def __init__(self, name=None, every='step', relative_abundance=False):
+        super().__init__(name=name, every=every)
+        self.relative_abundance = relative_abundance
+        self._id_blocks = []
+
+    @property
+    def group_ids(self):
+        return list(dict.fromkeys(group_id for id_block in self._id_blocks for group_id in id_block))
+
+    @property
+    def values(self):
+        group_indices = {group_id: i for i, group_id in enumerate(self.group_ids)}
+        values = np.zeros((len(group_indices), self.num_observations))
+        c = 0
+        for id_block, value_block in zip(self._id_blocks, self._value_blocks):
+            values[[group_indices[group_id] for group_id in id_block], c:c+value_block.shape[1]] = value_block
+            c += value_block.shape[1]
+        return values
+
+    def observe(self, system, t, N, R):
+        group_ids, group_abds = self.reduce(system, t, N, R)
+        if(self.relative_abundance):
+            total_abundances = group_abds.sum(axis=0)
+            group_abds = np.divide(group_abds, total_abundances, out=np.full(group_abds.shape, np.nan), where=(total_abundances > 0))
+        self._t_blocks.append(np.array(t))
+        self._id_blocks.append(group_ids)
+        self._value_blocks.append(group_abds)
+
+    def reduce(self, system, t, N, R):
+        return self.get_group_abundances(system, N)
+
+    @abc.abstractmethod
+    def get_group_abundances(self, system, N):
+        # Returns (group_ids, group abundances of shape (num_groups, k)) for the given abundances
+        pass
+
+    def reset(self):
+        super().reset()
+        self._id_blocks = []
+
+
+class CladeAbundanceObserver(GroupAbundanceObserver):
+
+    # Clades are those of the phylogeny as it stands at each observation. Branching clades never change once formed,
+    # but coalescing clades depend on subtree heights, so they can differ from clades computed afterwards on the final phylogeny.
+
+    def __init__(self, phylogeny_depth, mode='branchings', name=None, every='step', relative_abundance=False):
+        super().__init__(name=(f"clade_abundances_d{phylogeny_depth}" if name is None else name), every=every, relative_abundance=relative_abundance)
+        self.phylogeny_depth = phylogeny_depth
+        self.mode = mode
+
+    def get_group_abundances(self, system, N):
+        clade_ids, clade_abds, clade_counts = system.type_set.phylogeny_index.get_clade_sums(N, self.phylogeny_depth, mode=self.mode)
+        return (clade_ids, clade_abds)
+
+
+class FunctionalGroupAbundanceObserver(GroupAbundanceObserver):
+
+    def __init__(self, trait_subset, name=None, every='step', relative_abundance=False):
+        super().__init__(name=("functional_group_abundances" if name is None else name), every=every, relative_abundance=relative_abundance)
+        self.trait_subset = list(trait_subset)
+
+    def get_group_abundances(self, system, N):
+        group_ids, membership = cg.get_functional_group_membership(system, self.trait_subset)
+        return (group_ids, np.asarray(membership @ N))
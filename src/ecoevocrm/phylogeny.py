@@ -0,0 +1,114 @@
+import numpy as np
+
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+class PhylogenyIndex():
+
+    # Flat index over a lineage tree with lineage ids of the form '1.2.1' (as assigned by TypeSet.add_type_to_phylogeny()).
+    # Nodes are stored in depth-first preorder, so that every subtree occupies a contiguous interval [start, end) of positions;
+    # the abundance of any clade is then a difference of prefix sums over the phylogenetically ordered abundances.
+
+    def __init__(self, lineage_ids, phylogeny=None):
+        self.lineage_ids = list(lineage_ids)
+        #----------------------------------
+        # Collect all nodes (including ancestors of the given lineages that may not be types themselves):
+        node_keys = set()
+        def add_lineage(lineage_id):
+            parts = tuple(int(p) for p in lineage_id.split('.'))
+            for l in range(1, len(parts)+1):
+                node_keys.add(parts[:l])
+        for lineage_id in self.lineage_ids:
+            add_lineage(lineage_id)
+        stack = list((phylogeny or {}).items())
+        while(len(stack) > 0):
+            node_id, subtree = stack.pop()
+            add_lineage(node_id)
+            stack.extend(subtree.items())
+        #----------------------------------
+        # Lexicographic order of the integer id tuples is a depth-first preorder of the tree:
+        node_keys = sorted(node_keys)
+        self.num_nodes = len(node_keys)
+        self.node_ids  = ['.'.join(str(p) for p in key) for key in node_keys]
+        self.node_positions = {node_id: pos for pos, node_id in enumerate(self.node_ids)}
+        #----------------------------------
+        self.depths  = np.array([len(key) for key in node_keys], dtype=int)
+        self.parents = np.full(self.num_nodes, -1, dtype=int)
+        self.ends    = np.empty(self.num_nodes, dtype=int)
+        self.heights = np.zeros(self.num_nodes, dtype=int)
+        open_nodes = []
+        for pos, key in enumerate(node_keys):
+            while(len(open_nodes) > 0 and len(node_keys[open_nodes[-1]]) >= len(key)):
+                self.ends[open_nodes.pop()] = pos
+            if(len(open_nodes) > 0):
+                self.parents[pos] = open_nodes[-1]
+            open_nodes.append(pos)
+        for pos in open_nodes:
+            self.ends[pos] = self.num_nodes
+        for pos in range(self.num_nodes-1, -1, -1):
+            if(self.parents[pos] >= 0):
+                self.heights[self.parents[pos]] = max(self.heights[self.parents[pos]], self.heights[pos]+1)
+        #----------------------------------
+        self.type_positions = np.array([self.node_positions[lineage_id] for lineage_id in self.lineage_ids], dtype=int)
+        self.types_share_nodes = (len(np.unique(self.type_positions)) < len(self.type_positions))
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_clades(self, phylogeny_depth, mode='branchings'):
+        # Returns (clade_ids, starts, ends): the clades partitioning the tree at the given depth, as preorder intervals.
+        #   'branchings':  clades are the subtrees rooted at depth phylogeny_depth; shallower nodes are singleton clades.
+        #   'coalescings': collapsing childless subtrees phylogeny_depth times turns nodes of height <= phylogeny_depth into leaves;
+        #                  clades are the subtrees of these collapsed leaves, and remaining interior nodes are singleton clades.
+        if(mode == 'branchings'):
+            if(phylogeny_depth <= 0):
+                return ([''], np.array([0]), np.array([self.num_nodes]))
+            is_clade   = (self.depths <= phylogeny_depth)
+            is_subtree = (self.depths == phylogeny_depth)
+        elif(mode == 'coalescings'):
+            parent_heights = np.where(self.parents >= 0, self.heights[self.parents], np.iinfo(int).max)
+            is_subtree = (self.heights <= phylogeny_depth) & (parent_heights > phylogeny_depth)
+            is_clade   = is_subtree | (self.heights > phylogeny_depth)
+        else:
+            utils.error(f"Error in PhylogenyIndex.get_clades(): mode '{mode}' is not recognized.")
+        #----------------------------------
+        clade_starts = np.where(is_clade)[0]
+        clade_ends   = np.where(is_subtree[clade_starts], self.ends[clade_starts], clade_starts+1)
+        return ([self.node_ids[pos] for pos in clade_starts], clade_starts, clade_ends)
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_type_clade_indices(self, clade_starts):
+        # Index of the clade (from get_clades()) containing each type
+        return np.searchsorted(clade_starts, self.type_positions, side='right') - 1
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def get_prefix_sums(self, type_values):
+        # type_values: array of shape (num_types,) or (num_types, num_times), in type order;
+        # returns prefix sums over the preorder-ordered node values, of shape (num_nodes+1,) or (num_nodes+1, num_times)
+        type_values = np.asarray(type_values)
+        node_values = np.zeros((self.num_nodes,) + type_values.shape[1:], dtype=type_values.dtype)
+        if(self.types_share_nodes):
+            np.add.at(node_values, self.type_positions, type_values)
+        else:
+            node_values[self.type_positions] = type_values
+        prefix_sums = np.zeros((self.num_nodes+1,) + type_values.shape[1:], dtype=type_values.dtype)
+        np.cumsum(node_values, axis=0, out=prefix_sums[1:])
+        return prefix_sums
+
+    def get_clade_sums(self, type_values, phylogeny_depth, mode='branchings'):
+        # Returns (clade_ids, clade_sums, clade_counts), where clade_counts are the numbers of types with nonzero value in each clade
+        clade_ids, clade_starts, clade_ends = self.get_clades(phylogeny_depth, mode=mode)
+        type_values   = np.asarray(type_values)
+        prefix_sums   = self.get_prefix_sums(type_values)
+        prefix_counts = self.get_prefix_sums((type_values != 0).astype(int))
+        clade_sums    = prefix_sums[clade_ends] - prefix_sums[clade_starts]
+        clade_counts  = prefix_counts[clade_ends] - prefix_counts[clade_starts]
+        # Differences of prefix sums are not exactly zero for empty clades in floating point:
+        clade_sums[clade_counts == 0] = 0
+        return (clade_ids, clade_sums, clade_counts)
@@ -0,0 +1,196 @@
+import bisect
+import copy
+import numpy as np
+
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Time-varying resource influx (ResourceSet rho in the RESOURCE_INFLUX_TEMPORAL mode) as a schedule that is cheap to evaluate
+# on every RHS evaluation. Called at a scalar time, a schedule returns the influx rates of all resources, shape (num_resources,);
+# called at an array of times, shape (num_resources, len(t)) (as scipy.interpolate.interp1d(t, values) with values of shape
+# (num_resources, len(t))). Forms:
+#   'constant': piecewise constant, values[:, i] on [t[i], t[i+1])
+#   'linear':   piecewise linear between the knots t
+#   'analytic': a function fn(t) returning the influx rates (for scalar t, shape (num_resources,); for array t, (num_resources, len(t)))
+# Outside of the knots, piecewise schedules hold their first/last values.
+#
+# Solver times are nearly monotone, so scalar evaluations first check the bracket of the previous call (and the next one)
+# before bisecting, which makes evaluation O(1) amortized.
+#
+# breakpoints are times at which the schedule is discontinuous; run() ends integration epochs at breakpoints so that the solver
+# never steps over a discontinuity. Every breakpoint costs an epoch, so by default they are only used for sparse step changes:
+# the knots of 'constant' schedules at which the values change, if there are at most MAX_DEFAULT_BREAKPOINTS of them (dense
+# tables, e.g., sampled noise, are left to the solver's step size control). Pass breakpoints='knots' to use all such knots,
+# or explicit breakpoint times.
+
+class ResourceSchedule():
+
+    KINDS = ['constant', 'linear', 'analytic']
+
+    MAX_DEFAULT_BREAKPOINTS = 100
+
+    def __init__(self, t=None, values=None, kind='linear', fn=None, breakpoints=None):
+        if(kind not in ResourceSchedule.KINDS):
+            utils.error(f"Error in ResourceSchedule __init__(): kind must be one of {ResourceSchedule.KINDS} (given '{kind}').")
+        self.kind = kind
+        self.fn   = fn
+        #----------------------------------
+        if(kind == 'analytic'):
+            if(fn is None):
+                utils.error("Error in ResourceSchedule __init__(): An analytic schedule requires a function fn(t).")
+            self.knots  = None
+            self.values = None
+            self.num_resources = len(np.ravel(fn(0.0)))
+            self.breakpoints   = np.sort(np.asarray(breakpoints, dtype=float)) if breakpoints is not None else np.array([])
+        else:
+            if(t is None or values is None):
+                utils.error(f"Error in ResourceSchedule __init__(): A {kind} schedule requires knots t and values.")
+            self.knots  = np.asarray(t, dtype=float).ravel()
+            self.values = np.atleast_2d(np.asarray(values, dtype=float))
+            if(self.values.shape[1] != len(self.knots)):
+                utils.error(f"Error in ResourceSchedule __init__(): values must have shape (num_resources, len(t)) (given {self.values.shape} for {len(self.knots)} knots).")
+            if(np.any(np.diff(self.knots) <= 0)):
+                utils.error("Error in ResourceSchedule __init__(): Knots t must be strictly increasing.")
+            self.num_resources = self.values.shape[0]
+            self.breakpoints   = self.get_default_breakpoints(breakpoints) if breakpoints is None or isinstance(breakpoints, str) else np.sort(np.asarray(breakpoints, dtype=float))
+            # Per-interval values and slopes as rows (contiguous per interval), so that a scalar evaluation is a single multiply-add:
+            self._rows   = np.ascontiguousarray(self.values.T)
+            self._slopes = np.ascontiguousarray((np.diff(self.values, axis=1)/np.diff(self.knots)).T) if kind == 'linear' and len(self.knots) > 1 else np.zeros((max(len(self.knots)-1, 0), self.num_resources))
+            self._knots_list = self.knots.tolist()
+            # (evaluations return rows of these arrays, which must not be modified in place by callers)
+            self._rows.flags.writeable   = False
+            self._slopes.flags.writeable = False
+        self._bracket = 0
+
+    def get_default_breakpoints(self, breakpoints=None):
+        # Knots of a 'constant' schedule at which its values change (if at most MAX_DEFAULT_BREAKPOINTS, or all of them with breakpoints='knots'):
+        if(breakpoints not in [None, 'knots']):
+            utils.error(f"Error in ResourceSchedule __init__(): breakpoints must be None, 'knots', or breakpoint times (given '{breakpoints}').")
+        if(self.kind != 'constant'):
+            return np.array([])
+        step_knots = self.knots[1:][np.any(np.diff(self.values, axis=1) != 0, axis=0)]
+        return step_knots if breakpoints == 'knots' or len(step_knots) <= ResourceSchedule.MAX_DEFAULT_BREAKPOINTS else np.array([])
+
+    @staticmethod
+    def from_interp1d(interp):
+        # Equivalent schedule for a scipy.interpolate.interp1d of kind 'linear', 'previous', or 'zero' interpolating along the last axis (else None).
+        # Only interp1ds that raise outside of their knots (bounds_error) are converted: the schedule holds its end values there,
+        # which agrees with the interp1d wherever the interp1d was defined, but not with its extrapolation or fill values.
+        kind = getattr(interp, '_kind', None)
+        if(kind not in ['linear', 'previous', 'zero'] or interp.axis not in [-1, interp.y.ndim-1] or not interp.bounds_error):
+            return None
+        values = np.asarray(interp.y, dtype=float)
+        return ResourceSchedule(t=interp.x, values=(values if values.ndim == 2 else values[np.newaxis, :]), kind=('linear' if kind == 'linear' else 'constant'))
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def __call__(self, t):
+        if(self.kind == 'analytic'):
+            return self.fn(t)
+        elif(np.ndim(t) == 0):
+            return self.evaluate_scalar(t)
+        else:
+            return self.evaluate_array(t)
+
+    def get_bracket(self, t):
+        # Index i of the knot interval [t[i], t[i+1]) containing t (clamped to the first/last interval)
+        knots = self._knots_list
+        i = self._bracket
+        if(knots[i] <= t):
+            if(i+1 >= len(knots)-1 or t < knots[i+1]):
+                return i
+            if(i+2 >= len(knots)-1 or t < knots[i+2]):
+                self._bracket = i+1
+                return i+1
+        i = min(max(bisect.bisect_right(knots, t) - 1, 0), max(len(knots)-2, 0))
+        self._bracket = i
+        return i
+
+    def evaluate_scalar(self, t):
+        if(t <= self.knots[0]):
+            return self._rows[0]
+        elif(t >= self.knots[-1]):
+            return self._rows[-1]
+        i = self.get_bracket(t)
+        if(self.kind == 'constant'):
+            return self._rows[i]
+        return self._rows[i] + (t - self.knots[i])*self._slopes[i]
+
+    def evaluate_array(self, t):
+        t = np.asarray(t, dtype=float)
+        if(self.kind == 'constant'):
+            indices = np.clip(np.searchsorted(self.knots, t, side='right') - 1, 0, len(self.knots)-1)
+            return self.values[:, indices]
+        return np.array([np.interp(t, self.knots, values_i) for values_i in self.values])
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def next_breakpoint(self, t):
+        # The first breakpoint after time t (np.inf if none)
+        i = np.searchsorted(self.breakpoints, t, side='right')
+        return self.breakpoints[i] if i < len(self.breakpoints) else np.inf
+
+    def get_hash_contents(self):
+        # Contents identifying the schedule (for ResultCache keys; excludes the bracket cache):
+        fn_code = (self.fn.__qualname__, self.fn.__code__.co_code, repr(self.fn.__code__.co_consts)) if self.fn is not None and hasattr(self.fn, '__code__') else None
+        return ['ResourceSchedule', self.kind, self.knots, self.values, self.breakpoints, fn_code]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Piecewise linear schedule whose knots and values are produced on demand, as the evaluation time advances, by an iterator of
+# consecutive segments (values, t) with values of shape (num_resources, len(t)) (e.g., utils.brownian_series_chunks()).
+# Only the latest keep_segments segments are held, so arbitrarily long environments are never tabulated in full. Evaluation
+# at times before the held segments is an error (e.g., get_fitness_series() over past times); past the end of the stream,
+# the last values are held. Clones of the schedule (and of the systems holding it) share the stream.
+
+class StreamingResourceSchedule(ResourceSchedule):
+
+    def __init__(self, segments, keep_segments=2):
+        self.segments      = iter(segments)
+        self.keep_segments = max(keep_segments, 1)
+        self.exhausted     = False
+        self.num_dropped   = 0
+        values, t = next(self.segments)
+        self._held = [(np.asarray(t, dtype=float).ravel(), np.atleast_2d(np.asarray(values, dtype=float)))]
+        super().__init__(t=self._held[0][0], values=self._held[0][1], kind='linear')
+
+    def extend(self, t):
+        # Pull segments from the stream until the held knots reach time t:
+        while(t > self._held[-1][0][-1] and not self.exhausted):
+            try:
+                values, t_segment = next(self.segments)
+            except StopIteration:
+                self.exhausted = True
+                break
+            self._held.append((np.asarray(t_segment, dtype=float).ravel(), np.atleast_2d(np.asarray(values, dtype=float))))
+            if(len(self._held) > self.keep_segments):
+                self._held.pop(0)
+                self.num_dropped += 1
+        ResourceSchedule.__init__(self, t=np.concatenate([t_segment for t_segment, _ in self._held]), values=np.concatenate([values for _, values in self._held], axis=1), kind='linear')
+
+    def check_time(self, t):
+        if(np.max(t) > self.knots[-1] and not self.exhausted):
+            self.extend(np.max(t))
+        if(np.min(t) < self.knots[0] and self.num_dropped > 0):
+            utils.error(f"Error in StreamingResourceSchedule: Time {np.min(t)} precedes the held segments of the stream (which start at {self.knots[0]}).")
+
+    def evaluate_scalar(self, t):
+        if(t > self._knots_list[-1] or t < self._knots_list[0]):
+            self.check_time(t)
+        return super().evaluate_scalar(t)
+
+    def evaluate_array(self, t):
+        self.check_time(t)
+        return super().evaluate_array(t)
+
+    def get_hash_contents(self):
+        # (the rest of the stream is not known in advance, so only the held segments identify the schedule)
+        return ['StreamingResourceSchedule', self.num_dropped] + super().get_hash_contents()[1:]
+
+    def __deepcopy__(self, memo):
+        # Streams (e.g., generators) cannot be copied, so copies share the stream:
+        clone = copy.copy(self)
+        clone._held = list(self._held)
+        return clone
@@ -1,6 +1,8 @@
 import numpy as np
 import scipy.interpolate
+import copy
 
+from ecoevocrm.resource_schedule import ResourceSchedule
 import ecoevocrm.utils as utils
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -11,6 +13,7 @@ class ResourceSet():
     # Define Class constants:
     RESOURCE_INFLUX_CONSTANT          = 0
     RESOURCE_INFLUX_TEMPORAL          = 1
+    RESOURCE_INFLUX_SINUSOID          = 2
 
     def __init__(self, num_resources = None,
                        rho           = 0,
@@ -19,13 +22,16 @@ class ResourceSet():
                        alpha         = 0,
                        theta         = 0,
                        phi           = 0,
-                       D             = None ):
+                       D             = None,
+                       influx_steps_per_period = 10 ):
 
         # Determine the number of resources:
         if(isinstance(rho, (list, np.ndarray))):
             self.num_resources = len(rho)
+        elif(isinstance(rho, ResourceSchedule)):
+            self.num_resources = rho.num_resources
         elif(isinstance(rho, scipy.interpolate.interpolate.interp1d)):
-            self.num_resources = len(rho(0).ravel())
+            self.num_resources = len(rho(rho.x[0]).ravel())
         elif(isinstance(omega, (list, np.ndarray))):
             self.num_resources = len(omega)
         elif(isinstance(tau, (list, np.ndarray))):
@@ -36,19 +42,17 @@ class ResourceSet():
             utils.error("Error in ResourceSet __init__(): Number of resources must be specified by providing a) a value for num_resources, or b) lists for rho/tau/omega.")
 
         # Initialize resource parameters:
-        if(isinstance(rho, scipy.interpolate.interpolate.interp1d)):
-            self._rho = rho
-            self.resource_influx_mode = ResourceSet.RESOURCE_INFLUX_TEMPORAL
-        else:
-            self._rho = utils.reshape(rho, shape=(1, self.num_resources)).ravel()
-            self.resource_influx_mode = ResourceSet.RESOURCE_INFLUX_CONSTANT
+        self.rho   = rho
         self.tau   = utils.reshape(tau,   shape=(1, self.num_resources)).ravel()
         self.omega = utils.reshape(omega, shape=(1, self.num_resources)).ravel()
-        self.alpha = utils.reshape(alpha, shape=(1, self.num_resources)).ravel()
-        self.theta = utils.reshape(theta, shape=(1, self.num_resources)).ravel()
-        self.phi   = utils.reshape(phi,   shape=(1, self.num_resources)).ravel()
+        self.alpha = self.reshape_sinusoid_param(alpha)
+        self.theta = self.reshape_sinusoid_param(theta)
+        self.phi   = self.reshape_sinusoid_param(phi)
         self.D     = utils.reshape(D,     shape=(self.num_resources, self.num_resources)) if D is not None else None
 
+        # Number of solver steps per period of the fastest sinusoidal influx component (see max_step_hint):
+        self.influx_steps_per_period = influx_steps_per_period
+
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -80,18 +84,90 @@ class ResourceSet():
 
     @rho.setter
     def rho(self, vals):
+        # Time-varying influx is given as a ResourceSchedule or an interp1d (linear and piecewise constant interp1ds without
+        # fill values are converted to equivalent ResourceSchedules, which are much cheaper to evaluate on every RHS evaluation):
         if(isinstance(vals, scipy.interpolate.interpolate.interp1d)):
+            schedule  = ResourceSchedule.from_interp1d(vals)
+            self._rho = schedule if schedule is not None else vals
+        elif(isinstance(vals, ResourceSchedule)):
             self._rho = vals
-            self.resource_influx_mode = ResourceSet.RESOURCE_INFLUX_TEMPORAL
         else:
             self._rho = utils.reshape(vals, shape=(1, self.num_resources)).ravel()
-            self.resource_influx_mode = ResourceSet.RESOURCE_INFLUX_CONSTANT
+
+    @property
+    def resource_influx_mode(self):
+        # Time-varying rho (RESOURCE_INFLUX_TEMPORAL), or constant rho plus the (sum of) sinusoids
+        #   alpha * sin(theta * (t + phi))
+        # evaluated in closed form (RESOURCE_INFLUX_SINUSOID; alpha/theta/phi are ignored with a time-varying rho):
+        if(callable(self._rho)):
+            return ResourceSet.RESOURCE_INFLUX_TEMPORAL
+        elif(np.any(self.alpha != 0) and np.any(self.theta != 0)):
+            return ResourceSet.RESOURCE_INFLUX_SINUSOID
+        else:
+            return ResourceSet.RESOURCE_INFLUX_CONSTANT
+
+    def reshape_sinusoid_param(self, vals):
+        # Sinusoidal influx parameters are given per resource, shape (num_resources,), or, for a sum of sinusoids,
+        # per component and resource, shape (num_components, num_resources):
+        if(np.ndim(vals) == 2 and np.shape(vals)[0] > 1):
+            return utils.reshape(np.asarray(vals, dtype=float), shape=(np.shape(vals)[0], self.num_resources))
+        return utils.reshape(vals, shape=(1, self.num_resources)).ravel()
+
+
+    @staticmethod
+    def resource_influx(rho, t, resource_influx_mode, alpha=None, theta=None, phi=None):
+        # Influx rates of the resources at (scalar) time t, shape (num_resources,):
+        if(resource_influx_mode == ResourceSet.RESOURCE_INFLUX_TEMPORAL):
+            return np.ravel(rho(t))
+        elif(resource_influx_mode == ResourceSet.RESOURCE_INFLUX_SINUSOID):
+            sinusoids = alpha*np.sin(theta*(t + phi))
+            return rho + (sinusoids if sinusoids.ndim == 1 else sinusoids.sum(axis=0))
+        else:
+            return rho
+
+    def get_influx_series(self, t):
+        # Influx rates of the resources at an array of times t, shape (num_resources, len(t)):
+        t = np.asarray(t, dtype=float).ravel()
+        resource_influx_mode = self.resource_influx_mode
+        if(resource_influx_mode == ResourceSet.RESOURCE_INFLUX_TEMPORAL):
+            return np.reshape(self._rho(t), (self.num_resources, len(t)))
+        elif(resource_influx_mode == ResourceSet.RESOURCE_INFLUX_SINUSOID):
+            alpha, theta, phi = np.broadcast_arrays(*[np.atleast_2d(param)[:, :, np.newaxis] for param in [self.alpha, self.theta, self.phi]])
+            return self._rho[:, np.newaxis] + (alpha*np.sin(theta*(t + phi))).sum(axis=0)
+        else:
+            return np.broadcast_to(self._rho[:, np.newaxis], (self.num_resources, len(t)))
+
+    @property
+    def max_step_hint(self):
+        # Largest solver step that resolves the sinusoidal influx (influx_steps_per_period steps per period of its fastest component; np.inf for other influx modes):
+        if(self.resource_influx_mode != ResourceSet.RESOURCE_INFLUX_SINUSOID):
+            return np.inf
+        alpha, theta = np.broadcast_arrays(self.alpha, self.theta)
+        frequencies  = np.abs(theta[alpha != 0])
+        return 2*np.pi/frequencies.max()/self.influx_steps_per_period if np.any(frequencies > 0) else np.inf
+
+    def next_breakpoint(self, t):
+        # The first time after t at which the resource influx is discontinuous (np.inf if none):
+        return self._rho.next_breakpoint(t) if isinstance(self._rho, ResourceSchedule) else np.inf
+
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def clone(self, share_params=True):
+        clone = copy.copy(self)
+        #----------------------------------
+        for attr in ['_rho', 'tau', 'omega', 'alpha', 'theta', 'phi', 'D']:
+            setattr(clone, attr, utils.copy_array(getattr(self, attr), share_data=share_params))
+        if(not share_params and self.resource_influx_mode == ResourceSet.RESOURCE_INFLUX_TEMPORAL):
+            clone._rho = copy.deepcopy(self._rho)
+        #----------------------------------
+        return clone
 
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def get_resource_id(self, index):
-        return hash((self._rho[index], self.tau[index], self.omega[index], self.alpha[index], self.theta[index], self.phi[index]))
+        return hash((self._rho[index], self.tau[index], self.omega[index], *np.ravel(self.alpha[..., index]), *np.ravel(self.theta[..., index]), *np.ravel(self.phi[..., index])))
 
 
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -114,9 +190,9 @@ class ResourceSet():
                     'rho':           self._rho[resource_idx],
                     'tau':           self.tau[resource_idx],
                     'omega':         self.omega[resource_idx],
-                    'alpha':         self.alpha[resource_idx],
-                    'theta':         self.theta[resource_idx],
-                    'phi':           self.phi[resource_idx],
+                    'alpha':         self.alpha[..., resource_idx],
+                    'theta':         self.theta[..., resource_idx],
+                    'phi':           self.phi[..., resource_idx],
                     'M':             self.M[resource_idx,:]}
             # return (1, self._rho[resource_idx], self.tau[resource_idx], self.omega[resource_idx], self.D[resource_idx, :])
         
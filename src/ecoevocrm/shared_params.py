@@ -0,0 +1,150 @@
+import copy
+import concurrent.futures
+from multiprocessing import shared_memory
+import numpy as np
+
+import ecoevocrm.utils as utils
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# Arrays smaller than this many bytes are cheaper to pickle than to share:
+DEFAULT_MIN_SHARED_BYTES = 1 << 16
+
+# Segments attached in this process, by name (kept open for as long as views into them may be in use):
+_attached_segments = {}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class SharedArrayRef():
+
+    # Lightweight, picklable reference to an array published in a shared memory segment.
+
+    def __init__(self, name, shape, dtype):
+        self.name  = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def attach(self):
+        segment = _attached_segments.get(self.name)
+        if(segment is None):
+            try:
+                segment = shared_memory.SharedMemory(name=self.name, track=False)
+            except TypeError: # track argument only available in Python >= 3.13
+                segment = shared_memory.SharedMemory(name=self.name)
+            _attached_segments[self.name] = segment
+        #----------------------------------
+        arr = np.ndarray(shape=self.shape, dtype=self.dtype, buffer=segment.buf)
+        arr.flags.writeable = False
+        return arr
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def is_ecoevocrm_object(obj):
+    return hasattr(obj, '__dict__') and type(obj).__module__.startswith('ecoevocrm')
+
+
+def attach(obj):
+    # Returns obj with every SharedArrayRef within it (recursively through dicts, lists, tuples, ExpandableArrays,
+    # and TypeSet/ResourceSet/ConsumerResourceSystem attributes) replaced by a read-only zero-copy view of the shared array:
+    if(isinstance(obj, SharedArrayRef)):
+        return obj.attach()
+    elif(isinstance(obj, utils.ExpandableArray)):
+        if(not isinstance(obj._arr, SharedArrayRef)):
+            return obj
+        attached = copy.copy(obj)
+        attached._arr   = obj._arr.attach()
+        attached._alloc = attached._arr.shape
+        return attached
+    elif(isinstance(obj, dict)):
+        return {key: attach(val) for key, val in obj.items()}
+    elif(isinstance(obj, (list, tuple))):
+        return type(obj)(attach(val) for val in obj)
+    elif(is_ecoevocrm_object(obj)):
+        attached = copy.copy(obj)
+        attached.__dict__.update({attr: attach(val) for attr, val in obj.__dict__.items()})
+        return attached
+    else:
+        return obj
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class SharedParams():
+
+    # Publishes the large arrays of parameter objects into shared memory once, so that worker processes can attach to them
+    # zero-copy instead of receiving a pickled copy with every task. Segments are unlinked when close() is called
+    # (or on exiting the context manager).
+
+    def __init__(self, min_bytes=DEFAULT_MIN_SHARED_BYTES):
+        self.min_bytes = min_bytes
+        self._segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def nbytes(self):
+        return sum(segment.size for segment in self._segments)
+
+    def publish_array(self, arr):
+        arr     = np.ascontiguousarray(arr)
+        segment = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(shape=arr.shape, dtype=arr.dtype, buffer=segment.buf)[...] = arr
+        self._segments.append(segment)
+        return SharedArrayRef(name=segment.name, shape=arr.shape, dtype=arr.dtype.str)
+
+    def publish(self, obj):
+        # Returns a copy of obj in which every ndarray of at least min_bytes (recursively through dicts, lists, tuples,
+        # ExpandableArrays, and TypeSet/ResourceSet/ConsumerResourceSystem attributes) is replaced by a SharedArrayRef;
+        # obj itself is not modified. Pass the returned object to workers and call attach() on it there.
+        if(isinstance(obj, np.ndarray)):
+            return self.publish_array(obj) if(obj.dtype != object and obj.nbytes >= self.min_bytes) else obj
+        elif(isinstance(obj, utils.ExpandableArray)):
+            if(obj.values.nbytes < self.min_bytes):
+                return obj
+            published = copy.copy(obj)
+            published._arr   = self.publish_array(obj.values)
+            published._alloc = obj.shape
+            return published
+        elif(isinstance(obj, dict)):
+            return {key: self.publish(val) for key, val in obj.items()}
+        elif(isinstance(obj, (list, tuple))):
+            return type(obj)(self.publish(val) for val in obj)
+        elif(is_ecoevocrm_object(obj)):
+            published = copy.copy(obj)
+            published.__dict__.update({attr: self.publish(val) for attr, val in obj.__dict__.items()})
+            return published
+        else:
+            return obj
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self._segments = []
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class SharedParamsPool(concurrent.futures.ProcessPoolExecutor):
+
+    # ProcessPoolExecutor that owns a SharedParams: objects passed as shared_objs are published once at construction
+    # (available as pool.shared[name], to be passed to tasks and attach()'ed there) and the shared memory segments
+    # are unlinked when the pool is shut down.
+
+    def __init__(self, max_workers=None, shared_objs=None, min_bytes=DEFAULT_MIN_SHARED_BYTES, **pool_args):
+        super().__init__(max_workers=max_workers, **pool_args)
+        self.shared_params = SharedParams(min_bytes=min_bytes)
+        self.shared        = {name: self.shared_params.publish(obj) for name, obj in (shared_objs or {}).items()}
+
+    def shutdown(self, wait=True, **shutdown_args):
+        super().shutdown(wait=wait, **shutdown_args)
+        self.shared_params.close()
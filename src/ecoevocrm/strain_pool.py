@@ -1,6 +1,7 @@
 import numpy as np
 import copy
 
+from ecoevocrm.resource_schedule import StreamingResourceSchedule
 import ecoevocrm.utils as utils
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -15,7 +16,7 @@ def get_perturbed_systems(orig_system, reps=50, perturbation_args=None):
 	#----------------------------------
 	perturbed_systems = []
 	for rep in range(reps):
-		perturbed_system = copy.deepcopy(orig_system).perturb(param=perturbation_args['param'], dist=perturbation_args['dist'], args=perturbation_args['args'], mode=perturbation_args['mode'], element_wise=perturbation_args['element_wise'])
+		perturbed_system = orig_system.clone().perturb(param=perturbation_args['param'], dist=perturbation_args['dist'], args=perturbation_args['args'], mode=perturbation_args['mode'], element_wise=perturbation_args['element_wise'])
 		perturbed_systems.append(perturbed_system)
 	#----------------------------------
 	return perturbed_systems
@@ -37,7 +38,7 @@ def generate_strain_pool(orig_system, rep_communities=50, perturbation_args=None
 		print(f"Running dynamics for perturbation community {i+1}/{len(perturbed_systems)}\r", end="")
 		perturbed_system.run(T=run_T)
 	#----------------------------------
-	strain_pool = copy.deepcopy(orig_system)
+	strain_pool = orig_system.clone()
 	strain_pool.set_type_abundance(type_index=range(strain_pool.type_set.num_types), abundance=0.0)
 	for i in range(len(perturbed_systems)):
 		strain_pool.combine(perturbed_systems[i])
@@ -48,7 +49,9 @@ def generate_strain_pool(orig_system, rep_communities=50, perturbation_args=None
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def generate_strain_pool_brownian_envs(orig_system, rep_communities=50, brownian_args={}, run_T=1e6):
+def generate_strain_pool_brownian_envs(orig_system, rep_communities=50, brownian_args={}, run_T=1e6, stream_envs=False, chunk_length=10000):
+	# With stream_envs, each community's environment is generated in segments of chunk_length time points as its run advances
+	# (utils.brownian_series_chunks(), with a random state of its own) rather than tabulated over all of T in advance.
 	brownian_params = {	
 						'T': 3*run_T,
 						'dt': 1000,
@@ -64,17 +67,20 @@ def generate_strain_pool_brownian_envs(orig_system, rep_communities=50, brownian
 	#----------------------------------
 	rep_systems = []
 	for i in range(rep_communities):
-		rho = utils.brownian_series(T=brownian_params['T'], dt=brownian_params['dt'], L=brownian_params['L'], 
-									lamda=brownian_params['lamda'], eta_mean=brownian_params['eta_mean'], eta_std=brownian_params['eta_std'], 
-									k=brownian_params['k'], y0=brownian_params['y0'], v0=brownian_params['v0'], return_interp=True)
-		rep_system = copy.deepcopy(orig_system)
+		if(stream_envs):
+			rho = StreamingResourceSchedule(utils.brownian_series_chunks(**brownian_params, chunk_length=chunk_length, rng=np.random.RandomState(np.random.randint(2**31))))
+		else:
+			rho = utils.brownian_series(T=brownian_params['T'], dt=brownian_params['dt'], L=brownian_params['L'], 
+										lamda=brownian_params['lamda'], eta_mean=brownian_params['eta_mean'], eta_std=brownian_params['eta_std'], 
+										k=brownian_params['k'], y0=brownian_params['y0'], v0=brownian_params['v0'], return_interp=True)
+		rep_system = orig_system.clone()
 		rep_system.resource_set.rho = rho
 		# print(rep_system.rho)
 		print(f"Running dynamics for rep community {i+1}/{rep_communities}")#\r", end="")
 		rep_system.run(T=run_T)
 		rep_systems.append(rep_system)
 	#----------------------------------
-	strain_pool = copy.deepcopy(orig_system)
+	strain_pool = orig_system.clone()
 	strain_pool.set_type_abundance(type_index=range(strain_pool.type_set.num_types), abundance=0.0)
 	for i in range(rep_communities):
 		strain_pool.combine(rep_systems[i])
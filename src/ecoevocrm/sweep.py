@@ -0,0 +1,234 @@
+import os
+import csv
+import json
+import pickle
+import time
+import hashlib
+import itertools
+import concurrent.futures
+import numpy as np
+
+from ecoevocrm.consumer_resource_system import *
+from ecoevocrm.shared_params import SharedParamsPool
+import ecoevocrm.shared_params as shared_params
+import ecoevocrm.utils as utils
+from ecoevocrm.cache import update_hash
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+def grid_design(param_grid):
+    # param_grid: {param_name: list of values}; returns the list of all combinations as param dicts
+    param_names = list(param_grid.keys())
+    param_vals  = [param_grid[name] if isinstance(param_grid[name], (list, tuple, np.ndarray, range)) else [param_grid[name]] for name in param_names]
+    #----------------------------------
+    return [dict(zip(param_names, vals)) for vals in itertools.product(*param_vals)]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def random_design(param_ranges, num_points, seed=None):
+    # param_ranges: {param_name: spec}, where spec is one of
+    #   (low, high)               -> uniform on [low, high]
+    #   ('log', low, high)        -> log-uniform on [low, high]
+    #   list of values            -> uniform choice among the values
+    #   callable(rng)             -> value returned by the callable
+    rng = np.random.default_rng(seed)
+    #----------------------------------
+    design = []
+    for i in range(num_points):
+        point = {}
+        for name, spec in param_ranges.items():
+            if(callable(spec)):
+                point[name] = spec(rng)
+            elif(isinstance(spec, tuple) and len(spec) == 3 and spec[0] == 'log'):
+                point[name] = float(np.exp(rng.uniform(np.log(spec[1]), np.log(spec[2]))))
+            elif(isinstance(spec, tuple) and len(spec) == 2):
+                point[name] = float(rng.uniform(spec[0], spec[1]))
+            elif(isinstance(spec, (list, np.ndarray))):
+                point[name] = spec[rng.integers(len(spec))]
+            else:
+                utils.error(f"Error in random_design(): range specification for parameter '{name}' is not recognized.")
+        design.append(point)
+    #----------------------------------
+    return design
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def encode_param_val(val):
+    if(isinstance(val, np.ndarray)):
+        return val.tolist()
+    elif(isinstance(val, np.generic)):
+        return val.item()
+    elif(isinstance(val, (list, tuple))):
+        return [encode_param_val(v) for v in val]
+    elif(isinstance(val, (int, float, str, bool)) or val is None):
+        return val
+    else:
+        return repr(val)
+
+
+def get_point_id(point, system_args=None, T=None, run_args=None, seed=None):
+    # The id covers everything that determines a point's outcome (its params, the base system args, T, the run args,
+    # and its seed), so that resuming into a results file from a sweep with different settings does not skip points:
+    hasher = hashlib.sha1(json.dumps({name: encode_param_val(val) for name, val in point.items()}, sort_keys=True).encode())
+    try:
+        update_hash(hasher, {'system_args': system_args, 'T': T, 'run_args': run_args, 'seed': seed})
+    except (pickle.PicklingError, AttributeError, TypeError):
+        utils.error("Error in get_point_id(): sweep system_args and run_args must be picklable (e.g., no lambdas) to identify sweep points.")
+    return hasher.hexdigest()[:16]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def default_sweep_metrics(system):
+    abundances     = system.N[system.N > 0]
+    rel_abundances = abundances/np.sum(abundances) if len(abundances) > 0 else abundances
+    #----------------------------------
+    return {'t_final':               system.t,
+            'biomass':               system.biomass,
+            'num_types':             system.num_types,
+            'num_extant_types':      len(abundances),
+            'num_extant_phenotypes': int(system.get_num_extant_phenotypes(t_index=[-1])[0]),
+            'mean_num_traits':       float(system.get_num_traits_per_type(summary_stat='mean')) if len(abundances) > 0 else 0.0,
+            'shannon_diversity':     float(-np.sum(rel_abundances * np.log(rel_abundances)))}
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def build_sweep_system(point, system_args):
+    # Point params override the base system args; any ConsumerResourceSystem, TypeSet, or ResourceSet parameter
+    # accepted by the ConsumerResourceSystem constructor may be swept:
+    return ConsumerResourceSystem(**{**system_args, **point})
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def run_sweep_point(point, point_id, point_index, system_args, T, run_args, metrics, system_builder, seed, trajectory_file=None):
+    row = {'point_id': point_id, 'point_index': point_index}
+    row.update({name: (json.dumps(encode_param_val(val)) if isinstance(val, (list, tuple, np.ndarray)) else encode_param_val(val)) for name, val in point.items()})
+    #----------------------------------
+    try:
+        np.random.seed(seed)
+        #------------------------------
+        # Large arrays in the system args may have been published to shared memory by the parent process:
+        system_args = shared_params.attach(system_args)
+        #------------------------------
+        system = system_builder(point, system_args)
+        #------------------------------
+        t_start = time.time()
+        system.run(T=T, **run_args)
+        row['run_walltime'] = time.time() - t_start
+        #------------------------------
+        row.update(metrics(system))
+        row['status'] = 'ok'
+        #------------------------------
+        if(trajectory_file is not None):
+            np.savez_compressed(trajectory_file, t_series=system.t_series, N_series=system.N_series, R_series=system.R_series,
+                                                 sigma=system.type_set.sigma, lineage_ids=np.array(system.type_set.lineage_ids))
+    except (Exception, SystemExit) as err:
+        # utils.error() exits; catch that too so that one failed point does not take down the whole sweep
+        row['status'] = f"error: {type(err).__name__} {err}"
+    #----------------------------------
+    return row
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def get_completed_point_ids(results_file):
+    if(not os.path.exists(results_file)):
+        return set()
+    with open(results_file, 'r', newline='') as f:
+        return set(row['point_id'] for row in csv.DictReader(f) if row.get('status') == 'ok')
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def run_sweep(design, system_args, T, results_file, run_args=None, metrics=None, system_builder=None,
+              num_workers=None, save_trajectories=None, trajectories_dir=None, seed=0, resume=True):
+    # design:            list of param dicts (e.g., from grid_design() or random_design())
+    # system_args:       base ConsumerResourceSystem constructor args shared by all points
+    # results_file:      CSV file to which one row of summary metrics is appended as each point finishes
+    # save_trajectories: None, list of point indices, or callable(point) -> bool; full trajectories are saved only for these points
+    # resume:            if True, points already completed in an existing results file are skipped
+    run_args       = {} if run_args is None else run_args
+    metrics        = default_sweep_metrics if metrics is None else metrics
+    system_builder = build_sweep_system if system_builder is None else system_builder
+    num_workers    = os.cpu_count() if num_workers is None else num_workers
+    #----------------------------------
+    if(trajectories_dir is None):
+        trajectories_dir = os.path.splitext(results_file)[0] + '_trajectories'
+    #----------------------------------
+    point_ids       = [get_point_id(point, system_args, T, run_args, seed+i) for i, point in enumerate(design)]
+    completed_ids   = get_completed_point_ids(results_file) if resume else set()
+    pending_indices = [i for i, point_id in enumerate(point_ids) if point_id not in completed_ids]
+    #----------------------------------
+    def get_trajectory_file(i):
+        keep = (save_trajectories(design[i]) if callable(save_trajectories) else (i in save_trajectories)) if save_trajectories is not None else False
+        if(keep):
+            os.makedirs(trajectories_dir, exist_ok=True)
+            return os.path.join(trajectories_dir, f"{point_ids[i]}.npz")
+        return None
+    #----------------------------------
+    if(os.path.exists(results_file) and not resume):
+        os.remove(results_file)
+    fieldnames = None
+    if(os.path.exists(results_file)):
+        with open(results_file, 'r', newline='') as f:
+            fieldnames = csv.DictReader(f).fieldnames
+    #----------------------------------
+    def write_row(row):
+        nonlocal fieldnames
+        if(fieldnames is None):
+            fieldnames = list(row.keys())
+            with open(results_file, 'w', newline='') as f:
+                csv.DictWriter(f, fieldnames=fieldnames).writeheader()
+        elif(any(key not in fieldnames for key in row)):
+            # Row has columns not yet in the file (e.g., first successful point after failed ones); rewrite with extended header:
+            with open(results_file, 'r', newline='') as f:
+                prev_rows = list(csv.DictReader(f))
+            fieldnames = fieldnames + [key for key in row if key not in fieldnames]
+            with open(results_file, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(prev_rows)
+        with open(results_file, 'a', newline='') as f:
+            csv.DictWriter(f, fieldnames=fieldnames).writerow(row)
+    #----------------------------------
+    def get_point_args(system_args):
+        return [(design[i], point_ids[i], i, system_args, T, run_args, metrics, system_builder, seed+i, get_trajectory_file(i)) for i in pending_indices]
+    #----------------------------------
+    if(num_workers <= 1):
+        for args in get_point_args(system_args):
+            write_row(run_sweep_point(*args))
+    else:
+        # Large system arg arrays (e.g., sigma, J, D) are published to shared memory once rather than pickled for every point:
+        with SharedParamsPool(max_workers=num_workers, shared_objs={'system_args': system_args}) as pool:
+            futures = [pool.submit(run_sweep_point, *args) for args in get_point_args(pool.shared['system_args'])]
+            for future in concurrent.futures.as_completed(futures):
+                write_row(future.result())
+    #----------------------------------
+    return load_sweep_results(results_file, point_ids=point_ids)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def load_sweep_results(results_file, point_ids=None):
+    # point_ids: if given, only rows for these points are returned (e.g., leaving out rows from earlier sweeps with other settings)
+    import pandas as pd
+    if(not os.path.exists(results_file)):
+        # Nothing has been written yet (e.g., an empty design):
+        return pd.DataFrame(columns=['point_id', 'point_index', 'status'])
+    results = pd.read_csv(results_file)
+    if(point_ids is not None):
+        results = results[results['point_id'].isin(point_ids)]
+    # Points that errored and were re-run on resume appear more than once; keep the latest row for each point:
+    return results.drop_duplicates(subset='point_id', keep='last').sort_values('point_index').reset_index(drop=True)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def load_sweep_trajectory(trajectories_dir, point_id):
+    # point_id: the id of the point as listed in the sweep results (see get_point_id())
+    return dict(np.load(os.path.join(trajectories_dir, f"{point_id}.npz")))
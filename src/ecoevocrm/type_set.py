@@ -1,5 +1,7 @@
 import numpy as np
+import copy
 
+from ecoevocrm.phylogeny import PhylogenyIndex
 import ecoevocrm.utils as utils
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -88,6 +90,8 @@ class TypeSet():
         
         self.phylogeny = {}
 
+        self._phylogeny_index = None
+
         self.binarize_traits_chi_cost_terms = binarize_traits_chi_cost_terms
         self.binarize_traits_J_cost_terms   = binarize_traits_J_cost_terms
                 
@@ -236,6 +240,14 @@ class TypeSet():
             self._lineage_ids = lineage_ids
         return self._lineage_ids
 
+    @property
+    def phylogeny_index(self):
+        # Rebuilt only when the types' lineages have changed (types added or reordered) since it was last built
+        # (getattr: type sets pickled before this attribute existed do not have it):
+        if(getattr(self, '_phylogeny_index', None) is None or self._phylogeny_index.lineage_ids != self.lineage_ids):
+            self._phylogeny_index = PhylogenyIndex(self.lineage_ids, self.phylogeny)
+        return self._phylogeny_index
+
     
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -309,7 +321,7 @@ class TypeSet():
         mu_mut    = np.repeat(self.mu,    repeats=self.sigma.shape[1], axis=0) if self.mu.ndim == 2    else self.mu
         #----------------------------------
         if(self._mean_xi_mut > 0):
-            xi_mut = self.xi.ravel() - np.random.exponential(scale=self._mean_xi_mut, size=sigma_mut.shape[0])
+            xi_mut = np.repeat(self.xi.ravel(), repeats=self.sigma.shape[1]) - np.random.exponential(scale=self._mean_xi_mut, size=sigma_mut.shape[0])
         else:
             xi_mut = np.repeat(self.xi, repeats=self.sigma.shape[1], axis=0) if self.xi.ndim == 2 else self.xi
         #----------------------------------
@@ -406,14 +418,15 @@ class TypeSet():
         if(type_idx is None):
             utils.error(f"Error in TypeSet get_type(): A type index or type id must be given.")
         #----------------------------------
+        # (per-type trait params are kept 2d, else a single type's row would be taken as a per-trait vector shared by all types)
         return TypeSet(sigma  = self.sigma[type_idx], 
-                        beta  = self.beta[type_idx]  if self.beta.ndim == 2   else self.beta, 
-                        kappa = self.kappa[type_idx] if self.kappa.ndim == 2  else self.kappa, 
-                        eta   = self.eta[type_idx]   if self.eta.ndim == 2    else self.eta, 
-                        lamda = self.lamda[type_idx] if self.lamda.ndim == 2  else self.lamda, 
+                        beta  = np.atleast_2d(self.beta[type_idx])  if self.beta.ndim == 2   else self.beta, 
+                        kappa = np.atleast_2d(self.kappa[type_idx]) if self.kappa.ndim == 2  else self.kappa, 
+                        eta   = np.atleast_2d(self.eta[type_idx])   if self.eta.ndim == 2    else self.eta, 
+                        lamda = np.atleast_2d(self.lamda[type_idx]) if self.lamda.ndim == 2  else self.lamda, 
                         gamma = self.gamma[type_idx] if self.gamma.ndim == 2  else self.gamma, 
                         xi    = self.xi[type_idx]    if self.xi.ndim == 2     else self.xi, 
-                        chi   = self.chi[type_idx]   if self.chi.ndim == 2    else self.chi, 
+                        chi   = np.atleast_2d(self.chi[type_idx])   if self.chi.ndim == 2    else self.chi, 
                         mu    = self.mu[type_idx]    if self.mu.ndim == 2     else self.mu,
                         J     = self.J,
                         mean_xi_mut = self._mean_xi_mut,
@@ -484,6 +497,24 @@ class TypeSet():
         return
 
 
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    def clone(self, share_params=True):
+        clone = copy.copy(self)
+        #----------------------------------
+        # Parameter arrays are shared copy-on-write (or copied outright if share_params is False):
+        for attr in ['_sigma', '_beta', '_kappa', '_eta', '_lamda', '_gamma', '_xi', '_chi', '_mu', '_J', '_energy_costs', '_mutant_indices']:
+            setattr(clone, attr, utils.copy_array(getattr(self, attr), share_data=share_params))
+        #----------------------------------
+        # Mutable metadata is always copied:
+        clone._type_ids       = list(self._type_ids) if self._type_ids is not None else None
+        clone._parent_indices = list(self._parent_indices)
+        clone._lineage_ids    = list(self._lineage_ids) if self._lineage_ids is not None else None
+        clone.phylogeny       = copy.deepcopy(self.phylogeny)
+        #----------------------------------
+        return clone
+
+
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     def get_lineage_depths(self):
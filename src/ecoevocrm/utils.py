@@ -1,10 +1,14 @@
 import sys
+import copy
 import numpy as np
 import scipy
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
+# Arrays smaller than this are copied rather than shared by copy_array() and ExpandableArray.copy() with share_data:
+SHARED_ARRAY_MIN_NBYTES = 2**16
+
 class ExpandableArray():
 
     def __init__(self, arr, alloc_shape=None, dtype='float64', default_expand_factor=2):
@@ -45,6 +49,7 @@ class ExpandableArray():
 
     def add(self, added_arr, axis=0):
         added_arr = np.atleast_2d(added_arr)
+        self.make_writeable()
         if(axis == 0):
             while(self._shape[0] + added_arr.shape[0] > self._alloc[0]):
                 self.expand_alloc(new_alloc = (int(self._alloc[0]*self.default_expand_factor), self._alloc[1]))
@@ -63,103 +68,128 @@ class ExpandableArray():
         return self
 
     def reorder(self, order):
+        self.make_writeable()
         self._arr[:self._shape[0], :self._shape[1]] = self.values[order]
         return self
 
+    def copy(self, share_data=False):
+        arr_copy = copy.copy(self)
+        if(share_data and self.values.nbytes >= SHARED_ARRAY_MIN_NBYTES):
+            # The copy references this array's data without copying it (as a read-only view). Both arrays are marked as shared
+            # so that whichever one is modified first (add/reorder) makes its own copy of the data (copy-on-write);
+            # this array itself stays writeable:
+            self._shared = True
+            arr_copy._arr = self.values.view()
+            arr_copy._arr.flags.writeable = False
+            arr_copy._shared = True
+        else:
+            arr_copy._arr = self.values.copy()
+            arr_copy._shared = False
+        arr_copy._alloc = self._shape
+        return arr_copy
+
+    def make_writeable(self):
+        if(not self._arr.flags.writeable or getattr(self, '_shared', False)):
+            arr = np.empty(shape=self._alloc, dtype=self.dtype)
+            arr[:self._shape[0], :self._shape[1]] = self.values
+            self._arr = arr
+            self._shared = False
+        return self
+
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def random_matrix(shape, mode, args={}, sparsity=0.0, symmetric=False, triangular=False, diagonal=None, ordered=False, scale_range=None, seed=None):
-    if(seed is not None):
-        np.random.seed(seed)
+def random_matrix(shape, mode, args={}, sparsity=0.0, symmetric=False, triangular=False, diagonal=None, ordered=False, scale_range=None, seed=None, rng=None, num_matrices=None):
+    # Random values are drawn from rng (a numpy Generator or RandomState, e.g., one per parallel worker for reproducible draws),
+    # or from the global numpy random state (seeded with seed, if given) by default.
+    # With num_matrices, returns num_matrices independent matrices at once (shape (num_matrices,) + shape), with all values drawn together.
+    if(rng is None):
+        if(seed is not None):
+            np.random.seed(seed)
+        rng = np.random
+    num_rows, num_cols = shape
+    batch_shape = (1 if num_matrices is None else num_matrices,) + tuple(shape)
     #--------------------------------
     # Generate random values according to one of the following random models:
     #--------------------------------
     if(mode == 'bernoulli'):
-        M = np.random.binomial(n=1, p=(args['p'] if 'p' in args else 0.5), size=shape )
+        M = rng.binomial(n=1, p=(args['p'] if 'p' in args else 0.5), size=batch_shape )
     elif(mode == 'binomial'):
-        M = np.random.binomial(n=(args['n'] if 'n' in args else 1), p=(args['p'] if 'p' in args else 0.5), size=shape )
+        M = rng.binomial(n=(args['n'] if 'n' in args else 1), p=(args['p'] if 'p' in args else 0.5), size=batch_shape )
     elif(mode == 'uniform'):
-        M = np.random.uniform(low=(args['min'] if 'min' in args else 0), high=(args['max'] if 'max' in args else 1), size=shape )
+        M = rng.uniform(low=(args['min'] if 'min' in args else 0), high=(args['max'] if 'max' in args else 1), size=batch_shape )
     elif(mode == 'normal'):
-        M = np.random.normal(loc=(args['mean'] if 'mean' in args else 0), scale=(args['std'] if 'std' in args else 1), size=shape )
+        M = rng.normal(loc=(args['mean'] if 'mean' in args else 0), scale=(args['std'] if 'std' in args else 1), size=batch_shape )
     elif(mode == 'logistic'):
-        M = np.random.logistic(loc=(args['mean'] if 'mean' in args else 0), scale=(args['scale'] if 'scale' in args else 1), size=shape )
+        M = rng.logistic(loc=(args['mean'] if 'mean' in args else 0), scale=(args['scale'] if 'scale' in args else 1), size=batch_shape )
     elif(mode == 'exponential'):
-        M = np.random.exponential(scale=(args['scale'] if 'scale' in args else 1), size=shape )
-        M *=  np.random.choice([1, -1], size=shape)
+        M = rng.exponential(scale=(args['scale'] if 'scale' in args else 1), size=batch_shape )
+        M *=  rng.choice([1, -1], size=batch_shape)
     elif(mode == 'gamma'):
-        mean     = (args['mean'] if 'mean' in args else 0)
-        coeffvar = (args['coeffvar'] if 'coeffvar' in args else args['cv'] if 'cv' in args else 0)
-        scale    = mean * coeffvar ** 2
-        shape    = mean / scale
-        np.random.gamma(scale=scale, shape=shape, size=shape)
+        mean     = (args['mean'] if 'mean' in args else 1)
+        coeffvar = (args['coeffvar'] if 'coeffvar' in args else args['cv'] if 'cv' in args else 1)
+        M = rng.gamma(shape=1/coeffvar**2, scale=mean*coeffvar**2, size=batch_shape)
     elif(mode == 'tikhonov_sigmoid'):
         J_0    = args['J_0'] if 'J_0' in args else 0.2
         n_star = args['n_star'] if 'n_star' in args else 10
         delta  = args['delta'] if 'delta' in args else 3
-        M = np.zeros(shape=shape)
-        for i, j in np.ndindex(M.shape):
-            if(i >= j):
-                continue
-            M[i,j] = np.random.normal( loc=0, scale=J_0*(1/(1 + np.exp((max(i,j) - n_star)/delta))) )
+        # Entries above the diagonal (row by row), with std decaying in max(i, j) = j:
+        i, j = np.triu_indices(num_rows, k=1, m=num_cols)
+        M = np.zeros(shape=batch_shape)
+        M[:, i, j] = rng.normal(loc=0, scale=J_0*(1/(1 + np.exp((j - n_star)/delta))), size=(batch_shape[0], len(i)))
     elif(mode == 'tikhonov_sigmoid_ordered'):
         J_0    = args['J_0'] if 'J_0' in args else 0.4
         n_star = args['n_star'] if 'n_star' in args else 10
         delta  = args['delta'] if 'delta' in args else 5
-        M = np.zeros(shape=shape)
-        vals   = [np.random.choice([1, -1]) * J_0/(1 + np.exp((i - n_star)/delta)) for i in range(int((M.shape[0]*M.shape[0]-M.shape[0])/2))]
-        c = 0
-        for j in range(M.shape[1]):
-            for i in range(M.shape[0]):
-                if(j <= i):
-                    continue
-                else:
-                    M[i,j] = vals[c] * (1 if (j+i)%2==0 else -1)
-                    c += 1
+        # Entries above the diagonal (column by column), with magnitudes decaying in that order and checkerboard signs:
+        j, i = np.tril_indices(num_cols, k=-1, m=num_rows)
+        c    = np.arange(len(i))
+        M = np.zeros(shape=batch_shape)
+        M[:, i, j] = rng.choice([1, -1], size=(batch_shape[0], len(i))) * J_0/(1 + np.exp((c - n_star)/delta)) * np.where((i + j)%2 == 0, 1, -1)
     elif(mode == 'choice'):
-        M = np.random.choice(a=args['a'], size=shape)
+        M = rng.choice(a=args['a'], size=batch_shape)
     else:
         error(f"Error in random_matrix(): generator mode '{mode}' is not recognized.")
     #--------------------------------
+    if((symmetric or triangular) and num_rows != num_cols):
+        error(f"Error in random_matrix(): shape {shape} is not square and cannot be made {'symmetric' if symmetric else 'triangular'}.")
+    for k in range(batch_shape[0]):
+        M[k] = random_matrix_structure(M[k], rng, sparsity, symmetric, triangular, diagonal, ordered, scale_range)
+    #--------------------------------
+    return M[0] if num_matrices is None else M
+
+
+def random_matrix_structure(M, rng, sparsity=0.0, symmetric=False, triangular=False, diagonal=None, ordered=False, scale_range=None):
+    # Applies the structure options of random_matrix() to a matrix of random values:
+    #--------------------------------
     # Apply specified sparsity:
-    # num_ = range(len(np.triu_indices(M.shape[0], k=0 if diagonal is not None else 1)[0])) if triangular else M.shape[1]*M.shape[0]
-    # zeroed_indices = np.random.choice(, replace=False, size=int(M.shape[1]*M.shape[0]*sparsity))        
     if(triangular):
         active_indices   = np.triu_indices(M.shape[0], k=0 if diagonal is not None and diagonal != 0 else 1)
-        zeroed_indices_i = np.random.choice(range(len(active_indices[0])), replace=False, size=int(len(active_indices[0])*sparsity))
+        zeroed_indices_i = rng.choice(range(len(active_indices[0])), replace=False, size=int(len(active_indices[0])*sparsity))
         zeroed_indices   = (active_indices[0][zeroed_indices_i], active_indices[1][zeroed_indices_i])
         M[zeroed_indices] = 0
     else:
-        zeroed_indices = np.random.choice(M.shape[1]*M.shape[0], replace=False, size=int(M.shape[1]*M.shape[0]*sparsity))
+        zeroed_indices = rng.choice(M.shape[1]*M.shape[0], replace=False, size=int(M.shape[1]*M.shape[0]*sparsity))
         M[np.unravel_index(zeroed_indices, M.shape)] = 0 
     #--------------------------------
     # Make symmetric, if applicable:
     if(symmetric):
-        if(shape[0] != shape[1]):
-            error(f"Error in random_matrix(): shape {shape} is not square and cannot be made symmetric.")
         M = np.tril(M) + np.triu(M.T, 1)
     #--------------------------------
     # Make triangular, if applicable:
     if(triangular):
-        if(shape[0] != shape[1]):
-            error(f"Error in random_matrix(): shape {shape} is not square and cannot be made triangular.")
-        M *= 1 - np.tri(*M.shape, k=-1, dtype=np.bool)
+        M *= 1 - np.tri(*M.shape, k=-1, dtype=bool)
     #--------------------------------
     # Set diagonal, if applicable:
     if(diagonal is not None):
         np.fill_diagonal(M, diagonal)
     #--------------------------------
-    # Make ordered, if applicable:
+    # Make ordered, if applicable (nonzero values placed column by column in order of decreasing magnitude):
     if(ordered):
-        vals = sorted(M[M!=0], key=abs, reverse=True)
-        c = 0
-        for j in range(M.shape[1]):
-            for i in range(M.shape[0]):
-                if(M[i,j] != 0):
-                    M[i,j] = vals[c]
-                    c += 1
+        vals = M[M != 0]
+        j, i = np.nonzero(M.T)
+        M[i, j] = vals[np.argsort(-np.abs(vals), kind='stable')]
     #--------------------------------
     # Scale values to desired range, if applicable:
     if(scale_range is not None):
@@ -203,6 +233,25 @@ def binary_combinations(num_digits, exclude_all_zeros=False):
     return combos if not exclude_all_zeros else combos[1:, :]
 
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def copy_array(arr, share_data=False):
+    # With share_data, arrays of at least SHARED_ARRAY_MIN_NBYTES are shared with the copy as a read-only view (smaller
+    # arrays are cheap to copy, and are copied); the original array is left as it is, so in-place modifications of it
+    # (other than through ExpandableArray methods, which copy on write) are seen by the copy.
+    if(isinstance(arr, ExpandableArray)):
+        return arr.copy(share_data=share_data)
+    elif(isinstance(arr, np.ndarray)):
+        if(share_data and arr.nbytes >= SHARED_ARRAY_MIN_NBYTES):
+            view = arr.view()
+            view.flags.writeable = False
+            return view
+        else:
+            return arr.copy()
+    else:
+        return arr
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 def treat_as_list(val):
@@ -267,6 +316,9 @@ def sinusoid_series(T, dt=0.1, amplitude=1, period=2*np.pi, phase=0, shift=0, L=
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 def brownian_series(T, dt=1, lamda=1, eta_mean=0, eta_std=1, k=0, y0=0, v0=0, L=1, return_interp=True):
+    # Damped, spring-anchored random walk of L independent channels:
+    #   v[t+1] = v[t] + (-lamda*v[t] + eta[t] - k*(y[t]-y0))*dt,   y[t+1] = y[t] + v[t+1]*dt,   eta[t] ~ Normal(eta_mean, eta_std)
+    # All noise is drawn at once (in the same order as drawing it per channel and time step) and the recurrence is solved by brownian_filter().
     lamda    = reshape(lamda, shape=(1, L)).ravel()
     eta_mean = reshape(eta_mean, shape=(1, L)).ravel()
     eta_std  = reshape(eta_std, shape=(1, L)).ravel()
@@ -276,19 +328,9 @@ def brownian_series(T, dt=1, lamda=1, eta_mean=0, eta_std=1, k=0, y0=0, v0=0, L=
     #--------------------------------
     t_series  = np.arange(0, T+dt, step=dt)
     #--------------------------------
-    y_series = []
-    for i in range(L):
-        y    = np.zeros_like(t_series)
-        y[0] = y0[i]
-        v      = np.zeros_like(t_series)
-        v[0]   = v0[i]
-        for t in range(len(t_series)-1):
-            dv     = -lamda[i]*v[t] + np.random.normal(eta_mean[i], eta_std[i]) - k[i]*(y[t]-y[0])
-            v[t+1] = v[t] + dv*dt
-            dy     = v[t+1]
-            y[t+1] = y[t] + dy*dt
-        y_series.append(y)
-    y_series = np.array(y_series)
+    noise       = eta_mean[:, np.newaxis] + eta_std[:, np.newaxis]*np.random.standard_normal(size=(L, len(t_series)-1))
+    y_series, _ = brownian_filter(noise, dt, lamda, k, brownian_initial_state(dt, lamda, v0))
+    y_series    = y0[:, np.newaxis] + np.concatenate([np.zeros((L, 1)), y_series], axis=1)
     #--------------------------------
     if(return_interp):
         import scipy.interpolate
@@ -297,6 +339,54 @@ def brownian_series(T, dt=1, lamda=1, eta_mean=0, eta_std=1, k=0, y0=0, v0=0, L=
         return y_series, t_series
 
 
+def brownian_series_chunks(T=np.inf, dt=1, lamda=1, eta_mean=0, eta_std=1, k=0, y0=0, v0=0, L=1, chunk_length=10000, rng=None):
+    # Generator of consecutive segments (y_series, t_series) of chunk_length time points of the brownian_series() process,
+    # until time T (indefinitely for T=np.inf), e.g., for a StreamingResourceSchedule (see resource_schedule.py).
+    # Noise is drawn segment by segment, so for L > 1 the values differ from brownian_series() with the same random state.
+    # Noise is drawn from rng (a numpy RandomState or Generator; the global numpy random state by default); segments that are
+    # generated while a system runs should have their own rng, so that their draws do not interleave with those of the run.
+    rng      = np.random if rng is None else rng
+    lamda    = reshape(lamda, shape=(1, L)).ravel()
+    eta_mean = reshape(eta_mean, shape=(1, L)).ravel()
+    eta_std  = reshape(eta_std, shape=(1, L)).ravel()
+    k        = reshape(k, shape=(1, L)).ravel()
+    y0       = reshape(y0, shape=(1, L)).ravel()
+    v0       = reshape(v0, shape=(1, L)).ravel()
+    #--------------------------------
+    num_points = len(np.arange(0, T+dt, step=dt)) if np.isfinite(T) else np.inf
+    state      = brownian_initial_state(dt, lamda, v0)
+    i = 0
+    while(i < num_points):
+        j = int(min(i + chunk_length, num_points))
+        noise = eta_mean[:, np.newaxis] + eta_std[:, np.newaxis]*rng.standard_normal(size=(L, j - max(i, 1)))
+        y_series, state = brownian_filter(noise, dt, lamda, k, state)
+        if(i == 0):
+            y_series = np.concatenate([np.zeros((L, 1)), y_series], axis=1)
+        yield (y0[:, np.newaxis] + y_series, np.arange(i, j)*dt)
+        i = j
+
+
+def brownian_initial_state(dt, lamda, v0):
+    # brownian_filter() state at time 0 (displacement 0 and velocity v0):
+    return np.stack([(1 - lamda*dt)*dt*v0, np.zeros_like(v0)], axis=1)
+
+
+def brownian_filter(noise, dt, lamda, k, state):
+    # Solves the brownian_series() recurrence for the displacements u = y - y0 given noise of shape (L, n),
+    # as the second-order linear filter (one scipy.signal.lfilter call per distinct set of channel coefficients)
+    #   u[t+1] = (2 - lamda*dt - k*dt**2)*u[t] - (1 - lamda*dt)*u[t-1] + dt**2*eta[t]
+    # Returns the next n displacements with shape (L, n), and the filter state to continue from (shape (L, 2)).
+    import scipy.signal
+    coeffs = np.stack([2 - lamda*dt - k*dt**2, 1 - lamda*dt], axis=1)
+    unique_coeffs, channel_groups = np.unique(coeffs, axis=0, return_inverse=True)
+    u          = np.empty(noise.shape)
+    next_state = np.empty(state.shape)
+    for g, (c1, c2) in enumerate(unique_coeffs):
+        channels = (channel_groups.ravel() == g)
+        u[channels], next_state[channels] = scipy.signal.lfilter([1.0], [1.0, -c1, c2], dt**2 * noise[channels], axis=-1, zi=state[channels])
+    return (u, next_state)
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 # def get_boltzmann_temp_for_entropy(energy, target_entropy):
@@ -239,6 +239,43 @@ def Lstar_types_plot(system, ax=None, figsize=(7,5)):
         sns.despine()
 
 
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def Lstar_types_series_plot(system, ax=None, Lstar='all', t_max=None, t_downsample='default', log_x_axis=False, palette='viridis'):
+    import ecoevocrm.coarse_graining as cg
+
+    if(t_max is None):
+        t_max = np.max(system.t_series)
+
+    if(t_downsample == 'default'):
+        t_downsample = max(int((len(system.t_series)//10000)+1), 1)
+    elif(t_downsample is None):
+        t_downsample = 1
+
+    t_indices = np.where(system.t_series <= t_max)[0][::t_downsample]
+    Lstar_vals, num_Lstar_types = cg.get_Lstar_types_series(system, Lstar=Lstar, t_index=t_indices)
+
+    ax = plt.axes() if ax is None else ax
+
+    colors = sns.color_palette(palette, len(Lstar_vals))
+
+    with sns.axes_style('white'):
+        for i, Lstar_val in enumerate(Lstar_vals):
+            ax.plot(system.t_series[t_indices], num_Lstar_types[i], color=colors[i], label=f"L$^*$={Lstar_val}")
+
+        ax.set_ylim(ymin=0)
+        ax.set_xlabel('time')
+        ax.set_ylabel('number of unique types')
+        ax.legend()
+
+        if(log_x_axis):
+            ax.set_xscale('log')
+
+        sns.despine()
+
+    return ax
+
+
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 def strainpool_plot(strainpool_system, type_weights, rank_cutoff=None, weight_cutoff=None, figsize=(10, 10), type_colors=None):